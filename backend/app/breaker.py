@@ -0,0 +1,159 @@
+import logging
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Deque, Dict, Tuple
+
+from .deadline import DeadlineExceeded
+from .logs import log_event
+from .settings import get_settings
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(RuntimeError):
+    def __init__(self, name: str, retry_after: float):
+        super().__init__(f"circuit '{name}' is open, retry after {retry_after:.0f}s")
+        self.name = name
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """Per-process breaker: opens when the failure rate over `window_seconds` reaches `failure_rate`
+    (with at least `min_calls` calls), rejects calls for `open_seconds`, then lets one probe through."""
+
+    def __init__(
+        self,
+        name: str,
+        failure_rate: float = 0.5,
+        min_calls: int = 5,
+        window_seconds: float = 60.0,
+        open_seconds: float = 30.0,
+    ):
+        self.name = name
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.window_seconds = window_seconds
+        self.open_seconds = open_seconds
+        self.state = CLOSED
+        self._calls: Deque[Tuple[float, bool]] = deque()
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self.rejected = 0
+        self.opened = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.min_calls > 0 and self.failure_rate > 0
+
+    def retry_after(self) -> float:
+        return max(0.0, self._opened_at + self.open_seconds - time.monotonic())
+
+    def allow(self) -> bool:
+        if not self.enabled or self.state == CLOSED:
+            return True
+        if self.state == OPEN:
+            if self.retry_after() > 0:
+                self.rejected += 1
+                return False
+            self.state = HALF_OPEN
+        # Half-open: a single probe decides whether to close or re-open.
+        if self._probe_in_flight:
+            self.rejected += 1
+            return False
+        self._probe_in_flight = True
+        return True
+
+    def record_success(self) -> None:
+        if self.state == HALF_OPEN:
+            self._close()
+            return
+        self._record(True)
+
+    def record_failure(self) -> None:
+        if self.state == HALF_OPEN:
+            self._open()
+            return
+        self._record(False)
+        failures = sum(1 for _, ok in self._calls if not ok)
+        if len(self._calls) >= self.min_calls and failures / len(self._calls) >= self.failure_rate:
+            self._open()
+
+    @asynccontextmanager
+    async def guard(self) -> AsyncIterator[None]:
+        if not self.allow():
+            raise CircuitOpenError(self.name, self.retry_after())
+        try:
+            yield
+        except DeadlineExceeded:
+            # Our own budget ran out; that says nothing about the dependency.
+            self._probe_in_flight = False
+            raise
+        except Exception:
+            self.record_failure()
+            raise
+        except BaseException:
+            # Cancelled calls say nothing about the dependency either; just free the probe slot.
+            self._probe_in_flight = False
+            raise
+        else:
+            self.record_success()
+
+    def stats(self) -> dict:
+        self._trim(time.monotonic())
+        failures = sum(1 for _, ok in self._calls if not ok)
+        return {
+            "state": self.state,
+            "calls": len(self._calls),
+            "failures": failures,
+            "rejected": self.rejected,
+            "opened": self.opened,
+            "retry_after": round(self.retry_after(), 1) if self.state != CLOSED else 0,
+        }
+
+    def _record(self, ok: bool) -> None:
+        now = time.monotonic()
+        self._calls.append((now, ok))
+        self._trim(now)
+
+    def _trim(self, now: float) -> None:
+        while self._calls and self._calls[0][0] <= now - self.window_seconds:
+            self._calls.popleft()
+
+    def _open(self) -> None:
+        self.state = OPEN
+        self._opened_at = time.monotonic()
+        self._probe_in_flight = False
+        self._calls.clear()
+        self.opened += 1
+        log_event("circuit_open", level=logging.WARNING, circuit=self.name, open_seconds=self.open_seconds)
+
+    def _close(self) -> None:
+        self.state = CLOSED
+        self._probe_in_flight = False
+        self._calls.clear()
+        log_event("circuit_closed", circuit=self.name)
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+
+
+def get_breaker(name: str) -> CircuitBreaker:
+    breaker = _breakers.get(name)
+    if breaker is None:
+        settings = get_settings()
+        breaker = CircuitBreaker(
+            name,
+            failure_rate=settings.breaker_failure_rate,
+            min_calls=settings.breaker_min_calls,
+            window_seconds=settings.breaker_window_seconds,
+            open_seconds=settings.breaker_open_seconds,
+        )
+        _breakers[name] = breaker
+    return breaker
+
+
+def breaker_stats() -> Dict[str, dict]:
+    return {name: breaker.stats() for name, breaker in _breakers.items()}
@@ -0,0 +1,66 @@
+import time
+from collections import OrderedDict
+from typing import Any, Hashable
+
+MISSING = object()
+
+
+class TTLCache:
+    """Small in-process LRU cache whose entries also expire after ttl_seconds."""
+
+    def __init__(self, maxsize: int = 1024, ttl_seconds: float = 30.0):
+        self.maxsize = maxsize
+        self.ttl_seconds = ttl_seconds
+        self._data: "OrderedDict[Hashable, tuple[float, Any]]" = OrderedDict()
+        # Bumped by invalidate(); clear() and evicting a counter bump _epoch instead.
+        self._generations: "OrderedDict[Hashable, int]" = OrderedDict()
+        self._epoch = 0
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.maxsize > 0 and self.ttl_seconds > 0
+
+    def get(self, key: Hashable) -> Any:
+        entry = self._data.get(key)
+        if entry is None:
+            self.misses += 1
+            return MISSING
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self._data[key]
+            self.misses += 1
+            return MISSING
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def generation(self, key: Hashable) -> tuple[int, int]:
+        return self._epoch, self._generations.get(key, 0)
+
+    def set(self, key: Hashable, value: Any, generation: tuple[int, int] | None = None) -> None:
+        # Pass the generation() read before loading value: if the key was invalidated while it
+        # was loading, the value may predate the change and is not stored.
+        if not self.enabled or (generation is not None and generation != self.generation(key)):
+            return
+        self._data[key] = (time.monotonic() + self.ttl_seconds, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def invalidate(self, key: Hashable) -> None:
+        self._data.pop(key, None)
+        self._generations[key] = self._generations.get(key, 0) + 1
+        self._generations.move_to_end(key)
+        if len(self._generations) > max(self.maxsize, 1):
+            self._generations.popitem(last=False)
+            self._epoch += 1
+
+    def clear(self) -> None:
+        self._data.clear()
+        self._generations.clear()
+        self._epoch += 1
+
+    def stats(self) -> dict:
+        return {"size": len(self._data), "hits": self.hits, "misses": self.misses}
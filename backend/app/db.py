@@ -1,16 +1,42 @@
 import os
+import copy
 import json
+import logging
 import secrets
 import hashlib
 import asyncio
+import struct
 import sys
-from typing import Any, Dict, Optional
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from .cache import MISSING, TTLCache
+from .logs import log_event
+from .ratelimit import RateLimitedError
 
 try:
     from psycopg_pool import AsyncConnectionPool
 except Exception:  # pragma: no cover
     AsyncConnectionPool = None
 
+try:
+    from psycopg import AsyncConnection
+except Exception:  # pragma: no cover
+    AsyncConnection = None
+
+try:
+    import zstandard
+except Exception:  # pragma: no cover
+    zstandard = None
+
+try:
+    from psycopg.adapt import Dumper
+    from psycopg.pq import Format
+    from psycopg.types import TypeInfo
+except Exception:  # pragma: no cover
+    Dumper = None
+
 # Psycopg async on Windows requires Selector event loop.
 if sys.platform == "win32":
     asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
@@ -18,14 +44,87 @@ if sys.platform == "win32":
 DATABASE_URL = os.getenv('DATABASE_URL', '')
 JWT_SECRET = os.getenv('JWT_SECRET', '')
 JWT_EXPIRE_MINUTES = int(os.getenv('JWT_EXPIRE_MINUTES', '10080'))
+DB_POOL_MIN_SIZE = int(os.getenv('DB_POOL_MIN_SIZE', '1'))
+DB_POOL_MAX_SIZE = int(os.getenv('DB_POOL_MAX_SIZE', '10'))
+DB_POOL_TIMEOUT_SECONDS = float(os.getenv('DB_POOL_TIMEOUT_SECONDS', '10'))
+DB_POOL_MAX_LIFETIME_SECONDS = float(os.getenv('DB_POOL_MAX_LIFETIME_SECONDS', '1800'))
+DB_POOL_MAX_IDLE_SECONDS = float(os.getenv('DB_POOL_MAX_IDLE_SECONDS', '300'))
+# Column type of stored embeddings: "vector" (float32) or "halfvec" (float16, pgvector >= 0.7).
+EMBEDDING_STORAGE = "halfvec" if os.getenv('EMBEDDING_STORAGE', 'vector').strip().lower() == "halfvec" else "vector"
+# How new plan_results rows are stored: "zstd" (compressed bytea, needs the zstandard package;
+# falls back to JSONB without it) or "none" (JSONB).
+PLAN_RESULT_COMPRESSION = os.getenv('PLAN_RESULT_COMPRESSION', 'zstd').strip().lower()
+PLAN_RESULT_ZSTD_LEVEL = int(os.getenv('PLAN_RESULT_ZSTD_LEVEL', '6'))
+
+# Read-through cache for user and preference lookups. Entries expire quickly and are
+# invalidated across workers through LISTEN/NOTIFY on CACHE_NOTIFY_CHANNEL.
+USER_CACHE_TTL_SECONDS = float(os.getenv('USER_CACHE_TTL_SECONDS', '30'))
+USER_CACHE_MAXSIZE = int(os.getenv('USER_CACHE_MAXSIZE', '2048'))
+CACHE_NOTIFY_CHANNEL = "cache_invalidation"
 
 _pool = None
 _pool_lock = asyncio.Lock()
+_user_cache = TTLCache(maxsize=USER_CACHE_MAXSIZE, ttl_seconds=USER_CACHE_TTL_SECONDS)
+_prefs_cache = TTLCache(maxsize=USER_CACHE_MAXSIZE, ttl_seconds=USER_CACHE_TTL_SECONDS)
+# Lets a worker ignore its own invalidation notifications.
+_process_token = secrets.token_hex(4)
+# Vector types whose binary dumper is registered on pool connections.
+_binary_vector_types: set[str] = set()
+
+
+class _VectorParam:
+    __slots__ = ("values",)
+
+    def __init__(self, values: list[float]):
+        self.values = values
+
+
+class _HalfvecParam(_VectorParam):
+    __slots__ = ()
+
+
+if Dumper is not None:
+    # pgvector binary wire format: int16 dim, int16 unused, then float4 (vector) or float2 (halfvec) values.
+    class _VectorBinaryDumper(Dumper):
+        format = Format.BINARY
+
+        def dump(self, obj: _VectorParam) -> bytes:
+            values = obj.values
+            return struct.pack(f">HH{len(values)}f", len(values), 0, *values)
+
+    class _HalfvecBinaryDumper(Dumper):
+        format = Format.BINARY
+
+        def dump(self, obj: _VectorParam) -> bytes:
+            values = obj.values
+            return struct.pack(f">HH{len(values)}e", len(values), 0, *values)
 
 
 def _to_pgvector(values: list[float]) -> str:
     return "[" + ",".join(str(v) for v in values) + "]"
 
+
+# Embedding query parameter; pair it with a `%s::{EMBEDDING_STORAGE}` cast in SQL.
+def vector_param(values: list[float]) -> Any:
+    if EMBEDDING_STORAGE in _binary_vector_types:
+        return _HalfvecParam(values) if EMBEDDING_STORAGE == "halfvec" else _VectorParam(values)
+    return _to_pgvector(values)
+
+
+async def _configure_connection(conn) -> None:
+    if Dumper is None:
+        return
+    for type_name, param_cls, dumper_cls in (
+        ("vector", _VectorParam, _VectorBinaryDumper),
+        ("halfvec", _HalfvecParam, _HalfvecBinaryDumper),
+    ):
+        info = await TypeInfo.fetch(conn, type_name)
+        if info is None:
+            continue
+        conn.adapters.register_dumper(param_cls, type(dumper_cls.__name__, (dumper_cls,), {"oid": info.oid}))
+        _binary_vector_types.add(type_name)
+    await conn.commit()
+
 async def get_pool():
     global _pool
     if not DATABASE_URL:
@@ -35,11 +134,153 @@ async def get_pool():
             raise RuntimeError("psycopg_pool not installed")
         async with _pool_lock:
             if _pool is None:
-                _pool = AsyncConnectionPool(DATABASE_URL, min_size=1, max_size=5, open=False)
-                await _pool.open()
+                pool = AsyncConnectionPool(
+                    DATABASE_URL,
+                    min_size=DB_POOL_MIN_SIZE,
+                    max_size=max(DB_POOL_MAX_SIZE, DB_POOL_MIN_SIZE),
+                    timeout=DB_POOL_TIMEOUT_SECONDS,
+                    max_lifetime=DB_POOL_MAX_LIFETIME_SECONDS,
+                    max_idle=DB_POOL_MAX_IDLE_SECONDS,
+                    open=False,
+                    configure=_configure_connection,
+                    name="etravel",
+                )
+                await pool.open()
+                _pool = pool
     return _pool
 
 
+async def open_pool() -> None:
+    # Called from the app lifespan: connect min_size connections up front and
+    # verify them, so the first requests after a deploy do not pay for it.
+    pool = await get_pool()
+    if pool is None:
+        return
+    await pool.wait(timeout=DB_POOL_TIMEOUT_SECONDS)
+    await pool.check()
+    async with pool.connection() as conn:
+        await conn.execute("select 1")
+
+
+async def close_pool() -> None:
+    global _pool
+    if _pool is not None:
+        await _pool.close()
+        _pool = None
+
+
+def pool_stats() -> Dict[str, Any]:
+    if _pool is None:
+        return {"open": False}
+    stats = _pool.get_stats()
+    in_use = stats.get("pool_size", 0) - stats.get("pool_available", 0)
+    queued = stats.get("requests_queued", 0)
+    return {
+        "open": True,
+        **stats,
+        "in_use": in_use,
+        "utilization": round(in_use / _pool.max_size, 3) if _pool.max_size else 0.0,
+        "avg_wait_ms": round(stats.get("requests_wait_ms", 0) / queued, 1) if queued else 0.0,
+    }
+
+
+# JSONB parameter from a dict/list or from JSON that was already serialized once upstream.
+def _jsonb(value: Any) -> str:
+    if isinstance(value, bytes):
+        return value.decode("utf-8")
+    if isinstance(value, str):
+        return value
+    return json.dumps(value, ensure_ascii=False)
+
+
+def plan_result_summary(result: Dict[str, Any]) -> Dict[str, Any]:
+    # What the history list view shows, so listing never decodes a stored result.
+    return {
+        "days": len(result.get("daily_plan") or []),
+        "top_destinations": [d.get("name") for d in result.get("top_destinations") or [] if isinstance(d, dict)],
+        "warnings": len(result.get("warnings") or []),
+    }
+
+
+def encode_plan_result(result: Dict[str, Any] | bytes, body: bytes | None = None) -> Dict[str, Any]:
+    # Parameters for _UPSERT_PLAN_RESULT. The row is addressed by the sha256 of the JSON bytes,
+    # so plans and history entries for the same result share one row.
+    if isinstance(result, bytes):
+        body, result = result, json.loads(result)
+    elif body is None:
+        body = json.dumps(result, ensure_ascii=False).encode("utf-8")
+    params: Dict[str, Any] = {
+        "hash": hashlib.sha256(body).hexdigest(),
+        "encoding": "json",
+        "data": body.decode("utf-8"),
+        "blob": None,
+        "summary": _jsonb(plan_result_summary(result)),
+        "raw_bytes": len(body),
+    }
+    if PLAN_RESULT_COMPRESSION == "zstd" and zstandard is not None:
+        params.update(encoding="zstd", data=None, blob=zstandard.ZstdCompressor(level=PLAN_RESULT_ZSTD_LEVEL).compress(body))
+    return params
+
+
+def decode_plan_result(encoding: str, data: Any, blob: Any) -> Any:
+    if encoding == "zstd":
+        if zstandard is None:
+            raise RuntimeError("zstandard not installed; cannot read compressed plan results")
+        return json.loads(zstandard.ZstdDecompressor().decompress(bytes(blob)))
+    return json.loads(data) if isinstance(data, str) else data
+
+
+# Re-referencing an existing result refreshes touched_at so the sweep never races a new reference.
+_UPSERT_PLAN_RESULT = """
+    insert into plan_results (hash, encoding, data, blob, summary, raw_bytes)
+    values (%(hash)s, %(encoding)s, %(data)s, %(blob)s, %(summary)s, %(raw_bytes)s)
+    on conflict (hash) do update set touched_at=now()
+"""
+
+
+def _invalidate_cached(kind: str, key: str) -> None:
+    if kind == "user":
+        _user_cache.invalidate(key)
+    elif kind == "prefs":
+        _prefs_cache.invalidate(key)
+
+
+async def _notify_invalidation(cur, kind: str, key: str) -> None:
+    # Delivered to other workers when the surrounding transaction commits.
+    await cur.execute("select pg_notify(%s, %s)", (CACHE_NOTIFY_CHANNEL, f"{_process_token}:{kind}:{key}"))
+
+
+async def listen_cache_invalidations() -> None:
+    if not DATABASE_URL or AsyncConnection is None:
+        return
+    backoff = 1.0
+    while True:
+        try:
+            conn = await AsyncConnection.connect(DATABASE_URL, autocommit=True)
+            async with conn:
+                await conn.execute(f"listen {CACHE_NOTIFY_CHANNEL}")
+                backoff = 1.0
+                # Notifications sent while we were not listening are lost.
+                _user_cache.clear()
+                _prefs_cache.clear()
+                async for notify in conn.notifies():
+                    origin, _, rest = notify.payload.partition(":")
+                    if origin == _process_token:
+                        continue
+                    kind, _, key = rest.partition(":")
+                    _invalidate_cached(kind, key)
+        except asyncio.CancelledError:
+            raise
+        except Exception as exc:
+            log_event("cache_listener_error", level=logging.WARNING, error=str(exc))
+        await asyncio.sleep(backoff)
+        backoff = min(backoff * 2, 30.0)
+
+
+def cache_stats() -> Dict[str, Any]:
+    return {"users": _user_cache.stats(), "preferences": _prefs_cache.stats()}
+
+
 def hash_password(password: str, salt: Optional[str] = None) -> Dict[str, str]:
     if salt is None:
         salt = secrets.token_hex(16)
@@ -66,19 +307,30 @@ async def create_user(email: str, password: str) -> None:
                 """,
                 (email.lower(), pw["hash"], pw["salt"]),
             )
+            await _notify_invalidation(cur, "user", email.lower())
+    _user_cache.invalidate(email.lower())
 
 
 async def get_user_by_email(email: str) -> Optional[Dict[str, Any]]:
+    key = email.lower()
+    cached = _user_cache.get(key)
+    if cached is not MISSING:
+        return dict(cached)
+    # Read before the query: a password change committed meanwhile must not be undone by
+    # caching the old hash.
+    generation = _user_cache.generation(key)
     pool = await get_pool()
     if pool is None:
         return None
     async with pool.connection() as conn:
         async with conn.cursor() as cur:
-            await cur.execute("select id, email, password_hash, password_salt from users where email=%s", (email.lower(),))
+            await cur.execute("select id, email, password_hash, password_salt from users where email=%s", (key,))
             row = await cur.fetchone()
             if not row:
                 return None
-            return {"id": row[0], "email": row[1], "password_hash": row[2], "password_salt": row[3]}
+            user = {"id": row[0], "email": row[1], "password_hash": row[2], "password_salt": row[3]}
+    _user_cache.set(key, user, generation)
+    return dict(user)
 
 
 async def update_password(email: str, new_password: str) -> None:
@@ -92,15 +344,41 @@ async def update_password(email: str, new_password: str) -> None:
                 "update users set password_hash=%s, password_salt=%s where email=%s",
                 (pw["hash"], pw["salt"], email.lower()),
             )
+            await _notify_invalidation(cur, "user", email.lower())
+    _user_cache.invalidate(email.lower())
 
 
-async def store_code(email: str, code: str, purpose: str) -> None:
+async def store_code(
+    email: str,
+    code: str,
+    purpose: str,
+    max_per_email: int = 0,
+    window_seconds: int = 900,
+    outbox_email: Optional[tuple[str, str]] = None,
+) -> None:
     pool = await get_pool()
     if pool is None:
         raise RuntimeError("DATABASE_URL not set")
-    pw = hash_password(code)
     async with pool.connection() as conn:
         async with conn.cursor() as cur:
+            if max_per_email > 0:
+                # Serializes concurrent requests for one address until commit, so they cannot all
+                # pass the count. Checked before hashing so a flooded address costs one indexed
+                # count, not a PBKDF2 run. Used and expired codes stay in the table until the
+                # window has passed (see verify_code / sweep_auth_codes), so they still count.
+                await cur.execute("select pg_advisory_xact_lock(hashtext(%s))", (f"auth_code:{email.lower()}",))
+                await cur.execute(
+                    """
+                    select count(*), min(created_at) + make_interval(secs => %s) - now()
+                    from auth_codes
+                    where email=%s and created_at > now() - make_interval(secs => %s)
+                    """,
+                    (window_seconds, email.lower(), window_seconds),
+                )
+                count, retry_after = await cur.fetchone()
+                if count >= max_per_email:
+                    raise RateLimitedError(retry_after.total_seconds() if retry_after else window_seconds)
+            pw = await asyncio.to_thread(hash_password, code)
             await cur.execute(
                 """
                 insert into auth_codes (email, code_hash, code_salt, purpose, expires_at)
@@ -108,6 +386,13 @@ async def store_code(email: str, code: str, purpose: str) -> None:
                 """,
                 (email.lower(), pw["hash"], pw["salt"], purpose),
             )
+            if outbox_email is not None:
+                # Same transaction as the code: the email exists iff the code does.
+                subject, text = outbox_email
+                await cur.execute(
+                    "insert into email_outbox (to_email, subject, body) values (%s, %s, %s)",
+                    (email.lower(), subject, text),
+                )
 
 
 async def verify_code(email: str, code: str, purpose: str) -> bool:
@@ -130,10 +415,457 @@ async def verify_code(email: str, code: str, purpose: str) -> bool:
                 return False
             code_ok = verify_password(code, row[2], row[1])
             if code_ok:
-                await cur.execute("delete from auth_codes where id=%s", (row[0],))
+                # A used code also retires any older codes issued for the same purpose. They are
+                # expired rather than deleted so they keep counting toward the issuance throttle.
+                await cur.execute(
+                    "update auth_codes set expires_at=now() where email=%s and purpose=%s and expires_at > now()",
+                    (email.lower(), purpose),
+                )
             return code_ok
 
 
+async def sweep_auth_codes(retain_seconds: int = 900, batch_size: int = 1000) -> int:
+    # Expired codes are kept until they leave the store_code throttle window.
+    pool = await get_pool()
+    if pool is None:
+        return 0
+    total = 0
+    while True:
+        async with pool.connection() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(
+                    """
+                    delete from auth_codes
+                    where id in (
+                        select id from auth_codes
+                        where expires_at < now() and created_at < now() - make_interval(secs => %s)
+                        limit %s
+                    )
+                    """,
+                    (retain_seconds, batch_size),
+                )
+                deleted = cur.rowcount
+        total += deleted
+        if deleted < batch_size:
+            return total
+
+
+async def claim_outbox_emails(batch_size: int = 50, lease_seconds: int = 60) -> list[Dict[str, Any]]:
+    pool = await get_pool()
+    if pool is None:
+        return []
+    async with pool.connection() as conn:
+        async with conn.cursor() as cur:
+            # Leasing pushes next_attempt_at forward so other workers skip rows in flight;
+            # rows from a crashed worker become due again once the lease runs out.
+            await cur.execute(
+                """
+                update email_outbox
+                set attempts = attempts + 1, next_attempt_at = now() + make_interval(secs => %s)
+                where id in (
+                    select id from email_outbox
+                    where status='pending' and next_attempt_at <= now()
+                    order by next_attempt_at
+                    limit %s
+                    for update skip locked
+                )
+                returning id, to_email, subject, body, attempts, extract(epoch from now() - created_at)
+                """,
+                (lease_seconds, batch_size),
+            )
+            rows = await cur.fetchall() or []
+            return [
+                {
+                    "id": row[0],
+                    "to_email": row[1],
+                    "subject": row[2],
+                    "body": row[3],
+                    "attempts": row[4],
+                    "age_seconds": float(row[5]),
+                }
+                for row in rows
+            ]
+
+
+async def mark_outbox_sent(ids: list[Any]) -> None:
+    pool = await get_pool()
+    if pool is None or not ids:
+        return
+    async with pool.connection() as conn:
+        async with conn.cursor() as cur:
+            # Drop the body once delivered so plaintext codes do not linger.
+            await cur.execute(
+                "update email_outbox set status='sent', sent_at=now(), body='', last_error=null where id = any(%s)",
+                (ids,),
+            )
+
+
+async def mark_outbox_failed(outbox_id: Any, error: str, retry_in_seconds: Optional[float]) -> None:
+    pool = await get_pool()
+    if pool is None:
+        return
+    async with pool.connection() as conn:
+        async with conn.cursor() as cur:
+            if retry_in_seconds is None:
+                # Dead letters are kept for debugging; the error is enough, the code is not.
+                await cur.execute(
+                    "update email_outbox set status='dead', body='', last_error=%s where id=%s",
+                    (error[:1000], outbox_id),
+                )
+            else:
+                await cur.execute(
+                    """
+                    update email_outbox
+                    set last_error=%s, next_attempt_at = now() + make_interval(secs => %s)
+                    where id=%s
+                    """,
+                    (error[:1000], retry_in_seconds, outbox_id),
+                )
+
+
+async def sweep_email_outbox(retention_days: int = 7, batch_size: int = 1000) -> int:
+    pool = await get_pool()
+    if pool is None:
+        return 0
+    total = 0
+    while True:
+        async with pool.connection() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(
+                    """
+                    delete from email_outbox
+                    where id in (
+                        select id from email_outbox
+                        where status <> 'pending' and created_at < now() - make_interval(days => %s)
+                        limit %s
+                    )
+                    """,
+                    (retention_days, batch_size),
+                )
+                deleted = cur.rowcount
+        total += deleted
+        if deleted < batch_size:
+            return total
+
+
+async def enqueue_plan_job(
+    user_id: str | None,
+    request: Dict[str, Any],
+    owner_key: str | None = None,
+    max_pending: int = 0,
+) -> Optional[str]:
+    # Returns None when owner_key already has max_pending queued/running jobs (0 = no cap).
+    pool = await get_pool()
+    if pool is None:
+        raise RuntimeError("DATABASE_URL not set")
+    async with pool.connection() as conn:
+        async with conn.cursor() as cur:
+            if max_pending > 0 and owner_key:
+                # Serializes concurrent submissions of one caller until commit.
+                await cur.execute("select pg_advisory_xact_lock(hashtext(%s))", (f"plan_job:{owner_key}",))
+                await cur.execute(
+                    "select count(*) from plan_jobs where owner_key=%s and status in ('queued', 'running')",
+                    (owner_key,),
+                )
+                if (await cur.fetchone())[0] >= max_pending:
+                    return None
+            await cur.execute(
+                "insert into plan_jobs (user_id, request, owner_key) values (%s, %s, %s) returning id",
+                (user_id, _jsonb(request), owner_key),
+            )
+            row = await cur.fetchone()
+            return str(row[0])
+
+
+async def claim_plan_job(lease_seconds: float = 300, max_attempts: int = 2) -> Optional[Dict[str, Any]]:
+    pool = await get_pool()
+    if pool is None:
+        return None
+    async with pool.connection() as conn:
+        async with conn.cursor() as cur:
+            # Running jobs whose lease ran out (worker crashed or restarted) are picked up again,
+            # unless they already used all their attempts; those fail instead of looping.
+            await cur.execute(
+                """
+                update plan_jobs
+                set status='failed', error=coalesce(error, 'lease expired'), locked_until=null, finished_at=now()
+                where status='running' and locked_until < now() and attempts >= %s
+                """,
+                (max_attempts,),
+            )
+            await cur.execute(
+                """
+                update plan_jobs
+                set status='running', attempts = attempts + 1, started_at = now(),
+                    locked_until = now() + make_interval(secs => %s)
+                where id = (
+                    select id from plan_jobs
+                    where status='queued' or (status='running' and locked_until < now() and attempts < %s)
+                    order by created_at
+                    limit 1
+                    for update skip locked
+                )
+                returning id, user_id, request, attempts
+                """,
+                (lease_seconds, max_attempts),
+            )
+            row = await cur.fetchone()
+            if not row:
+                return None
+            return {
+                "id": str(row[0]),
+                "user_id": str(row[1]) if row[1] else None,
+                "request": row[2],
+                "attempts": row[3],
+            }
+
+
+async def complete_plan_job(job_id: str, request: Dict[str, Any], result: Dict[str, Any], model_version: str) -> str:
+    pool = await get_pool()
+    if pool is None:
+        raise RuntimeError("DATABASE_URL not set")
+    async with pool.connection() as conn:
+        async with conn.cursor() as cur:
+            # trip_requests, trip_plans and the job row commit together.
+            await cur.execute(
+                """
+                insert into trip_requests (
+                  id, origin, start_date, days, travelers, budget_min, budget_max,
+                  budget_text, preferences, pace, constraints, raw_input
+                )
+                values (gen_random_uuid(), %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+                returning id
+                """,
+                (
+                    request.get("origin"),
+                    request.get("start_date"),
+                    request.get("days"),
+                    request.get("travelers") or 1,
+                    request.get("budget_min"),
+                    request.get("budget_max"),
+                    request.get("budget_text"),
+                    _jsonb(request.get("preferences") or []),
+                    request.get("pace") or "",
+                    _jsonb(request.get("constraints") or []),
+                    _jsonb(request),
+                ),
+            )
+            request_id = (await cur.fetchone())[0]
+            await cur.execute(
+                """
+                insert into trip_plans (
+                  id, request_id, model_version, top_destinations, daily_plan, budget_breakdown, warnings
+                )
+                values (gen_random_uuid(), %s, %s, %s, %s, %s, %s)
+                returning id
+                """,
+                (
+                    request_id,
+                    model_version,
+                    _jsonb(result["top_destinations"]),
+                    _jsonb(result["daily_plan"]),
+                    _jsonb(result["budget_breakdown"]),
+                    _jsonb(result.get("warnings") or []),
+                ),
+            )
+            plan_id = (await cur.fetchone())[0]
+            await cur.execute(
+                """
+                update plan_jobs
+                set status='done', plan_id=%s, error=null, locked_until=null, finished_at=now()
+                where id=%s
+                """,
+                (plan_id, job_id),
+            )
+            return str(plan_id)
+
+
+async def fail_plan_job(job_id: str, error: str, retry: bool) -> None:
+    pool = await get_pool()
+    if pool is None:
+        return
+    async with pool.connection() as conn:
+        async with conn.cursor() as cur:
+            if retry:
+                await cur.execute(
+                    "update plan_jobs set status='queued', error=%s, locked_until=null where id=%s",
+                    (error[:1000], job_id),
+                )
+            else:
+                await cur.execute(
+                    """
+                    update plan_jobs
+                    set status='failed', error=%s, locked_until=null, finished_at=now()
+                    where id=%s
+                    """,
+                    (error[:1000], job_id),
+                )
+
+
+async def get_plan_job(job_id: str) -> Optional[Dict[str, Any]]:
+    pool = await get_pool()
+    if pool is None:
+        return None
+    async with pool.connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(
+                """
+                select id, user_id, status, attempts, error, plan_id, created_at, started_at, finished_at
+                from plan_jobs where id=%s
+                """,
+                (job_id,),
+            )
+            row = await cur.fetchone()
+            if not row:
+                return None
+            return {
+                "id": str(row[0]),
+                "user_id": str(row[1]) if row[1] else None,
+                "status": row[2],
+                "attempts": row[3],
+                "error": row[4],
+                "plan_id": str(row[5]) if row[5] else None,
+                "created_at": row[6].isoformat() if row[6] else None,
+                "started_at": row[7].isoformat() if row[7] else None,
+                "finished_at": row[8].isoformat() if row[8] else None,
+            }
+
+
+async def load_trip_plan(plan_id: str) -> Optional[Dict[str, Any]]:
+    pool = await get_pool()
+    if pool is None:
+        return None
+    async with pool.connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(
+                """
+                select top_destinations, daily_plan, budget_breakdown, warnings
+                from trip_plans where id=%s
+                """,
+                (plan_id,),
+            )
+            row = await cur.fetchone()
+            if not row:
+                return None
+            return {
+                "top_destinations": row[0],
+                "daily_plan": row[1],
+                "budget_breakdown": row[2],
+                "warnings": row[3],
+            }
+
+
+async def sweep_plan_jobs(retention_days: int = 7, batch_size: int = 500) -> int:
+    pool = await get_pool()
+    if pool is None:
+        return 0
+    total = 0
+    while True:
+        async with pool.connection() as conn:
+            async with conn.cursor() as cur:
+                # Finished jobs past retention go together with their trip_plans / trip_requests;
+                # plans that received feedback are kept.
+                await cur.execute(
+                    """
+                    with expired as (
+                        delete from plan_jobs
+                        where id in (
+                            select id from plan_jobs
+                            where status in ('done', 'failed')
+                              and finished_at < now() - make_interval(days => %s)
+                            limit %s
+                        )
+                        returning plan_id
+                    ),
+                    plans as (
+                        delete from trip_plans p
+                        using expired e
+                        where p.id = e.plan_id
+                          and not exists (select 1 from feedback f where f.plan_id = p.id)
+                        returning p.request_id
+                    ),
+                    requests as (
+                        delete from trip_requests r
+                        using plans p
+                        where r.id = p.request_id
+                        returning r.id
+                    )
+                    select count(*) from expired
+                    """,
+                    (retention_days, batch_size),
+                )
+                deleted = (await cur.fetchone())[0]
+        total += deleted
+        if deleted < batch_size:
+            return total
+
+
+async def insert_llm_usage(rows: List[tuple]) -> int:
+    pool = await get_pool()
+    if pool is None:
+        return 0
+    async with pool.connection() as conn:
+        async with conn.cursor() as cur:
+            async with cur.copy(
+                """
+                copy llm_usage (
+                  created_at, request_id, user_id, stage, model, attempt, status,
+                  prompt_tokens, completion_tokens, cached_tokens, latency_ms
+                ) from stdin
+                """
+            ) as copy_in:
+                for row in rows:
+                    await copy_in.write_row(row)
+    return len(rows)
+
+
+async def llm_usage_report(days: int = 7, user_id: str | None = None) -> List[Dict[str, Any]]:
+    pool = await get_pool()
+    if pool is None:
+        return []
+    async with pool.connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(
+                """
+                select
+                  (created_at at time zone 'utc')::date as day,
+                  stage,
+                  count(*),
+                  count(*) filter (where status <> 'ok'),
+                  count(*) filter (where attempt > 0),
+                  count(distinct user_id),
+                  coalesce(sum(prompt_tokens), 0),
+                  coalesce(sum(cached_tokens), 0),
+                  coalesce(sum(completion_tokens), 0),
+                  percentile_cont(0.5) within group (order by latency_ms),
+                  percentile_cont(0.95) within group (order by latency_ms)
+                from llm_usage
+                where created_at >= now() - make_interval(days => %s)
+                  and (%s::uuid is null or user_id = %s::uuid)
+                group by 1, 2
+                order by 1 desc, 2
+                """,
+                (days, user_id, user_id),
+            )
+            rows = await cur.fetchall() or []
+    return [
+        {
+            "day": r[0].isoformat(),
+            "stage": r[1],
+            "calls": r[2],
+            "errors": r[3],
+            "retries": r[4],
+            "users": r[5],
+            "prompt_tokens": int(r[6]),
+            "cached_tokens": int(r[7]),
+            "completion_tokens": int(r[8]),
+            "latency_p50_ms": int(r[9] or 0),
+            "latency_p95_ms": int(r[10] or 0),
+        }
+        for r in rows
+    ]
+
+
 async def save_preferences(user_id: str, prefs: Dict[str, Any]) -> None:
     pool = await get_pool()
     if pool is None:
@@ -146,11 +878,17 @@ async def save_preferences(user_id: str, prefs: Dict[str, Any]) -> None:
                 values (%s, %s)
                 on conflict (user_id) do update set data=excluded.data, updated_at=now()
                 """,
-                (user_id, json.dumps(prefs, ensure_ascii=False)),
+                (user_id, _jsonb(prefs)),
             )
+            await _notify_invalidation(cur, "prefs", str(user_id))
+    _prefs_cache.set(str(user_id), copy.deepcopy(prefs))
 
 
 async def load_preferences(user_id: str) -> Optional[Dict[str, Any]]:
+    cached = _prefs_cache.get(str(user_id))
+    if cached is not MISSING:
+        return copy.deepcopy(cached)
+    generation = _prefs_cache.generation(str(user_id))
     pool = await get_pool()
     if pool is None:
         return None
@@ -158,26 +896,27 @@ async def load_preferences(user_id: str) -> Optional[Dict[str, Any]]:
         async with conn.cursor() as cur:
             await cur.execute("select data from user_preferences where user_id=%s", (user_id,))
             row = await cur.fetchone()
-            if not row:
-                return None
-            data = row[0]
-            if isinstance(data, (dict, list)):
-                return data
-            return json.loads(data)
+            data = row[0] if row else None
+            if isinstance(data, str):
+                data = json.loads(data)
+    _prefs_cache.set(str(user_id), data, generation)
+    return copy.deepcopy(data)
 
 
-async def save_plan(user_id: str, plan: Dict[str, Any]) -> None:
+async def save_plan(user_id: str, plan: Dict[str, Any] | bytes) -> None:
     pool = await get_pool()
     if pool is None:
         return
     async with pool.connection() as conn:
         async with conn.cursor() as cur:
+            stored = encode_plan_result(plan)
+            await cur.execute(_UPSERT_PLAN_RESULT, stored)
             await cur.execute(
                 """
-                insert into user_plans (user_id, data)
+                insert into user_plans (user_id, result_hash)
                 values (%s, %s)
                 """,
-                (user_id, json.dumps(plan, ensure_ascii=False)),
+                (user_id, stored["hash"]),
             )
             await cur.execute(
                 """
@@ -192,22 +931,20 @@ async def save_plan(user_id: str, plan: Dict[str, Any]) -> None:
             )
 
 
-async def save_search_history(user_id: str, query: Dict[str, Any], result: Dict[str, Any]) -> None:
+async def save_search_history(user_id: str, query: Dict[str, Any], result: Dict[str, Any] | bytes) -> None:
     pool = await get_pool()
     if pool is None:
         return
     async with pool.connection() as conn:
         async with conn.cursor() as cur:
+            stored = encode_plan_result(result)
+            await cur.execute(_UPSERT_PLAN_RESULT, stored)
             await cur.execute(
                 """
-                insert into user_search_history (user_id, query, result)
+                insert into user_search_history (user_id, query, result_hash)
                 values (%s, %s, %s)
                 """,
-                (
-                    user_id,
-                    json.dumps(query, ensure_ascii=False),
-                    json.dumps(result, ensure_ascii=False),
-                ),
+                (user_id, _jsonb(query), stored["hash"]),
             )
             await cur.execute(
                 """
@@ -222,6 +959,92 @@ async def save_search_history(user_id: str, query: Dict[str, Any], result: Dict[
             )
 
 
+# Everything a logged-in plan writes, as one transaction sent in pipeline mode (one network
+# round-trip plus the commit instead of one per statement). Preferences are only upserted when
+# they differ from what is stored. When memory_content is given, an identical memory doc is
+# refreshed in the same transaction; returns False when none existed, so the caller still has
+# to embed and insert it (kept out of the transaction to avoid holding it across the API call).
+async def save_plan_result(
+    user_id: str,
+    prefs: Dict[str, Any],
+    query: Dict[str, Any],
+    result: Dict[str, Any],
+    body: bytes | None = None,
+    memory_content: str | None = None,
+) -> bool:
+    pool = await get_pool()
+    if pool is None:
+        return False
+    stored = encode_plan_result(result, body)
+    cached_prefs = _prefs_cache.get(str(user_id))
+    write_prefs = cached_prefs is MISSING or cached_prefs != prefs
+    async with pool.connection() as conn:
+        async with conn.cursor() as cur, conn.cursor() as memory_cur:
+            async with conn.pipeline():
+                if write_prefs:
+                    # Notifies other workers only when the row actually changed.
+                    await cur.execute(
+                        """
+                        with written as (
+                            insert into user_preferences (user_id, data)
+                            values (%s, %s)
+                            on conflict (user_id) do update set data=excluded.data, updated_at=now()
+                            where user_preferences.data is distinct from excluded.data
+                            returning user_id
+                        )
+                        select pg_notify(%s, %s) from written
+                        """,
+                        (user_id, _jsonb(prefs), CACHE_NOTIFY_CHANNEL, f"{_process_token}:prefs:{user_id}"),
+                    )
+                # Stored once; the plan and the history entry both reference it.
+                await cur.execute(_UPSERT_PLAN_RESULT, stored)
+                await cur.execute("insert into user_plans (user_id, result_hash) values (%s, %s)", (user_id, stored["hash"]))
+                await cur.execute(
+                    """
+                    delete from user_plans
+                    where id in (
+                        select id from user_plans
+                        where user_id=%s
+                        order by created_at desc offset 10
+                    )
+                    """,
+                    (user_id,),
+                )
+                await cur.execute(
+                    "insert into user_search_history (user_id, query, result_hash) values (%s, %s, %s)",
+                    (user_id, _jsonb(query), stored["hash"]),
+                )
+                await cur.execute(
+                    """
+                    delete from user_search_history
+                    where id in (
+                        select id from user_search_history
+                        where user_id=%s
+                        order by created_at desc offset 10
+                    )
+                    """,
+                    (user_id,),
+                )
+                if memory_content is not None:
+                    await memory_cur.execute(
+                        """
+                        update user_memory_docs set created_at=now()
+                        where id = (
+                            select id from user_memory_docs
+                            where user_id=%s and content=%s
+                            limit 1
+                        )
+                        returning id
+                        """,
+                        (user_id, memory_content),
+                    )
+            # Leaving the pipeline block synced it, so the results can be read now.
+            memory_touched = memory_content is not None and await memory_cur.fetchone() is not None
+    if write_prefs:
+        _prefs_cache.set(str(user_id), copy.deepcopy(prefs))
+    return memory_touched
+
+
 async def load_search_history(user_id: str, limit: int = 10) -> list[Dict[str, Any]]:
     pool = await get_pool()
     if pool is None:
@@ -230,10 +1053,11 @@ async def load_search_history(user_id: str, limit: int = 10) -> list[Dict[str, A
         async with conn.cursor() as cur:
             await cur.execute(
                 """
-                select id, query, result, created_at
-                from user_search_history
-                where user_id=%s
-                order by created_at desc
+                select h.id, h.query, r.encoding, r.data, r.blob, h.created_at
+                from user_search_history h
+                join plan_results r on r.hash = h.result_hash
+                where h.user_id=%s
+                order by h.created_at desc
                 limit %s
                 """,
                 (user_id, limit),
@@ -242,22 +1066,102 @@ async def load_search_history(user_id: str, limit: int = 10) -> list[Dict[str, A
             items = []
             for row in rows:
                 query = row[1]
-                result = row[2]
                 if isinstance(query, str):
                     query = json.loads(query)
-                if isinstance(result, str):
-                    result = json.loads(result)
                 items.append(
                     {
                         "id": str(row[0]),
                         "query": query,
-                        "result": result,
-                        "created_at": row[3].isoformat() if row[3] else None,
+                        "result": decode_plan_result(row[2], row[3], row[4]),
+                        "created_at": row[5].isoformat() if row[5] else None,
                     }
                 )
             return items
 
 
+async def list_search_history(
+    user_id: str,
+    limit: int = 10,
+    before: Optional[tuple[datetime, str]] = None,
+) -> list[Dict[str, Any]]:
+    pool = await get_pool()
+    if pool is None:
+        return []
+    # Keyset pagination on (created_at, id); only the stored summary of each result is read.
+    where = "where h.user_id=%s"
+    params: list[Any] = [user_id]
+    if before is not None:
+        where += " and (h.created_at, h.id) < (%s, %s)"
+        params.extend(before)
+    params.append(limit)
+    async with pool.connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(
+                f"""
+                select h.id, h.query, h.created_at, r.hash, r.summary
+                from user_search_history h
+                join plan_results r on r.hash = h.result_hash
+                {where}
+                order by h.created_at desc, h.id desc
+                limit %s
+                """,
+                params,
+            )
+            rows = await cur.fetchall() or []
+            items = []
+            for row in rows:
+                query = row[1]
+                if isinstance(query, str):
+                    query = json.loads(query)
+                summary = row[4]
+                if isinstance(summary, str):
+                    summary = json.loads(summary)
+                items.append(
+                    {
+                        "id": str(row[0]),
+                        "query": query,
+                        "created_at": row[2].isoformat() if row[2] else None,
+                        "result_digest": {
+                            "hash": row[3],
+                            "days": summary.get("days", 0),
+                            "top_destinations": summary.get("top_destinations", []),
+                            "warnings": summary.get("warnings", 0),
+                        },
+                    }
+                )
+            return items
+
+
+async def get_search_history_item(user_id: str, history_id: str) -> Optional[Dict[str, Any]]:
+    pool = await get_pool()
+    if pool is None:
+        return None
+    async with pool.connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(
+                """
+                select h.id, h.query, r.encoding, r.data, r.blob, h.created_at, r.hash
+                from user_search_history h
+                join plan_results r on r.hash = h.result_hash
+                where h.id=%s and h.user_id=%s
+                """,
+                (history_id, user_id),
+            )
+            row = await cur.fetchone()
+            if not row:
+                return None
+            query = row[1]
+            if isinstance(query, str):
+                query = json.loads(query)
+            return {
+                "id": str(row[0]),
+                "query": query,
+                "result": decode_plan_result(row[2], row[3], row[4]),
+                "created_at": row[5].isoformat() if row[5] else None,
+                "result_hash": row[6],
+            }
+
+
 async def delete_search_history_item(user_id: str, history_id: str) -> bool:
     pool = await get_pool()
     if pool is None:
@@ -271,49 +1175,290 @@ async def delete_search_history_item(user_id: str, history_id: str) -> bool:
             return cur.rowcount > 0
 
 
-async def save_user_memory_doc(user_id: str, title: str, source: str, content: str, embedding: list[float]) -> None:
+async def sweep_plan_results(grace_seconds: float = 3600, batch_size: int = 500) -> int:
+    # Results left unreferenced by plan/history pruning; touched_at keeps fresh ones out of reach.
     pool = await get_pool()
     if pool is None:
+        return 0
+    total = 0
+    while True:
+        async with pool.connection() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(
+                    """
+                    delete from plan_results
+                    where hash in (
+                        select p.hash from plan_results p
+                        where p.touched_at < now() - make_interval(secs => %s)
+                          and not exists (select 1 from user_plans u where u.result_hash = p.hash)
+                          and not exists (select 1 from user_search_history h where h.result_hash = p.hash)
+                          and not exists (select 1 from plan_cache c where c.result_hash = p.hash)
+                        limit %s
+                        for update skip locked
+                    )
+                    """,
+                    (grace_seconds, batch_size),
+                )
+                deleted = cur.rowcount
+        total += deleted
+        if deleted < batch_size:
+            return total
+
+
+@asynccontextmanager
+async def advisory_lock(name: str) -> AsyncIterator[bool]:
+    # Session-level lock on a connection of its own (not the pool), held for the whole block;
+    # yields False when another process holds it. Closing the connection releases it.
+    if not DATABASE_URL or AsyncConnection is None:
+        yield False
         return
-    vector_str = _to_pgvector(embedding)
+    conn = await AsyncConnection.connect(DATABASE_URL, autocommit=True)
+    async with conn:
+        cur = await conn.execute("select pg_try_advisory_lock(hashtext(%s))", (name,))
+        yield bool((await cur.fetchone())[0])
+
+
+async def recent_search_queries(lookback_days: int = 30, limit: int = 5000) -> list[Dict[str, Any]]:
+    # Raw request payloads of all users' recent searches, newest first.
+    pool = await get_pool()
+    if pool is None:
+        return []
     async with pool.connection() as conn:
         async with conn.cursor() as cur:
             await cur.execute(
                 """
-                insert into user_memory_docs (user_id, title, source, content, embedding)
-                values (%s, %s, %s, %s, %s::vector)
+                select query from user_search_history
+                where created_at > now() - make_interval(days => %s)
+                order by created_at desc
+                limit %s
                 """,
-                (user_id, title, source, content, vector_str),
+                (lookback_days, limit),
             )
+            rows = await cur.fetchall() or []
+    return [json.loads(row[0]) if isinstance(row[0], str) else row[0] for row in rows]
+
+
+async def load_plan_cache(key: str) -> Optional[Dict[str, Any]]:
+    pool = await get_pool()
+    if pool is None:
+        return None
+    async with pool.connection() as conn:
+        async with conn.cursor() as cur:
+            # Lookup and hit count in one statement.
             await cur.execute(
                 """
-                delete from user_memory_docs
-                where id in (
+                update plan_cache c
+                set hits = c.hits + 1, last_hit_at = now()
+                from plan_results r
+                where c.key=%s and c.expires_at > now() and r.hash = c.result_hash
+                returning r.encoding, r.data, r.blob
+                """,
+                (key,),
+            )
+            row = await cur.fetchone()
+    return decode_plan_result(row[0], row[1], row[2]) if row else None
+
+
+async def fresh_plan_cache_keys(keys: List[str], min_remaining_seconds: float) -> set[str]:
+    # Keys whose entry stays valid for at least min_remaining_seconds more.
+    pool = await get_pool()
+    if pool is None or not keys:
+        return set()
+    async with pool.connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(
+                """
+                select key from plan_cache
+                where key = any(%s) and expires_at > now() + make_interval(secs => %s)
+                """,
+                (keys, min_remaining_seconds),
+            )
+            return {row[0] for row in await cur.fetchall() or []}
+
+
+async def save_plan_cache(
+    key: str,
+    request: Dict[str, Any],
+    result: Dict[str, Any],
+    ttl_seconds: float,
+    requests: int = 0,
+    prompt_tokens: int = 0,
+    completion_tokens: int = 0,
+    body: bytes | None = None,
+) -> None:
+    pool = await get_pool()
+    if pool is None:
+        return
+    stored = encode_plan_result(result, body)
+    async with pool.connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(_UPSERT_PLAN_RESULT, stored)
+            await cur.execute(
+                """
+                insert into plan_cache (
+                  key, request, result_hash, requests, prompt_tokens, completion_tokens, expires_at
+                )
+                values (%s, %s, %s, %s, %s, %s, now() + make_interval(secs => %s))
+                on conflict (key) do update set
+                  request=excluded.request,
+                  result_hash=excluded.result_hash,
+                  requests=excluded.requests,
+                  prompt_tokens=excluded.prompt_tokens,
+                  completion_tokens=excluded.completion_tokens,
+                  generated_at=now(),
+                  expires_at=excluded.expires_at
+                """,
+                (key, _jsonb(request), stored["hash"], requests, prompt_tokens, completion_tokens, ttl_seconds),
+            )
+
+
+async def sweep_plan_cache(batch_size: int = 500) -> int:
+    # Expired entries; their results are then left to sweep_plan_results.
+    pool = await get_pool()
+    if pool is None:
+        return 0
+    total = 0
+    while True:
+        async with pool.connection() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(
+                    """
+                    delete from plan_cache
+                    where key in (
+                        select key from plan_cache
+                        where expires_at < now()
+                        limit %s
+                        for update skip locked
+                    )
+                    """,
+                    (batch_size,),
+                )
+                deleted = cur.rowcount
+        total += deleted
+        if deleted < batch_size:
+            return total
+
+
+async def touch_user_memory_doc(user_id: str, content: str) -> bool:
+    pool = await get_pool()
+    if pool is None:
+        return False
+    async with pool.connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(
+                """
+                update user_memory_docs set created_at=now()
+                where id = (
                     select id from user_memory_docs
-                    where user_id=%s
-                    order by created_at desc offset 100
+                    where user_id=%s and content=%s
+                    limit 1
                 )
                 """,
-                (user_id,),
+                (user_id, content),
+            )
+            return cur.rowcount > 0
+
+
+# Inserts a memory doc, or merges it into the user's nearest doc when cosine similarity
+# reaches dedup_threshold. Returns True when an existing doc was merged instead of inserted.
+async def save_user_memory_doc(
+    user_id: str,
+    title: str,
+    source: str,
+    content: str,
+    embedding: list[float],
+    dedup_threshold: float = 1.0,
+) -> bool:
+    pool = await get_pool()
+    if pool is None:
+        return False
+    vector = vector_param(embedding)
+    async with pool.connection() as conn:
+        async with conn.cursor() as cur:
+            # Until commit, other writes for this user wait here, so two concurrent plans cannot
+            # both miss each other's doc and insert near-duplicates.
+            await cur.execute("select pg_advisory_xact_lock(hashtext(%s))", (f"user_memory:{user_id}",))
+            await cur.execute(
+                f"""
+                with nearest as (
+                    select id, embedding <=> %(embedding)s::{EMBEDDING_STORAGE} as distance
+                    from user_memory_docs
+                    where user_id=%(user_id)s
+                    order by distance
+                    limit 1
+                ),
+                merged as (
+                    update user_memory_docs d
+                    set title=%(title)s, source=%(source)s, content=%(content)s,
+                        embedding=%(embedding)s::{EMBEDDING_STORAGE}, created_at=now()
+                    from nearest
+                    where d.id = nearest.id and nearest.distance <= %(max_distance)s
+                    returning d.id
+                )
+                insert into user_memory_docs (user_id, title, source, content, embedding)
+                select %(user_id)s, %(title)s, %(source)s, %(content)s, %(embedding)s::{EMBEDDING_STORAGE}
+                where not exists (select 1 from merged)
+                """,
+                {
+                    "user_id": user_id,
+                    "title": title,
+                    "source": source,
+                    "content": content,
+                    "embedding": vector,
+                    "max_distance": 1.0 - dedup_threshold,
+                },
             )
+            return cur.rowcount == 0
+
+
+async def compact_user_memory_docs(keep: int = 100, batch_size: int = 500) -> int:
+    pool = await get_pool()
+    if pool is None:
+        return 0
+    total = 0
+    while True:
+        # One short transaction per batch so compaction never holds locks for long.
+        async with pool.connection() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(
+                    """
+                    delete from user_memory_docs
+                    where id in (
+                        select id from (
+                            select id, row_number() over (partition by user_id order by created_at desc) as rn
+                            from user_memory_docs
+                            where user_id in (
+                                select user_id from user_memory_docs
+                                group by user_id having count(*) > %s
+                            )
+                        ) ranked
+                        where rn > %s
+                        limit %s
+                    )
+                    """,
+                    (keep, keep, batch_size),
+                )
+                deleted = cur.rowcount
+        total += deleted
+        if deleted < batch_size:
+            return total
 
 
 async def load_user_memory_by_vector(user_id: str, embedding: list[float], limit: int = 4) -> list[Dict[str, Any]]:
     pool = await get_pool()
     if pool is None:
         return []
-    vector_str = _to_pgvector(embedding)
     async with pool.connection() as conn:
         async with conn.cursor() as cur:
             await cur.execute(
-                """
+                f"""
                 select id, title, source, content
                 from user_memory_docs
                 where user_id=%s
-                order by embedding <=> %s::vector
+                order by embedding <=> %s::{EMBEDDING_STORAGE}
                 limit %s
                 """,
-                (user_id, vector_str, limit),
+                (user_id, vector_param(embedding), limit),
             )
             rows = await cur.fetchall() or []
             return [
@@ -0,0 +1,70 @@
+import contextvars
+import time
+from contextlib import contextmanager
+from typing import Iterator
+
+# Request-level time budget. The plan endpoint sets one; every stage checks it and sizes
+# its HTTP timeouts from what is left, so retries can never outlive the client.
+
+
+class DeadlineExceeded(TimeoutError):
+    def __init__(self, stage: str | None = None):
+        super().__init__(f"deadline exceeded{f' before {stage}' if stage else ''}")
+        self.stage = stage
+
+
+class Deadline:
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self) -> float:
+        return self.expires_at - time.monotonic()
+
+    def check(self, stage: str | None = None) -> None:
+        if self.remaining() <= 0:
+            raise DeadlineExceeded(stage)
+
+    def timeout_for(self, cap: float, minimum: float = 1.0, stage: str | None = None) -> float:
+        # Too little time left for a useful call: fail now instead of sending a doomed request.
+        remaining = self.remaining()
+        if remaining < minimum:
+            raise DeadlineExceeded(stage)
+        return min(cap, remaining)
+
+
+_current: contextvars.ContextVar[Deadline | None] = contextvars.ContextVar("deadline", default=None)
+
+
+@contextmanager
+def scope(seconds: float) -> Iterator[Deadline | None]:
+    # seconds <= 0 disables the budget; nested deadlines only ever shrink it.
+    if seconds <= 0:
+        yield _current.get()
+        return
+    parent = _current.get()
+    scoped = Deadline(seconds)
+    if parent is not None and parent.expires_at < scoped.expires_at:
+        scoped = parent
+    token = _current.set(scoped)
+    try:
+        yield scoped
+    finally:
+        _current.reset(token)
+
+
+def current() -> Deadline | None:
+    return _current.get()
+
+
+def check(stage: str | None = None) -> None:
+    scoped = _current.get()
+    if scoped is not None:
+        scoped.check(stage)
+
+
+def timeout_for(cap: float, minimum: float = 1.0, stage: str | None = None) -> float:
+    scoped = _current.get()
+    if scoped is None:
+        return cap
+    return scoped.timeout_for(cap, minimum=minimum, stage=stage)
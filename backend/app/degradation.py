@@ -0,0 +1,96 @@
+import math
+from contextlib import contextmanager
+from typing import Iterator
+
+from . import deadline
+from .settings import Settings
+
+# Degradation levels for plan generation; each level includes the ones below it.
+FULL = 0
+NO_BUDGET_RISK = 1
+NO_DUAL_RATE = 2
+NO_WEATHER = 3
+SKELETON_ONLY = 4
+
+_NAMES = {
+    FULL: "full",
+    NO_BUDGET_RISK: "no_budget_risk",
+    NO_DUAL_RATE: "no_dual_rate",
+    NO_WEATHER: "no_weather",
+    SKELETON_ONLY: "skeleton_only",
+}
+
+# Rough cost of an external weather lookup, on top of the per-LLM-call estimate.
+_WEATHER_SECONDS = 3.0
+
+_in_flight = 0
+
+
+def level_name(level: int) -> str:
+    return _NAMES.get(level, str(level))
+
+
+def in_flight() -> int:
+    return _in_flight
+
+
+@contextmanager
+def track() -> Iterator[int]:
+    # Counts concurrent plan generations in this worker; that count is the queue-pressure signal.
+    global _in_flight
+    _in_flight += 1
+    try:
+        yield _in_flight
+    finally:
+        _in_flight -= 1
+
+
+def _needed_seconds(level: int, settings: Settings) -> float:
+    call = settings.degrade_call_seconds
+    calls = 1 if level >= SKELETON_ONLY else 2  # planner (+ integrator)
+    if level < NO_BUDGET_RISK and settings.enable_budget_risk:
+        calls += 2
+    if level < NO_DUAL_RATE and settings.dual_rate_enabled:
+        calls += 1
+    seconds = calls * call
+    if level < NO_WEATHER and settings.rag_enabled and settings.rag_use_weather:
+        seconds += _WEATHER_SECONDS
+    return seconds
+
+
+def choose_level(settings: Settings, pending: int | None = None) -> int:
+    if not settings.degrade_enabled:
+        return FULL
+    scoped = deadline.current()
+    remaining = scoped.remaining() if scoped is not None else math.inf
+
+    level = SKELETON_ONLY
+    for candidate in range(FULL, SKELETON_ONLY + 1):
+        if _needed_seconds(candidate, settings) <= remaining:
+            level = candidate
+            break
+
+    # Under load, shed optional stages early, but never go to skeleton-only for pressure alone.
+    threshold = settings.degrade_inflight_threshold
+    pending = in_flight() if pending is None else pending
+    if threshold > 0 and pending > threshold:
+        level = max(level, min(NO_WEATHER, pending // threshold))
+    return level
+
+
+def fits(calls: int, settings: Settings) -> bool:
+    # Re-checked between stages: is there still time for `calls` more LLM calls?
+    scoped = deadline.current()
+    if scoped is None or not settings.degrade_enabled:
+        return True
+    return scoped.remaining() >= calls * settings.degrade_call_seconds
+
+
+def warning(level: int, language: str) -> str:
+    if language == "English":
+        if level >= SKELETON_ONLY:
+            return "Simplified plan: the service was busy, so activities and budget are outline-only."
+        return "Simplified plan: some refinement steps (budget/risk review, weather or memory summary) were skipped because the service was busy."
+    if level >= SKELETON_ONLY:
+        return "简化方案：服务繁忙，行程与预算仅为概要，请稍后重试获取完整方案。"
+    return "简化方案：服务繁忙，已跳过部分细化步骤（预算/风险复核、天气或记忆摘要）。"
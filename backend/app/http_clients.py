@@ -0,0 +1,22 @@
+import httpx
+
+# Shared keep-alive clients, one per upstream, so repeated calls reuse TLS connections.
+_clients: dict[str, httpx.AsyncClient] = {}
+
+
+def get_client(name: str, timeout: float = 30.0, **kwargs) -> httpx.AsyncClient:
+    client = _clients.get(name)
+    if client is None or client.is_closed:
+        client = httpx.AsyncClient(
+            timeout=timeout,
+            limits=httpx.Limits(max_connections=50, max_keepalive_connections=10, keepalive_expiry=60),
+            **kwargs,
+        )
+        _clients[name] = client
+    return client
+
+
+async def close_all() -> None:
+    for client in list(_clients.values()):
+        await client.aclose()
+    _clients.clear()
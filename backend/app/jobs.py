@@ -0,0 +1,48 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Coroutine, List, Set
+
+from .logs import log_event
+
+_tasks: List[asyncio.Task] = []
+# One-off background work (e.g. speculative prefetch); references kept until each task finishes.
+_spawned: Set[asyncio.Task] = set()
+
+
+async def _run_periodic(name: str, interval_seconds: float, func: Callable[[], Awaitable[None]]) -> None:
+    while True:
+        await asyncio.sleep(interval_seconds)
+        try:
+            await func()
+        except asyncio.CancelledError:
+            raise
+        except Exception as exc:
+            log_event("job_error", level=logging.ERROR, job=name, error=str(exc))
+
+
+def start_periodic(name: str, interval_seconds: float, func: Callable[[], Awaitable[None]]) -> None:
+    if interval_seconds <= 0:
+        return
+    _tasks.append(asyncio.create_task(_run_periodic(name, interval_seconds, func), name=f"job:{name}"))
+
+
+def start(name: str, func: Callable[[], Awaitable[None]]) -> None:
+    _tasks.append(asyncio.create_task(func(), name=f"job:{name}"))
+
+
+def spawn(name: str, coro: Coroutine[Any, Any, None]) -> None:
+    task = asyncio.create_task(coro, name=f"task:{name}")
+    _spawned.add(task)
+    task.add_done_callback(_spawned.discard)
+
+
+def spawned() -> int:
+    return len(_spawned)
+
+
+async def stop_all() -> None:
+    tasks = [*_tasks, *_spawned]
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    _tasks.clear()
@@ -1,18 +1,25 @@
+import asyncio
 import contextvars
 import json
+import logging
 import os
 import re
-from typing import Any, Dict, List
+import time
+from functools import lru_cache
+from typing import Any, Dict, List, Tuple
 
 import httpx
-from pydantic import ValidationError
+from pydantic import BaseModel, ValidationError
 
 from .settings import Settings, get_settings
-from .schemas import PlanRequest, PlanResponse
+from .schemas import DayBlock, PlanOverview, PlanPrefetchRequest, PlanRequest, PlanResponse
 from .retrieval import (
+    embed_texts,
+    prefetching,
     retrieve_context,
     retrieve_user_memory_context,
     retrieve_weather_context,
+    retrieve_weather_contexts,
 )
 from .prompts import (
     SYSTEM_GUARD,
@@ -25,8 +32,16 @@ from .prompts import (
     RISK_USER,
     INTEGRATOR_SYSTEM,
     INTEGRATOR_USER,
+    LANGUAGE_SUFFIX,
+    SHARD_OVERVIEW_SYSTEM,
+    SHARD_OVERVIEW_USER,
+    SHARD_DAYS_SYSTEM,
+    SHARD_DAYS_USER,
+    SUMMARIZER_USER,
 )
-from .dual_rate_memory import DualRateMemory
+from . import deadline, degradation, llm_cache, usage as usage_log
+from .http_clients import get_client
+from .logs import audit_dump, log_event, record_llm_usage, stage
 
 _usage_collector: contextvars.ContextVar[List[int] | None] = contextvars.ContextVar(
     "usage_collector",
@@ -35,8 +50,55 @@ _usage_collector: contextvars.ContextVar[List[int] | None] = contextvars.Context
 
 
 async def generate_plan_with_llm(req: PlanRequest, user_id: str | None = None, settings: Settings | None = None) -> PlanResponse:
+    with degradation.track():
+        return await _generate_plan(req, user_id, settings or get_settings())
+
+
+async def prefetch_shared_context(reqs: List[PlanRequest], user_id: str | None = None, settings: Settings | None = None) -> None:
+    # Batch planning: one embeddings request and one weather batch for every distinct query up
+    # front. Must run inside retrieval.shared_retrieval() so the pipelines reuse the results.
     settings = settings or get_settings()
+    if not settings.rag_enabled:
+        return
+    texts = [_rag_query_text(req) for req in reqs]
+    if any(texts) and (settings.rag_use_kb or (settings.rag_use_memory and user_id)):
+        try:
+            await embed_texts(texts)
+        except Exception as exc:
+            log_event("batch_prefetch", level=logging.WARNING, part="embeddings", error=str(exc))
+    if settings.rag_use_weather:
+        queries = list(dict.fromkeys((req.destination, req.start_date, req.days) for req in reqs if req.destination))
+        try:
+            await retrieve_weather_contexts(queries)
+        except Exception as exc:
+            log_event("batch_prefetch", level=logging.WARNING, part="weather", error=str(exc))
 
+
+async def prefetch_plan_context(
+    req: PlanPrefetchRequest,
+    user_id: str | None = None,
+    settings: Settings | None = None,
+) -> None:
+    # Speculative warm-up from the partially filled form: the same retrieval calls _generate_plan
+    # makes, run inside retrieval.prefetching() so the /api/plan that follows reuses them.
+    settings = settings or get_settings()
+    if not settings.rag_enabled:
+        return
+    query_text = _rag_query_text(req)
+    calls = []
+    with prefetching():
+        if query_text and settings.rag_use_kb:
+            calls.append(retrieve_context(query_text, top_k=settings.rag_top_k))
+        if query_text and settings.rag_use_memory and user_id:
+            calls.append(retrieve_user_memory_context(user_id, query_text, top_k=settings.rag_top_k))
+        if settings.rag_use_weather and req.destination:
+            calls.append(retrieve_weather_context(req.destination, req.start_date, req.days))
+        results = await asyncio.gather(*calls, return_exceptions=True)
+    errors = [str(r) for r in results if isinstance(r, Exception)]
+    log_event("plan_prefetch", level=logging.WARNING if errors else logging.INFO, calls=len(calls), errors=errors or None)
+
+
+async def _generate_plan(req: PlanRequest, user_id: str | None, settings: Settings) -> PlanResponse:
     provider = settings.llm_provider.strip().lower()
     if provider not in {"openai", "github", "vectorengine"}:
         raise RuntimeError(f"Unsupported LLM_PROVIDER: {provider}")
@@ -61,6 +123,19 @@ async def generate_plan_with_llm(req: PlanRequest, user_id: str | None = None, s
     mcp_enabled = settings.mcp_enabled
     dual_rate_enabled = settings.dual_rate_enabled
 
+    # Short on time or under load: shed optional stages up front instead of timing out later.
+    level = degradation.choose_level(settings)
+    skipped: List[str] = []
+    if level >= degradation.NO_BUDGET_RISK and budget_risk_enabled:
+        budget_risk_enabled = False
+        skipped.append("budget_risk")
+    if level >= degradation.NO_DUAL_RATE and dual_rate_enabled:
+        dual_rate_enabled = False
+        skipped.append("dual_rate")
+    if level >= degradation.NO_WEATHER and rag_enabled and rag_use_weather:
+        rag_use_weather = False
+        skipped.append("weather")
+
     budget = req.budget_text or _budget_range(req)
     language = "Chinese"
     if req.language:
@@ -80,64 +155,53 @@ async def generate_plan_with_llm(req: PlanRequest, user_id: str | None = None, s
     rag_weather_source = "disabled"
     if rag_enabled:
         try:
-            query_text = " ".join(
-                [
-                    req.origin or "",
-                    req.destination or "",
-                    req.budget_text or "",
-                    " ".join(req.preferences or []),
-                    " ".join(req.constraints or []),
-                ]
-            ).strip()
+            query_text = _rag_query_text(req)
             if query_text:
                 if rag_use_kb:
-                    chunks = await retrieve_context(query_text, top_k=rag_top_k)
+                    with stage("rag_kb"):
+                        chunks = await retrieve_context(query_text, top_k=rag_top_k)
                     rag_context = _format_rag_context(chunks)
                     rag_kb_hits = len(chunks)
-                    if audit_enabled:
-                        print("[rag_kb_hits]", rag_kb_hits)
                 if rag_use_memory and user_id:
-                    memory_chunks = await retrieve_user_memory_context(user_id, query_text, top_k=rag_top_k)
+                    with stage("rag_memory"):
+                        memory_chunks = await retrieve_user_memory_context(user_id, query_text, top_k=rag_top_k)
                     memory_context = _format_rag_context(memory_chunks)
                     rag_memory_hits = len(memory_chunks)
                     if audit_enabled:
-                        print("[rag_memory_hits]", rag_memory_hits)
                         memory_chars = sum(len(c.get("content") or "") for c in memory_chunks)
-                        print("[rag_memory_chars]", memory_chars)
+                        log_event("rag_memory", hits=rag_memory_hits, chars=memory_chars)
                 if rag_use_weather:
                     rag_weather_source = "mcp-first" if mcp_enabled else "open-meteo"
-                    weather_context = await retrieve_weather_context(req.destination, req.start_date, req.days)
+                    with stage("rag_weather"):
+                        weather_context = await retrieve_weather_context(req.destination, req.start_date, req.days)
                     rag_weather_status = "available" if weather_context else "empty"
-                    if audit_enabled:
-                        print("[rag_weather]", rag_weather_status)
                 if audit_enabled:
-                    print("[rag_enabled]", "true")
-                    print(
-                        "[rag_audit]",
-                        f"kb_hits={rag_kb_hits} memory_hits={rag_memory_hits} "
-                        f"weather={rag_weather_status} source={rag_weather_source}",
+                    log_event(
+                        "rag_audit",
+                        enabled=True,
+                        kb_hits=rag_kb_hits,
+                        memory_hits=rag_memory_hits,
+                        weather=rag_weather_status,
+                        source=rag_weather_source,
                     )
         except Exception as exc:
             rag_weather_status = "error"
             if audit_enabled:
-                print("[rag_error]", str(exc))
-                print(
-                    "[rag_audit]",
-                    f"kb_hits={rag_kb_hits} memory_hits={rag_memory_hits} "
-                    f"weather={rag_weather_status} source={rag_weather_source}",
+                log_event(
+                    "rag_audit",
+                    level=logging.WARNING,
+                    enabled=True,
+                    error=str(exc),
+                    kb_hits=rag_kb_hits,
+                    memory_hits=rag_memory_hits,
+                    weather=rag_weather_status,
+                    source=rag_weather_source,
                 )
     elif audit_enabled:
-        print("[rag_enabled]", "false")
-        print("[rag_audit]", "kb_hits=0 memory_hits=0 weather=disabled source=disabled")
+        log_event("rag_audit", enabled=False, kb_hits=0, memory_hits=0, weather="disabled", source="disabled")
 
     async def _summarize_for_dual_rate(text: str, max_tokens: int) -> str:
-        prompt = (
-            "Summarize the input into structured bullet points. "
-            "Only include facts explicitly present. "
-            "Do not invent new goals, tools, or steps. "
-            f"Keep it under ~{max_tokens} tokens.\n\n"
-            f"{text}"
-        )
+        prompt = SUMMARIZER_USER.format(text=text, max_tokens=max_tokens)
         return await _call_agent(
             SYSTEM_GUARD,
             prompt,
@@ -147,9 +211,12 @@ async def generate_plan_with_llm(req: PlanRequest, user_id: str | None = None, s
             response_format,
             timeout_seconds,
             provider,
+            stage="dual_rate",
         )
 
     if dual_rate_enabled and (rag_context or memory_context):
+        from .dual_rate_memory import DualRateMemory
+
         memory = DualRateMemory(
             fast_tokens=settings.dual_rate_fast_tokens,
             slow_tokens=settings.dual_rate_slow_tokens,
@@ -158,12 +225,14 @@ async def generate_plan_with_llm(req: PlanRequest, user_id: str | None = None, s
             recent_keep=settings.dual_rate_recent_keep,
         )
         merged = "\n\n".join([c for c in [rag_context, memory_context] if c])
-        await memory.update(merged, _summarize_for_dual_rate)
+        deadline.check("dual_rate")
+        with stage("dual_rate"):
+            await memory.update(merged, _summarize_for_dual_rate)
         dual_rate_context = memory.context()
         rag_context = ""
         memory_context = dual_rate_context
         if audit_enabled:
-            print("[dual_rate]", f"chars_in={len(merged)} chars_out={len(dual_rate_context)}")
+            log_event("dual_rate", chars_in=len(merged), chars_out=len(dual_rate_context))
 
     # 1) Planner
     planner_prompt = PLANNER_USER.format(
@@ -191,38 +260,13 @@ async def generate_plan_with_llm(req: PlanRequest, user_id: str | None = None, s
             )
         if weather_context:
             sections.append(f"Realtime weather context:\n{weather_context}")
-        planner_prompt += (
-            "\n\n"
-            + "\n\n".join(sections)
-            + "\n"
-            "If context is insufficient, state uncertainty instead of fabricating facts."
-        )
-
-    plan_skeleton = await _run_agent_with_retry(
-        system_prompt=PLANNER_SYSTEM.format(language=language),
-        user_prompt=planner_prompt,
-        api_base=api_base,
-        api_key=api_key,
-        model=model,
-        response_format=response_format,
-        timeout_seconds=timeout_seconds,
-        provider=provider,
-        max_retries=max_retries,
-    )
+        planner_prompt += "\n" + "\n\n".join(sections) + "\n"
 
-    if audit_enabled:
-        print("[planner_output]", json.dumps(plan_skeleton, ensure_ascii=False))#增加输出用来审计以下同理
-
-    if budget_risk_enabled:
-        # 2) Budget
-        budget_prompt = BUDGET_USER.format(
-            plan_skeleton=json.dumps(plan_skeleton, ensure_ascii=False),
-            budget=budget,
-            travelers=req.travelers,
-        )
-        budget_info = await _run_agent_with_retry(
-            system_prompt=BUDGET_SYSTEM.format(language=language),
-            user_prompt=budget_prompt,
+    deadline.check("planner")
+    with stage("planner"):
+        plan_skeleton = await _run_agent_with_retry(
+            system_prompt=PLANNER_SYSTEM,
+            user_prompt=_with_language(planner_prompt, language),
             api_base=api_base,
             api_key=api_key,
             model=model,
@@ -230,69 +274,148 @@ async def generate_plan_with_llm(req: PlanRequest, user_id: str | None = None, s
             timeout_seconds=timeout_seconds,
             provider=provider,
             max_retries=max_retries,
+            stage="planner",
         )
-        if audit_enabled:
-            print("[budget_output]", json.dumps(budget_info, ensure_ascii=False))
 
-        # 3) Risk
-        risk_prompt = RISK_USER.format(
-            plan_skeleton=json.dumps(plan_skeleton, ensure_ascii=False),
-        )
-        risk_info = await _run_agent_with_retry(
-            system_prompt=RISK_SYSTEM.format(language=language),
-            user_prompt=risk_prompt,
-            api_base=api_base,
-            api_key=api_key,
-            model=model,
-            response_format=response_format,
-            timeout_seconds=timeout_seconds,
-            provider=provider,
-            max_retries=max_retries,
-        )
-        if audit_enabled:
-            print("[risk_output]", json.dumps(risk_info, ensure_ascii=False))
-    else:
-        # 2) Budget/Risk disabled to reduce token usage
-        budget_info = {"budget_breakdown": {}, "alternatives": []}
-        risk_info = {"risks": [], "fixes": []}
+    if audit_enabled:
+        audit_dump("planner_output", plan_skeleton)#增加输出用来审计以下同理
+
+    if budget_risk_enabled and not degradation.fits(3, settings):
+        budget_risk_enabled = False
+        skipped.append("budget_risk")
+        level = max(level, degradation.NO_BUDGET_RISK)
+
+    # Budget/Risk disabled (to reduce token usage) or shed under time pressure
+    budget_info: Dict[str, Any] = {"budget_breakdown": {}, "alternatives": []}
+    risk_info: Dict[str, Any] = {"risks": [], "fixes": []}
+    if budget_risk_enabled:
+        try:
+            # 2) Budget
+            budget_prompt = BUDGET_USER.format(
+                plan_skeleton=json.dumps(plan_skeleton, ensure_ascii=False),
+                budget=budget,
+                travelers=req.travelers,
+            )
+            deadline.check("budget")
+            with stage("budget"):
+                budget_info = await _run_agent_with_retry(
+                    system_prompt=BUDGET_SYSTEM,
+                    user_prompt=_with_language(budget_prompt, language),
+                    api_base=api_base,
+                    api_key=api_key,
+                    model=model,
+                    response_format=response_format,
+                    timeout_seconds=timeout_seconds,
+                    provider=provider,
+                    max_retries=max_retries,
+                    stage="budget",
+                )
+            if audit_enabled:
+                audit_dump("budget_output", budget_info)
+
+            # 3) Risk
+            risk_prompt = RISK_USER.format(
+                plan_skeleton=json.dumps(plan_skeleton, ensure_ascii=False),
+            )
+            deadline.check("risk")
+            with stage("risk"):
+                risk_info = await _run_agent_with_retry(
+                    system_prompt=RISK_SYSTEM,
+                    user_prompt=_with_language(risk_prompt, language),
+                    api_base=api_base,
+                    api_key=api_key,
+                    model=model,
+                    response_format=response_format,
+                    timeout_seconds=timeout_seconds,
+                    provider=provider,
+                    max_retries=max_retries,
+                    stage="risk",
+                )
+            if audit_enabled:
+                audit_dump("risk_output", risk_info)
+        except (deadline.DeadlineExceeded, httpx.TimeoutException):
+            if not settings.degrade_enabled:
+                raise
+            budget_info = {"budget_breakdown": {}, "alternatives": []}
+            risk_info = {"risks": [], "fixes": []}
+            skipped.append("budget_risk")
+            level = max(level, degradation.NO_BUDGET_RISK)
+
+    def _finish() -> None:
+        if collect_usage:
+            _log_usage_summary()
+        if usage_token is not None:
+            _usage_collector.reset(usage_token)
+
+    def _degraded(result: PlanResponse, final_level: int) -> PlanResponse:
+        if skipped or final_level >= degradation.SKELETON_ONLY:
+            result.warnings.append(degradation.warning(final_level, language))
+            log_event(
+                "plan_degraded",
+                level=degradation.level_name(final_level),
+                skipped=skipped,
+                in_flight=degradation.in_flight(),
+            )
+        return result
+
+    # Last resort: no time left for the integrator, answer from the planner skeleton alone.
+    if level >= degradation.SKELETON_ONLY or not degradation.fits(1, settings):
+        _finish()
+        return _degraded(_plan_from_skeleton(req, plan_skeleton, budget_info, budget, language), degradation.SKELETON_ONLY)
+
+    # 4b) Long trips: overview + blocks of days generated concurrently instead of one long completion.
+    if settings.plan_shard_min_days > 0 and req.days >= settings.plan_shard_min_days:
+        try:
+            result = await _integrate_sharded(req, plan_skeleton, budget_info, risk_info, budget, language, settings)
+        finally:
+            _finish()
+        return _degraded(result, level)
 
     # 4) Integrator (with retries + schema validation)
-    schema = _format_schema()
     last_error = None
 
     integrator_messages = []
 
-    for _ in range(max_retries):
-        integrator_prompt = INTEGRATOR_USER.format(
-            plan_skeleton=json.dumps(plan_skeleton, ensure_ascii=False),
-            budget_info=json.dumps(budget_info, ensure_ascii=False),
-            risk_info=json.dumps(risk_info, ensure_ascii=False),
-            schema=schema,
-            language=language,
+    for attempt in range(max_retries):
+        integrator_prompt = _with_language(
+            INTEGRATOR_USER.format(
+                plan_skeleton=json.dumps(plan_skeleton, ensure_ascii=False),
+                budget_info=json.dumps(budget_info, ensure_ascii=False),
+                risk_info=json.dumps(risk_info, ensure_ascii=False),
+            ),
+            language,
         )
 
         if integrator_messages:
             # 如果之前失败，追加修正提示
             integrator_prompt = integrator_messages[-1]
 
-        final_content = await _call_agent(
-            INTEGRATOR_SYSTEM.format(language=language),
-            integrator_prompt,
-            api_base,
-            api_key,
-            model,
-            response_format,
-            timeout_seconds,
-            provider,
-        )
+        try:
+            deadline.check("integrator")
+            with stage("integrator"):
+                final_content = await _call_agent(
+                    _integrator_system(),
+                    integrator_prompt,
+                    api_base,
+                    api_key,
+                    model,
+                    response_format,
+                    timeout_seconds,
+                    provider,
+                    stage="integrator",
+                    attempt=attempt,
+                    schema=PlanResponse,
+                )
+        except (deadline.DeadlineExceeded, httpx.TimeoutException):
+            if not settings.degrade_enabled:
+                raise
+            _finish()
+            return _degraded(_plan_from_skeleton(req, plan_skeleton, budget_info, budget, language), degradation.SKELETON_ONLY)
         try:
             data = _extract_json_object(final_content)
             result = PlanResponse.model_validate(data)
-            if collect_usage:
-                _log_usage_summary()
-            if usage_token is not None:
-                _usage_collector.reset(usage_token)
-            return result
+            _finish()
+            return _degraded(result, level)
         except (json.JSONDecodeError, ValidationError) as exc:
             last_error = exc
             integrator_messages.append(
@@ -300,14 +423,259 @@ async def generate_plan_with_llm(req: PlanRequest, user_id: str | None = None, s
                 f"{exc}\n"
                 "Return ONLY valid JSON that matches the schema."
             )
-    if collect_usage:
-        _log_usage_summary()
-    if usage_token is not None:
-        _usage_collector.reset(usage_token)
+    _finish()
     raise RuntimeError(f"LLM output invalid: {last_error}")
 
 
 
+def _rag_query_text(req: PlanRequest | PlanPrefetchRequest) -> str:
+    return " ".join(
+        [
+            req.origin or "",
+            req.destination or "",
+            req.budget_text or "",
+            " ".join(req.preferences or []),
+            " ".join(req.constraints or []),
+        ]
+    ).strip()
+
+
+def _plan_from_skeleton(
+    req: PlanRequest,
+    plan_skeleton: Dict[str, Any],
+    budget_info: Dict[str, Any],
+    budget: str,
+    language: str,
+) -> PlanResponse:
+    # Valid PlanResponse built without the integrator: themes/highlights become activity titles,
+    # everything the integrator would have filled in is marked as pending.
+    pending = "TBD" if language == "English" else "待定"
+    summary = str(plan_skeleton.get("summary") or "").strip()
+
+    daily_plan = []
+    for index, entry in enumerate(_skeleton_days(plan_skeleton, req.days)):
+        theme = entry["theme"] or pending
+        titles = entry["highlights"]
+        slots = []
+        for slot in range(3):
+            slots.append(
+                {
+                    "title": titles[slot] if slot < len(titles) else theme,
+                    "transport": pending,
+                    "duration_hours": 3.0,
+                    "cost_range": pending,
+                    "alternatives": [],
+                }
+            )
+        daily_plan.append({"day": index + 1, "morning": slots[0], "afternoon": slots[1], "evening": slots[2]})
+
+    breakdown = budget_info.get("budget_breakdown") if isinstance(budget_info, dict) else None
+    breakdown = breakdown if isinstance(breakdown, dict) else {}
+    return PlanResponse.model_validate(
+        {
+            "top_destinations": [
+                {
+                    "name": req.destination or pending,
+                    "reasons": [summary] if summary else [],
+                    "budget_range": budget,
+                    "transport": pending,
+                    "best_season": pending,
+                }
+            ],
+            "daily_plan": daily_plan,
+            "budget_breakdown": {
+                key: str(breakdown.get(key) or pending)
+                for key in ("transport", "lodging", "food", "tickets", "local_transport")
+            },
+            "warnings": [],
+        }
+    )
+
+
+def _skeleton_days(plan_skeleton: Dict[str, Any], days: int) -> List[Dict[str, Any]]:
+    # One normalized {day, theme, highlights} entry per trip day, whatever shape the planner returned.
+    entries = plan_skeleton.get("daily_skeleton")
+    entries = entries if isinstance(entries, list) else []
+    normalized = []
+    for index in range(days):
+        entry = entries[index] if index < len(entries) else {}
+        if not isinstance(entry, dict):
+            entry = {"theme": str(entry)}
+        highlights = entry.get("highlights")
+        if isinstance(highlights, str):
+            highlights = [highlights]
+        normalized.append(
+            {
+                "day": index + 1,
+                "theme": str(entry.get("theme") or "").strip(),
+                "highlights": [str(h).strip() for h in (highlights or []) if str(h).strip()],
+            }
+        )
+    return normalized
+
+
+def _shard_ranges(days: int, size: int) -> List[Tuple[int, int]]:
+    return [(first, min(first + size - 1, days)) for first in range(1, days + 1, size)]
+
+
+def _check_day_block(data: Dict[str, Any], first: int, last: int) -> List[Dict[str, Any]]:
+    days = sorted(DayBlock.model_validate(data).daily_plan, key=lambda d: d.day)
+    if len(days) != last - first + 1:
+        raise ValueError(f"expected {last - first + 1} days ({first}-{last}), got {len(days)}")
+    # Models sometimes restart numbering at 1 inside a block; position is authoritative.
+    return [day.model_copy(update={"day": first + offset}).model_dump() for offset, day in enumerate(days)]
+
+
+def _outline_warning(first: int, last: int, language: str) -> str:
+    if language == "English":
+        return f"Days {first}-{last} are outline-only: detailed planning for them failed, please retry later."
+    return f"第{first}-{last}天仅为概要：详细行程生成失败，请稍后重试。"
+
+
+async def _generate_validated(
+    settings: Settings,
+    stage_name: str,
+    system_prompt: str,
+    user_prompt: str,
+    language: str,
+    validate: Any,
+    schema: type[BaseModel] | None = None,
+) -> Any:
+    # Like the integrator loop, but the correction is appended to the original prompt.
+    provider = settings.llm_provider.strip().lower()
+    correction = ""
+    last_error = None
+    for attempt in range(settings.llm_max_retries):
+        deadline.check(stage_name)
+        content = await _call_agent(
+            system_prompt,
+            _with_language(user_prompt + correction, language),
+            settings.llm_api_base,
+            settings.llm_api_key.strip(),
+            settings.llm_model,
+            settings.llm_response_format,
+            settings.llm_timeout_seconds,
+            provider,
+            stage=stage_name,
+            attempt=attempt,
+            schema=schema,
+        )
+        try:
+            return validate(_extract_json_object(content))
+        except (json.JSONDecodeError, ValueError) as exc:
+            last_error = exc
+            correction = (
+                "\nPrevious output failed validation:\n"
+                f"{exc}\n"
+                "Return ONLY valid JSON that matches the schema.\n"
+            )
+    raise RuntimeError(f"LLM output invalid ({stage_name}): {last_error}")
+
+
+async def _integrate_sharded(
+    req: PlanRequest,
+    plan_skeleton: Dict[str, Any],
+    budget_info: Dict[str, Any],
+    risk_info: Dict[str, Any],
+    budget: str,
+    language: str,
+    settings: Settings,
+) -> PlanResponse:
+    # The planner skeleton is the overall route. One overview call (destinations, budget) and one
+    # call per block of days run concurrently, so no completion has to cover the whole trip and a
+    # failed or truncated block costs only its own days (they fall back to the skeleton outline).
+    skeleton_days = _skeleton_days(plan_skeleton, req.days)
+    ranges = _shard_ranges(req.days, settings.plan_shard_days)
+    route = "\n".join(
+        f"day {d['day']}: {d['theme'] or '?'}" + (f" ({', '.join(d['highlights'])})" if d["highlights"] else "")
+        for d in skeleton_days
+    )
+    gate = asyncio.Semaphore(settings.plan_shard_concurrency)
+
+    async def _overview() -> Dict[str, Any]:
+        prompt = SHARD_OVERVIEW_USER.format(
+            plan_skeleton=json.dumps(plan_skeleton, ensure_ascii=False),
+            budget_info=json.dumps(budget_info, ensure_ascii=False),
+            risk_info=json.dumps(risk_info, ensure_ascii=False),
+        )
+        async with gate:
+            return await _generate_validated(
+                settings,
+                "shard_overview",
+                _shard_overview_system(),
+                prompt,
+                language,
+                lambda data: PlanOverview.model_validate(data).model_dump(),
+                schema=PlanOverview,
+            )
+
+    async def _block(first: int, last: int) -> List[Dict[str, Any]]:
+        prompt = SHARD_DAYS_USER.format(
+            destination=req.destination or "???",
+            days=req.days,
+            start_date=req.start_date,
+            travelers=req.travelers,
+            budget=budget,
+            pace=req.pace,
+            route=route,
+            first_day=first,
+            last_day=last,
+            day_skeleton=json.dumps(skeleton_days[first - 1 : last], ensure_ascii=False),
+            budget_info=json.dumps(budget_info.get("budget_breakdown") or {}, ensure_ascii=False),
+            fixes=json.dumps(risk_info.get("fixes") or [], ensure_ascii=False),
+        )
+        async with gate:
+            return await _generate_validated(
+                settings,
+                "shard_days",
+                _shard_days_system(),
+                prompt,
+                language,
+                lambda data: _check_day_block(data, first, last),
+                schema=DayBlock,
+            )
+
+    with stage("shards"):
+        overview, *blocks = await asyncio.gather(
+            _overview(),
+            *(_block(first, last) for first, last in ranges),
+            return_exceptions=True,
+        )
+
+    fallback = _plan_from_skeleton(req, plan_skeleton, budget_info, budget, language).model_dump()
+    if isinstance(overview, BaseException):
+        if isinstance(overview, asyncio.CancelledError) or not settings.degrade_enabled:
+            raise overview
+        log_event("plan_shard_fallback", level=logging.WARNING, part="overview", error=str(overview))
+        overview = {"top_destinations": fallback["top_destinations"], "budget_breakdown": fallback["budget_breakdown"], "warnings": []}
+
+    daily_plan: List[Dict[str, Any]] = []
+    warnings = list(overview["warnings"])
+    failed = 0
+    for (first, last), block in zip(ranges, blocks):
+        if isinstance(block, asyncio.CancelledError):
+            raise block
+        if isinstance(block, BaseException):
+            failed += 1
+            log_event("plan_shard_fallback", level=logging.WARNING, part=f"days_{first}-{last}", error=str(block))
+            daily_plan.extend(fallback["daily_plan"][first - 1 : last])
+            warnings.append(_outline_warning(first, last, language))
+        else:
+            daily_plan.extend(block)
+    if failed == len(ranges) and not settings.degrade_enabled:
+        raise RuntimeError(f"LLM output invalid: {blocks[0]}")
+
+    log_event("plan_sharded", days=req.days, blocks=len(ranges), failed=failed)
+    return PlanResponse.model_validate(
+        {
+            "top_destinations": overview["top_destinations"],
+            "daily_plan": daily_plan,
+            "budget_breakdown": overview["budget_breakdown"],
+            "warnings": warnings,
+        }
+    )
+
+
 def _build_user_prompt(req: PlanRequest) -> str:
     budget = req.budget_text or _budget_range(req)
     schema = json.dumps(PlanResponse.model_json_schema(), ensure_ascii=True)
@@ -349,16 +717,18 @@ def _log_usage_summary() -> None:
         return
     total = sum(collector)
     avg = total / len(collector)
-    print("[llm_avg_tokens]", f"calls={len(collector)} total_tokens={total} avg_total_tokens={avg:.1f}")
+    log_event("llm_avg_tokens", calls=len(collector), total_tokens=total, avg_total_tokens=round(avg, 1))
 
-def _maybe_log_usage(data: Dict[str, Any]) -> None:
+def _maybe_log_usage(usage: Dict[str, Any], stage_name: str) -> None:
+    if not usage:
+        return
+    # Per-stage totals (including prefix-cache hits) always land on the request log line.
+    cached_tokens = (usage.get("prompt_tokens_details") or {}).get("cached_tokens") or 0
+    record_llm_usage(stage_name, usage.get("prompt_tokens") or 0, usage.get("completion_tokens") or 0, cached_tokens)
     enabled = os.getenv("LLM_USAGE_LOG", "false").lower() == "true"
     if not enabled:
         return
-    usage = data.get("usage")
-    if usage is None:
-        return
-    print("[llm_usage]", usage)
+    log_event("llm_usage", stage=stage_name, cached_tokens=cached_tokens, usage=usage)
     collector = _usage_collector.get()
     if collector is not None:
         total_tokens = usage.get("total_tokens")
@@ -366,6 +736,9 @@ def _maybe_log_usage(data: Dict[str, Any]) -> None:
             collector.append(total_tokens)
 
 
+_SCHEMA_NAMES = {PlanResponse: "travel_plan", PlanOverview: "plan_overview", DayBlock: "day_block"}
+
+
 async def _call_openai(
     api_base: str,
     api_key: str,
@@ -373,7 +746,8 @@ async def _call_openai(
     messages: List[Dict[str, Any]],
     response_format: str,
     timeout_seconds: int,
-) -> str:
+    schema: type[BaseModel] | None = None,
+) -> Tuple[str, Dict[str, Any]]:
     url = f"{api_base.rstrip('/')}/chat/completions"
     payload: Dict[str, Any] = {
         "model": model,
@@ -381,12 +755,14 @@ async def _call_openai(
         "temperature": 0.2,
     }
 
-    if response_format == "json_schema":
+    # Only calls that produce a schema-bound object (integrator, shard overview / day blocks)
+    # are constrained; planner, budget, risk and summaries return free-form JSON objects.
+    if response_format == "json_schema" and schema is not None:
         payload["response_format"] = {
             "type": "json_schema",
             "json_schema": {
-                "name": "travel_plan",
-                "schema": PlanResponse.model_json_schema(),
+                "name": _SCHEMA_NAMES.get(schema, schema.__name__),
+                "schema": schema.model_json_schema(),
                 "strict": True,
             },
         }
@@ -398,14 +774,12 @@ async def _call_openai(
         "Content-Type": "application/json",
     }
 
-    async with httpx.AsyncClient(timeout=timeout_seconds) as client:
-        resp = await client.post(url, headers=headers, json=payload)
-        resp.raise_for_status()
-        data = resp.json()
-        _maybe_log_usage(data)
+    resp = await get_client("llm").post(url, headers=headers, json=payload, timeout=timeout_seconds)
+    resp.raise_for_status()
+    data = resp.json()
 
     try:
-        return data["choices"][0]["message"]["content"]
+        return data["choices"][0]["message"]["content"], data.get("usage") or {}
     except (KeyError, IndexError, TypeError) as exc:
         raise RuntimeError(f"Unexpected LLM response: {data}") from exc
 
@@ -416,7 +790,7 @@ async def _call_github_models(
     model: str,
     messages: List[Dict[str, Any]],
     timeout_seconds: int,
-) -> str:
+) -> Tuple[str, Dict[str, Any]]:
     url = f"{api_base.rstrip('/')}/chat/completions"
     payload: Dict[str, Any] = {
         "model": model,
@@ -430,14 +804,12 @@ async def _call_github_models(
         "Content-Type": "application/json",
     }
 
-    async with httpx.AsyncClient(timeout=timeout_seconds) as client:
-        resp = await client.post(url, headers=headers, json=payload)
-        resp.raise_for_status()
-        data = resp.json()
-        _maybe_log_usage(data)
+    resp = await get_client("llm").post(url, headers=headers, json=payload, timeout=timeout_seconds)
+    resp.raise_for_status()
+    data = resp.json()
 
     try:
-        return data["choices"][0]["message"]["content"]
+        return data["choices"][0]["message"]["content"], data.get("usage") or {}
     except (KeyError, IndexError, TypeError) as exc:
         raise RuntimeError(f"Unexpected LLM response: {data}") from exc
 
@@ -468,27 +840,57 @@ async def _call_agent(
     response_format: str,
     timeout_seconds: int,
     provider: str,
+    stage: str = "agent",
+    attempt: int = 0,
+    schema: type[BaseModel] | None = None,
 ) -> str:
     messages = [
         {"role": "system", "content": system_prompt},
         {"role": "user", "content": user_prompt},
     ]
-    if provider == "github":
-        return await _call_github_models(
-            api_base=api_base,
-            api_key=api_key,
-            model=model,
-            messages=messages,
-            timeout_seconds=timeout_seconds,
-        )
-    return await _call_openai(
-        api_base=api_base,
-        api_key=api_key,
-        model=model,
-        messages=messages,
-        response_format=response_format,
-        timeout_seconds=timeout_seconds,
-    )
+    cache_mode = llm_cache.mode()
+    cache_key = ""
+    if cache_mode != "passthrough":
+        cache_key = llm_cache.cache_key(provider, model, system_prompt, user_prompt, response_format)
+        if cache_mode in {"replay", "auto"}:
+            cached = await llm_cache.lookup(cache_key)
+            if cached is not None:
+                return cached
+            if cache_mode == "replay":
+                raise llm_cache.LLMCacheMiss(f"LLM cache miss in replay mode: {cache_key}")
+
+    # Never wait past the request deadline, whatever LLM_TIMEOUT_SECONDS allows.
+    timeout_seconds = deadline.timeout_for(timeout_seconds, minimum=2.0)
+    started = time.perf_counter()
+    usage: Dict[str, Any] = {}
+    status = "error"
+    try:
+        if provider == "github":
+            content, usage = await _call_github_models(
+                api_base=api_base,
+                api_key=api_key,
+                model=model,
+                messages=messages,
+                timeout_seconds=timeout_seconds,
+            )
+        else:
+            content, usage = await _call_openai(
+                api_base=api_base,
+                api_key=api_key,
+                model=model,
+                messages=messages,
+                response_format=response_format,
+                timeout_seconds=timeout_seconds,
+                schema=schema,
+            )
+        status = "ok"
+    finally:
+        # Buffered in memory only; a background job batches rows into llm_usage.
+        usage_log.record(stage, model, attempt, status, int((time.perf_counter() - started) * 1000), usage)
+    _maybe_log_usage(usage, stage)
+    if cache_key:
+        await llm_cache.store(cache_key, provider, model, content)
+    return content
 
 #把模型返回的内容解析成 JSON 对象
 def _parse_json_or_raise(content: str) -> Dict[str, Any]:
@@ -502,6 +904,27 @@ def _format_schema() -> str:
     return json.dumps(PlanResponse.model_json_schema(), ensure_ascii=True)
 
 
+@lru_cache
+def _integrator_system() -> str:
+    # Byte-identical on every call so the provider can cache guard + rules + schema as one prefix.
+    return INTEGRATOR_SYSTEM + _format_schema() + "\n"
+
+
+@lru_cache
+def _shard_overview_system() -> str:
+    return SHARD_OVERVIEW_SYSTEM + json.dumps(PlanOverview.model_json_schema(), ensure_ascii=True) + "\n"
+
+
+@lru_cache
+def _shard_days_system() -> str:
+    return SHARD_DAYS_SYSTEM + json.dumps(DayBlock.model_json_schema(), ensure_ascii=True) + "\n"
+
+
+def _with_language(prompt: str, language: str) -> str:
+    # The only per-language text goes last, after all request data.
+    return prompt.rstrip("\n") + "\n" + LANGUAGE_SUFFIX.format(language=language)
+
+
 def _format_rag_context(chunks: List[Dict[str, Any]]) -> str:
     if not chunks:
         return ""
@@ -524,10 +947,11 @@ async def _run_agent_with_retry(
     timeout_seconds: int,
     provider: str,
     max_retries: int,
+    stage: str = "agent",
 ) -> Dict[str, Any]:
     last_error = None
     prompt = user_prompt
-    for _ in range(max_retries):
+    for attempt in range(max_retries):
         content = await _call_agent(
             system_prompt,
             prompt,
@@ -537,6 +961,8 @@ async def _run_agent_with_retry(
             response_format,
             timeout_seconds,
             provider,
+            stage=stage,
+            attempt=attempt,
         )
         try:
             return _parse_json_or_raise(content)
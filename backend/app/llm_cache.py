@@ -0,0 +1,99 @@
+import asyncio
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from typing import Any, Dict
+
+from .logs import log_event
+from .settings import get_settings
+
+# Content-addressed cache of raw LLM completions, for evals and prompt debugging.
+#   passthrough  no caching (default)
+#   record       always call the model and store the completion
+#   replay       answer only from the cache; a miss is an error, so runs stay deterministic
+#   auto         replay hits, record misses
+# Rows live in one SQLite file (LLM_CACHE_PATH) keyed by sha256 of the call inputs.
+
+MODES = {"passthrough", "record", "replay", "auto"}
+
+_lock = threading.Lock()
+_conn: sqlite3.Connection | None = None
+_stats: Dict[str, int] = {"hits": 0, "misses": 0, "writes": 0}
+
+
+class LLMCacheMiss(RuntimeError):
+    pass
+
+
+def mode() -> str:
+    value = get_settings().llm_cache_mode
+    return value if value in MODES else "passthrough"
+
+
+def cache_key(provider: str, model: str, system_prompt: str, user_prompt: str, response_format: str) -> str:
+    raw = json.dumps([provider, model, system_prompt, user_prompt, response_format], ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _connection() -> sqlite3.Connection:
+    global _conn
+    if _conn is None:
+        _conn = sqlite3.connect(get_settings().llm_cache_path, check_same_thread=False)
+        _conn.execute(
+            """
+            create table if not exists llm_calls (
+              key text primary key,
+              provider text not null,
+              model text not null,
+              content text not null,
+              created_at real not null
+            )
+            """
+        )
+        _conn.commit()
+    return _conn
+
+
+def _read(key: str) -> str | None:
+    with _lock:
+        row = _connection().execute("select content from llm_calls where key = ?", (key,)).fetchone()
+    return row[0] if row else None
+
+
+def _write(key: str, provider: str, model: str, content: str) -> None:
+    with _lock:
+        conn = _connection()
+        conn.execute(
+            "insert or replace into llm_calls (key, provider, model, content, created_at) values (?, ?, ?, ?, ?)",
+            (key, provider, model, content, time.time()),
+        )
+        conn.commit()
+
+
+async def lookup(key: str) -> str | None:
+    content = await asyncio.to_thread(_read, key)
+    _stats["hits" if content is not None else "misses"] += 1
+    return content
+
+
+async def store(key: str, provider: str, model: str, content: str) -> None:
+    try:
+        await asyncio.to_thread(_write, key, provider, model, content)
+        _stats["writes"] += 1
+    except sqlite3.Error as exc:
+        # Recording is best effort; the live answer has already been produced.
+        log_event("llm_cache", status="write_error", error=str(exc))
+
+
+def stats() -> Dict[str, Any]:
+    return {"mode": mode(), **_stats}
+
+
+def close() -> None:
+    global _conn
+    with _lock:
+        if _conn is not None:
+            _conn.close()
+            _conn = None
@@ -0,0 +1,119 @@
+import contextvars
+import json
+import logging
+import queue
+import random
+import sys
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Any, Dict, Iterator
+
+from .settings import get_settings
+
+# Structured JSON-lines logging. Records are handed to a queue on the event loop and
+# formatted/written by a listener thread, so slow stdout never blocks a request.
+
+_logger = logging.getLogger("etravel")
+_listener: QueueListener | None = None
+
+# Per-request fields (request_id, user_id, stage timings), set by the request middleware.
+_request_ctx: contextvars.ContextVar[Dict[str, Any] | None] = contextvars.ContextVar("request_ctx", default=None)
+
+
+class _JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        payload: Dict[str, Any] = {
+            "ts": datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname.lower(),
+            "event": record.getMessage(),
+        }
+        payload.update(getattr(record, "fields", None) or {})
+        return json.dumps(payload, ensure_ascii=False, default=str)
+
+
+def setup_logging() -> None:
+    global _listener
+    if _listener is not None:
+        return
+    log_queue: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+    stream = logging.StreamHandler(sys.stdout)
+    stream.setFormatter(_JsonFormatter())
+    _listener = QueueListener(log_queue, stream, respect_handler_level=False)
+    _logger.handlers[:] = [QueueHandler(log_queue)]
+    _logger.setLevel(logging.INFO)
+    _logger.propagate = False
+    _listener.start()
+
+
+def shutdown_logging() -> None:
+    global _listener
+    if _listener is None:
+        return
+    _listener.stop()
+    _listener = None
+
+
+def log_event(event: str, level: int = logging.INFO, **fields: Any) -> None:
+    if _listener is None:
+        setup_logging()
+    ctx = _request_ctx.get()
+    if ctx is not None:
+        fields = {"request_id": ctx["request_id"], "user_id": ctx.get("user_id"), **fields}
+    _logger.log(level, event, extra={"fields": fields})
+
+
+def audit_dump(event: str, payload: Any) -> None:
+    # Large intermediate outputs (planner/budget/risk JSON) are sampled; callers gate on the audit flag.
+    if random.random() < get_settings().log_dump_sample_rate:
+        log_event(event, payload=payload)
+
+
+def begin_request(request_id: str) -> contextvars.Token:
+    return _request_ctx.set({"request_id": request_id, "user_id": None, "stages": {}, "llm": {}})
+
+
+def end_request(token: contextvars.Token) -> Dict[str, Any]:
+    ctx = _request_ctx.get() or {}
+    _request_ctx.reset(token)
+    return ctx
+
+
+def current_request_id() -> str | None:
+    ctx = _request_ctx.get()
+    return ctx["request_id"] if ctx else None
+
+
+def current_user_id() -> str | None:
+    ctx = _request_ctx.get()
+    return ctx.get("user_id") if ctx else None
+
+
+def set_user_id(user_id: Any) -> None:
+    ctx = _request_ctx.get()
+    if ctx is not None:
+        ctx["user_id"] = str(user_id) if user_id is not None else None
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        ctx = _request_ctx.get()
+        if ctx is not None:
+            stages = ctx["stages"]
+            stages[name] = stages.get(name, 0) + int((time.perf_counter() - started) * 1000)
+
+
+def record_llm_usage(stage_name: str, prompt_tokens: int, completion_tokens: int, cached_tokens: int) -> None:
+    ctx = _request_ctx.get()
+    if ctx is None:
+        return
+    totals = ctx["llm"].setdefault(stage_name, {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0, "cached_tokens": 0})
+    totals["calls"] += 1
+    totals["prompt_tokens"] += prompt_tokens
+    totals["completion_tokens"] += completion_tokens
+    totals["cached_tokens"] += cached_tokens
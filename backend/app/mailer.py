@@ -0,0 +1,115 @@
+import asyncio
+import logging
+from typing import Any, Dict, List
+
+import httpx
+
+from . import db
+from .http_clients import get_client
+from .logs import log_event
+from .settings import Settings, get_settings
+
+RESEND_URL = "https://api.resend.com/emails"
+RESEND_BATCH_URL = "https://api.resend.com/emails/batch"
+
+_wakeup: asyncio.Event | None = None
+
+
+class _SendError(Exception):
+    def __init__(self, message: str, retryable: bool):
+        super().__init__(message)
+        self.retryable = retryable
+
+
+def wake() -> None:
+    # Start delivering right away instead of waiting for the next poll.
+    if _wakeup is not None:
+        _wakeup.set()
+
+
+def _message(settings: Settings, to_email: str, subject: str, text: str) -> Dict[str, Any]:
+    return {"from": settings.email_from, "to": [to_email], "subject": subject, "text": text}
+
+
+async def _post(settings: Settings, url: str, payload: Any) -> None:
+    if not settings.resend_api_key:
+        raise _SendError("RESEND_API_KEY not set", retryable=False)
+    if not settings.email_from:
+        raise _SendError("EMAIL_FROM not set", retryable=False)
+    client = get_client("resend", timeout=20.0)
+    try:
+        resp = await client.post(url, headers={"Authorization": f"Bearer {settings.resend_api_key}"}, json=payload)
+    except httpx.HTTPError as exc:
+        raise _SendError(f"Resend request failed: {exc}", retryable=True) from exc
+    if resp.status_code >= 400:
+        retryable = resp.status_code == 429 or resp.status_code >= 500
+        raise _SendError(f"Resend error: {resp.status_code} {resp.text}", retryable=retryable)
+
+
+def _backoff_seconds(settings: Settings, attempts: int) -> float:
+    return min(settings.email_outbox_backoff_seconds * (2 ** (attempts - 1)), 300.0)
+
+
+async def _fail(settings: Settings, item: Dict[str, Any], exc: _SendError) -> None:
+    exhausted = item["attempts"] >= settings.email_outbox_max_attempts
+    # Codes expire, so an email that is too old is dead-lettered instead of retried.
+    too_old = item["age_seconds"] >= settings.email_outbox_max_age_seconds
+    retry_in = None if (not exc.retryable or exhausted or too_old) else _backoff_seconds(settings, item["attempts"])
+    await db.mark_outbox_failed(item["id"], str(exc), retry_in)
+    if retry_in is None:
+        log_event("email_dead_lettered", level=logging.WARNING, outbox_id=item["id"], attempts=item["attempts"], error=str(exc))
+
+
+async def _deliver(settings: Settings, batch: List[Dict[str, Any]]) -> None:
+    messages = [_message(settings, i["to_email"], i["subject"], i["body"]) for i in batch]
+    try:
+        if len(batch) == 1:
+            await _post(settings, RESEND_URL, messages[0])
+        else:
+            await _post(settings, RESEND_BATCH_URL, messages)
+        await db.mark_outbox_sent([i["id"] for i in batch])
+        return
+    except _SendError as exc:
+        if len(batch) == 1 or exc.retryable:
+            for item in batch:
+                await _fail(settings, item, exc)
+            return
+    # The batch was rejected as a whole; send one by one to isolate the bad message.
+    for item, message in zip(batch, messages):
+        try:
+            await _post(settings, RESEND_URL, message)
+            await db.mark_outbox_sent([item["id"]])
+        except _SendError as exc:
+            await _fail(settings, item, exc)
+
+
+def _batch_size(settings: Settings) -> int:
+    # Resend accepts at most 100 messages per batch call.
+    return max(1, min(settings.email_outbox_batch_size, 100))
+
+
+async def dispatch_once(settings: Settings | None = None) -> int:
+    settings = settings or get_settings()
+    batch = await db.claim_outbox_emails(batch_size=_batch_size(settings), lease_seconds=60)
+    if batch:
+        await _deliver(settings, batch)
+    return len(batch)
+
+
+async def run_dispatcher() -> None:
+    global _wakeup
+    _wakeup = asyncio.Event()
+    settings = get_settings()
+    while True:
+        try:
+            while await dispatch_once(settings) >= _batch_size(settings):
+                pass
+        except asyncio.CancelledError:
+            raise
+        except Exception as exc:
+            log_event("email_dispatch_error", level=logging.ERROR, error=str(exc))
+        try:
+            await asyncio.wait_for(_wakeup.wait(), timeout=settings.email_outbox_poll_seconds)
+        except asyncio.TimeoutError:
+            pass
+        _wakeup.clear()
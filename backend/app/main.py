@@ -1,11 +1,19 @@
+import time
+
+_IMPORT_STARTED = time.perf_counter()
+
+import logging
 import os
 import asyncio
+import base64
+import hashlib
 import sys
 import secrets
+import uuid
+from contextlib import asynccontextmanager
 from datetime import datetime, timedelta, timezone
 
 import jwt
-import httpx
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -14,11 +22,12 @@ load_dotenv()
 if sys.platform == "win32":
     asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
 
-from fastapi import FastAPI, HTTPException, Header, Depends
+from fastapi import FastAPI, HTTPException, Header, Depends, Query
 from fastapi.middleware.cors import CORSMiddleware
-from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.datastructures import Headers, MutableHeaders
 from starlette.requests import Request
-from starlette.responses import Response
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from starlette.responses import Response, StreamingResponse
 
 from .schemas import (
     PlanRequest,
@@ -30,42 +39,200 @@ from .schemas import (
     ResetPasswordRequest,
     ResetPasswordConfirmRequest,
     PreferencesRequest,
+    PlanBatchRequest,
+    PlanPrefetchRequest,
 )
-from .llm import generate_plan_with_llm
-from .retrieval import save_user_memory_from_plan
+from .llm import generate_plan_with_llm, prefetch_plan_context, prefetch_shared_context
+from .retrieval import memory_doc_from_plan, prefetch_stats, shared_retrieval, store_user_memory_doc
 from . import db
+from . import degradation
+from . import jobs
+from . import deadline
+from . import llm_cache
+from . import logs
+from . import plan_cache
+from . import plan_jobs
+from . import usage
+from .breaker import breaker_stats
+from .http_clients import close_all as close_http_clients
+from .logs import log_event
+from .responses import dumps, json_response
+from .ratelimit import RateLimitedError, SlidingWindowLimiter
 from .settings import get_settings
-
-app = FastAPI(title='Travel Planner API')
+from .warmup import warm_up
 
 settings = get_settings()
 
-class RequestLogMiddleware(BaseHTTPMiddleware):
-    async def dispatch(self, request: Request, call_next) -> Response:
-        started = datetime.now(timezone.utc)
-        response = await call_next(request)
-        duration_ms = int((datetime.now(timezone.utc) - started).total_seconds() * 1000)
-        client_ip = request.headers.get("x-forwarded-for", request.client.host if request.client else "-")
-        print(f"[request] {client_ip} {request.method} {request.url.path} {response.status_code} {duration_ms}ms")
-        return response
+_code_ip_limiter = SlidingWindowLimiter(settings.auth_code_max_per_ip, settings.auth_code_window_seconds)
+_prefetch_limiter = SlidingWindowLimiter(settings.prefetch_max_per_minute, 60)
+_batch_limiter = SlidingWindowLimiter(settings.plan_batch_items_per_minute, 60)
+_job_limiter = SlidingWindowLimiter(settings.plan_job_max_per_minute, 60)
+_prefetch_running = 0
 
 
-app.add_middleware(RequestLogMiddleware)
+async def _compact_user_memory() -> None:
+    deleted = await db.compact_user_memory_docs(keep=settings.memory_keep_per_user)
+    if deleted:
+        log_event("job_done", job="memory_compaction", deleted=deleted)
 
 
-async def send_email(to_email: str, subject: str, text: str) -> None:
-    if not settings.resend_api_key:
-        raise RuntimeError("RESEND_API_KEY not set")
-    if not settings.email_from:
-        raise RuntimeError("EMAIL_FROM not set")
-    async with httpx.AsyncClient(timeout=20.0) as client:
-        resp = await client.post(
-            "https://api.resend.com/emails",
-            headers={"Authorization": f"Bearer {settings.resend_api_key}"},
-            json={"from": settings.email_from, "to": [to_email], "subject": subject, "text": text},
-        )
-    if resp.status_code >= 400:
-        raise RuntimeError(f"Resend error: {resp.status_code} {resp.text}")
+async def _sweep_auth_codes() -> None:
+    deleted = await db.sweep_auth_codes(retain_seconds=settings.auth_code_window_seconds)
+    if deleted:
+        log_event("job_done", job="auth_code_sweep", deleted=deleted)
+    deleted = await db.sweep_email_outbox()
+    if deleted:
+        log_event("job_done", job="email_outbox_sweep", deleted=deleted)
+
+
+async def _sweep_plan_jobs() -> None:
+    deleted = await db.sweep_plan_jobs(retention_days=settings.plan_job_retention_days)
+    if deleted:
+        log_event("job_done", job="plan_job_sweep", deleted=deleted)
+
+
+async def _sweep_plan_results() -> None:
+    deleted = await db.sweep_plan_cache()
+    if deleted:
+        log_event("job_done", job="plan_cache_sweep", deleted=deleted)
+    deleted = await db.sweep_plan_results()
+    if deleted:
+        log_event("job_done", job="plan_result_sweep", deleted=deleted)
+
+
+async def _open_db_pool() -> None:
+    # Always opened and checked before serving, so the first requests never pay for it.
+    started = time.perf_counter()
+    try:
+        await db.open_pool()
+        log_event("pool_warmup", duration_ms=int((time.perf_counter() - started) * 1000), **db.pool_stats())
+    except Exception as exc:
+        if settings.db_required_at_startup:
+            raise
+        # Keep serving (anonymous /api/plan works without the DB); the pool retries connecting in the background.
+        log_event("pool_warmup_failed", level=logging.ERROR, error=str(exc))
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global _startup_done
+    logs.setup_logging()
+    started = time.perf_counter()
+    # The pool opens alongside the optional keep-alive touches.
+    pool_task = asyncio.create_task(_open_db_pool())
+    warmup = await warm_up(settings) if settings.startup_warmup else {}
+    await pool_task
+    _startup_done = time.perf_counter()
+    log_event(
+        "startup",
+        import_ms=int((_IMPORT_DONE - _IMPORT_STARTED) * 1000),
+        warmup_ms=int((_startup_done - started) * 1000),
+        warmup=warmup,
+        db_pool=db.pool_stats(),
+    )
+    if settings.cache_notify_enabled:
+        jobs.start("cache_invalidation", db.listen_cache_invalidations)
+    jobs.start_periodic("memory_compaction", settings.memory_compact_interval_seconds, _compact_user_memory)
+    jobs.start_periodic("auth_code_sweep", settings.auth_code_sweep_interval_seconds, _sweep_auth_codes)
+    if settings.llm_usage_enabled:
+        jobs.start_periodic("llm_usage_flush", settings.llm_usage_flush_seconds, usage.flush)
+    for worker in range(settings.plan_job_workers):
+        jobs.start(f"plan_job_worker_{worker}", lambda: plan_jobs.run_worker(_persist_user_plan))
+    jobs.start_periodic("plan_job_sweep", 3600, _sweep_plan_jobs)
+    jobs.start_periodic("plan_result_sweep", 3600, _sweep_plan_results)
+    if settings.plan_precompute_enabled:
+        jobs.start_periodic("plan_precompute", settings.plan_precompute_interval_seconds, plan_cache.run_precompute)
+    if not settings.send_code_in_response and settings.resend_api_key:
+        # Imported lazily: instances running with SEND_CODE_IN_RESPONSE never load the mailer.
+        from . import mailer
+
+        jobs.start("email_outbox", mailer.run_dispatcher)
+    yield
+    await jobs.stop_all()
+    await usage.flush()
+    await close_http_clients()
+    await db.close_pool()
+    llm_cache.close()
+    logs.shutdown_logging()
+
+
+app = FastAPI(title='Travel Planner API', lifespan=lifespan)
+
+
+def _client_ip(request: Request) -> str:
+    # Leading X-Forwarded-For entries are whatever the client sent; only the hops appended by
+    # our own TRUSTED_PROXY_COUNT proxies can be trusted, and the leftmost of those is the client.
+    forwarded = request.headers.get("x-forwarded-for")
+    if forwarded and settings.trusted_proxy_count > 0:
+        hops = [hop.strip() for hop in forwarded.split(",") if hop.strip()]
+        if hops:
+            return hops[max(0, len(hops) - settings.trusted_proxy_count)]
+    return request.client.host if request.client else "-"
+
+
+_startup_done: float | None = None
+_first_request_seen = False
+
+
+def _log_first_request(path: str, status_code: int) -> None:
+    global _first_request_seen
+    if _first_request_seen:
+        return
+    _first_request_seen = True
+    now = time.perf_counter()
+    log_event(
+        "first_request",
+        path=path,
+        status=status_code,
+        since_import_ms=int((now - _IMPORT_STARTED) * 1000),
+        since_ready_ms=int((now - _startup_done) * 1000) if _startup_done else None,
+    )
+
+
+class RequestLogMiddleware:
+    # Pure ASGI (no BaseHTTPMiddleware): no extra task per request and streaming bodies pass straight through.
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        request_id = Headers(scope=scope).get("x-request-id") or uuid.uuid4().hex
+        status_code = 500
+
+        async def send_with_request_id(message: Message) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                MutableHeaders(scope=message).append("x-request-id", request_id)
+            await send(message)
+
+        token = logs.begin_request(request_id)
+        try:
+            await self.app(scope, receive, send_with_request_id)
+        finally:
+            ctx = logs.end_request(token)
+            _log_first_request(scope["path"], status_code)
+            route = scope.get("route")
+            log_event(
+                "request",
+                request_id=request_id,
+                user_id=ctx.get("user_id"),
+                client_ip=_client_ip(Request(scope)),
+                method=scope["method"],
+                path=scope["path"],
+                route=getattr(route, "path", scope["path"]),
+                status=status_code,
+                duration_ms=int((time.perf_counter() - started) * 1000),
+                stages=ctx.get("stages") or {},
+                llm=ctx.get("llm") or {},
+            )
+
+
+app.add_middleware(RequestLogMiddleware)
 
 
 app.add_middleware(
@@ -77,6 +244,41 @@ app.add_middleware(
 )
 
 
+def _rate_limited(exc: RateLimitedError) -> HTTPException:
+    return HTTPException(
+        status_code=429,
+        detail="Too many code requests, try again later",
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
+
+async def _store_code(
+    request: Request,
+    email: str,
+    code: str,
+    purpose: str,
+    outbox_email: tuple[str, str] | None = None,
+) -> None:
+    if outbox_email is not None and not (settings.resend_api_key and settings.email_from):
+        raise HTTPException(status_code=500, detail="Failed to send email")
+    try:
+        _code_ip_limiter.hit(_client_ip(request))
+        await db.store_code(
+            email,
+            code,
+            purpose,
+            max_per_email=settings.auth_code_max_per_email,
+            window_seconds=settings.auth_code_window_seconds,
+            outbox_email=outbox_email,
+        )
+    except RateLimitedError as exc:
+        raise _rate_limited(exc) from exc
+    if outbox_email is not None:
+        from . import mailer
+
+        mailer.wake()
+
+
 def create_token(user: dict) -> str:
     if not db.JWT_SECRET:
         raise RuntimeError("JWT_SECRET not set")
@@ -94,9 +296,10 @@ def get_optional_user(authorization: str | None) -> dict | None:
     token = parts[1]
     try:
         payload = jwt.decode(token, db.JWT_SECRET, algorithms=["HS256"])
-        return {"id": payload.get("sub"), "email": payload.get("email")}
     except Exception:
         raise HTTPException(status_code=401, detail="Invalid token")
+    logs.set_user_id(payload.get("sub"))
+    return {"id": payload.get("sub"), "email": payload.get("email")}
 
 
 def optional_user_dep(authorization: str | None = Header(default=None)) -> dict | None:
@@ -109,9 +312,33 @@ def current_user_dep(user: dict | None = Depends(optional_user_dep)) -> dict:
     return user
 
 
+def admin_dep(x_admin_token: str | None = Header(default=None)) -> None:
+    # Operator-only endpoints do not exist unless ADMIN_TOKEN is set.
+    if not settings.admin_token:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not x_admin_token or not secrets.compare_digest(x_admin_token, settings.admin_token):
+        raise HTTPException(status_code=403, detail="Forbidden")
+
+
 @app.get('/health')
 async def health():
-    return {'status': 'ok'}
+    # Still 200 while a breaker is open: the plan path degrades instead of failing.
+    breakers = breaker_stats()
+    degraded = sorted(name for name, b in breakers.items() if b["state"] != "closed")
+    return {'status': 'degraded' if degraded else 'ok', 'open_circuits': degraded}
+
+
+@app.get('/metrics', dependencies=[Depends(admin_dep)])
+async def metrics():
+    return {
+        "db_pool": db.pool_stats(),
+        "cache": db.cache_stats(),
+        "breakers": breaker_stats(),
+        "llm_cache": llm_cache.stats(),
+        "plan_cache": plan_cache.stats(),
+        "llm_usage": usage.stats(),
+        "prefetch": {**prefetch_stats(), "running": _prefetch_running},
+    }
 
 
 @app.post('/api/auth/register')
@@ -127,17 +354,13 @@ async def register(req: AuthRegisterRequest):
 
 
 @app.post('/api/auth/register/request')
-async def register_code_request(req: AuthCodeRequest):
+async def register_code_request(req: AuthCodeRequest, request: Request):
     if await db.get_user_by_email(req.email):
         raise HTTPException(status_code=400, detail="Email already registered")
     code = f"{secrets.randbelow(1000000):06d}"
-    await db.store_code(req.email, code, "register")
     send_code = settings.send_code_in_response
-    if not send_code:
-        try:
-            await send_email(req.email, "E-Travel 注册验证码", f"你的注册验证码是：{code}\n10 分钟内有效。")
-        except Exception:
-            raise HTTPException(status_code=500, detail="Failed to send email")
+    outbox_email = None if send_code else ("E-Travel 注册验证码", f"你的注册验证码是：{code}\n10 分钟内有效。")
+    await _store_code(request, req.email, code, "register", outbox_email)
     return {"message": "code sent", **({"code": code} if send_code else {})}
 
 
@@ -151,18 +374,14 @@ async def login(req: AuthLoginRequest):
 
 
 @app.post('/api/auth/login-code/request')
-async def login_code_request(req: AuthCodeRequest):
+async def login_code_request(req: AuthCodeRequest, request: Request):
     user = await db.get_user_by_email(req.email)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     code = f"{secrets.randbelow(1000000):06d}"
-    await db.store_code(req.email, code, "login")
     send_code = settings.send_code_in_response
-    if not send_code:
-        try:
-            await send_email(req.email, "E-Travel 登录验证码", f"你的登录验证码是：{code}\n10 分钟内有效。")
-        except Exception:
-            raise HTTPException(status_code=500, detail="Failed to send email")
+    outbox_email = None if send_code else ("E-Travel 登录验证码", f"你的登录验证码是：{code}\n10 分钟内有效。")
+    await _store_code(request, req.email, code, "login", outbox_email)
     return {"message": "code sent", **({"code": code} if send_code else {})}
 
 
@@ -176,18 +395,14 @@ async def login_code_verify(req: AuthCodeVerifyRequest):
 
 
 @app.post('/api/auth/reset-password/request')
-async def reset_password_request(req: ResetPasswordRequest):
+async def reset_password_request(req: ResetPasswordRequest, request: Request):
     user = await db.get_user_by_email(req.email)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     code = f"{secrets.randbelow(1000000):06d}"
-    await db.store_code(req.email, code, "reset")
     send_code = settings.send_code_in_response
-    if not send_code:
-        try:
-            await send_email(req.email, "E-Travel 重置密码验证码", f"你的重置验证码是：{code}\n10 分钟内有效。")
-        except Exception:
-            raise HTTPException(status_code=500, detail="Failed to send email")
+    outbox_email = None if send_code else ("E-Travel 重置密码验证码", f"你的重置验证码是：{code}\n10 分钟内有效。")
+    await _store_code(request, req.email, code, "reset", outbox_email)
     return {"message": "code sent", **({"code": code} if send_code else {})}
 
 
@@ -205,9 +420,106 @@ async def get_preferences(user: dict = Depends(current_user_dep)):
     return prefs
 
 
+def _encode_history_cursor(item: dict) -> str:
+    raw = f"{item['created_at']}|{item['id']}".encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def _decode_history_cursor(cursor: str) -> tuple[datetime, str]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode("utf-8")
+        created_at, history_id = raw.split("|", 1)
+        return datetime.fromisoformat(created_at), str(uuid.UUID(history_id))
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def _etag(*parts: str) -> str:
+    digest = hashlib.sha1("|".join(parts).encode("utf-8")).hexdigest()
+    return f'W/"{digest}"'
+
+
+def _cache_headers(etag: str) -> dict:
+    # Browsers revalidate with If-None-Match instead of reusing a stale copy.
+    return {"ETag": etag, "Cache-Control": "private, no-cache"}
+
+
+def _etag_matches(if_none_match: str | None, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    return any(tag.strip() in {etag, "*"} for tag in if_none_match.split(","))
+
+
+def _usage_summary(rows: list) -> dict:
+    for row in rows:
+        row["cost_usd"] = round(usage.cost_usd(row["prompt_tokens"], row["cached_tokens"], row["completion_tokens"]), 6)
+    return {
+        "items": rows,
+        "total": {
+            "calls": sum(r["calls"] for r in rows),
+            "prompt_tokens": sum(r["prompt_tokens"] for r in rows),
+            "cached_tokens": sum(r["cached_tokens"] for r in rows),
+            "completion_tokens": sum(r["completion_tokens"] for r in rows),
+            "cost_usd": round(sum(r["cost_usd"] for r in rows), 6),
+        },
+    }
+
+
+@app.get('/api/me/usage')
+async def get_my_usage(days: int = Query(default=30, ge=1, le=90), user: dict = Depends(current_user_dep)):
+    rows = await db.llm_usage_report(days=days, user_id=str(user["id"]))
+    return _usage_summary(rows)
+
+
+@app.get('/api/admin/usage')
+async def get_usage_report(
+    days: int = Query(default=7, ge=1, le=90),
+    user_id: uuid.UUID | None = None,
+    _admin: None = Depends(admin_dep),
+):
+    rows = await db.llm_usage_report(days=days, user_id=str(user_id) if user_id else None)
+    return _usage_summary(rows)
+
+
 @app.get('/api/me/search-history')
-async def get_search_history(user: dict = Depends(current_user_dep)):
-    return await db.load_search_history(user["id"])
+async def get_search_history(
+    request: Request,
+    view: str = Query(default="full", pattern="^(full|summary)$"),
+    limit: int = Query(default=10, ge=1, le=50),
+    cursor: str | None = None,
+    if_none_match: str | None = Header(default=None),
+    user: dict = Depends(current_user_dep),
+):
+    if view == "full":
+        return json_response(request, dumps(await db.load_search_history(user["id"], limit=limit)))
+
+    before = _decode_history_cursor(cursor) if cursor else None
+    items = await db.list_search_history(user["id"], limit=limit, before=before)
+    next_cursor = _encode_history_cursor(items[-1]) if len(items) == limit else None
+    etag = _etag(cursor or "", *(f"{i['id']}:{i['result_digest']['hash']}" for i in items))
+    if _etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=_cache_headers(etag))
+    return json_response(request, dumps({"items": items, "next_cursor": next_cursor}), headers=_cache_headers(etag))
+
+
+@app.get('/api/me/search-history/{history_id}')
+async def get_search_history_item(
+    request: Request,
+    history_id: str,
+    if_none_match: str | None = Header(default=None),
+    user: dict = Depends(current_user_dep),
+):
+    try:
+        history_id = str(uuid.UUID(history_id))
+    except ValueError:
+        raise HTTPException(status_code=404, detail="History item not found")
+    item = await db.get_search_history_item(user["id"], history_id)
+    if not item:
+        raise HTTPException(status_code=404, detail="History item not found")
+    etag = _etag(item["id"], item.pop("result_hash") or "")
+    if _etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=_cache_headers(etag))
+    return json_response(request, dumps(item), headers=_cache_headers(etag))
 
 
 @app.delete('/api/me/search-history/{history_id}')
@@ -226,28 +538,245 @@ async def update_preferences(req: PreferencesRequest, user: dict = Depends(curre
 
 
 
+class _ClientDisconnected(Exception):
+    pass
+
+
+async def _cancel_on_disconnect(request: Request, coro, poll_seconds: float = 1.0):
+    # Run the work as a task and stop it as soon as the client goes away, so an abandoned
+    # request stops spending LLM tokens.
+    task = asyncio.ensure_future(coro)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=poll_seconds)
+            if done:
+                return task.result()
+            if await request.is_disconnected():
+                task.cancel()
+                raise _ClientDisconnected()
+    finally:
+        if not task.done():
+            task.cancel()
+
+
 @app.post('/api/plan', response_model=PlanResponse)
-async def plan(req: PlanRequest, user: dict | None = Depends(optional_user_dep)):
+async def plan(req: PlanRequest, request: Request, user: dict | None = Depends(optional_user_dep)):
+    # Popular requests are precomputed off-peak (app/plan_cache.py).
+    payload = await plan_cache.lookup(req) if settings.plan_cache_enabled else None
+    if payload is not None:
+        log_event("plan_cache", status="hit")
+    else:
+        with deadline.scope(settings.plan_deadline_seconds) as budget:
+            try:
+                result = await _cancel_on_disconnect(
+                    request,
+                    generate_plan_with_llm(req, user_id=(str(user["id"]) if user else None)),
+                )
+            except _ClientDisconnected:
+                log_event("plan_cancelled", reason="client_disconnected")
+                return Response(status_code=499)
+            except Exception as exc:
+                # A call cut short by the budget surfaces as an httpx timeout; report both as 504.
+                if isinstance(exc, deadline.DeadlineExceeded) or (budget is not None and budget.remaining() <= 0):
+                    log_event("plan_cancelled", reason="deadline", stage=getattr(exc, "stage", None))
+                    raise HTTPException(status_code=504, detail="Plan generation timed out") from exc
+                raise HTTPException(status_code=500, detail=str(exc)) from exc
+        payload = result.model_dump(mode="json")
+
+    # Serialize the plan once; the same bytes back the JSONB inserts and the HTTP body.
+    body = dumps(payload)
+
+    if user:
+        await _persist_user_plan(str(user["id"]), req, payload, body)
+
+    return json_response(request, body)
+
+
+async def _persist_user_plan(user_id: str, req: PlanRequest, payload: dict, body: bytes | None = None) -> None:
+    # Shared by /api/plan and the plan job workers.
+    body = body if body is not None else dumps(payload)
+    prefs = {
+        "origin": req.origin,
+        "destination": req.destination,
+        "travelers": req.travelers,
+        "budget_min": req.budget_min,
+        "budget_max": req.budget_max,
+        "budget_text": req.budget_text,
+        "preferences": req.preferences,
+        "pace": req.pace,
+        "constraints": req.constraints,
+    }
+    query = req.model_dump()
+    # One pipelined transaction for prefs/plan/history (+ refreshing an identical memory doc);
+    # only a new memory doc needs the embedding call and a second, separate write.
+    title, content = memory_doc_from_plan(query, payload)
+    touched = await db.save_plan_result(user_id, prefs, query, payload, body, memory_content=content)
+    await store_user_memory_doc(user_id, title, content, touched)
+
+
+def _job_for_user(job: dict | None, user: dict | None) -> dict:
+    # Jobs submitted while logged in are only visible to their owner; anonymous jobs are
+    # reachable by their (unguessable) id.
+    if job is None or (job["user_id"] and (not user or str(user["id"]) != job["user_id"])):
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+async def _run_prefetch(req: PlanPrefetchRequest, user_id: str | None) -> None:
+    # _prefetch_running was incremented when the task was scheduled.
+    global _prefetch_running
     try:
-        result = await generate_plan_with_llm(req, user_id=(str(user["id"]) if user else None))
+        await prefetch_plan_context(req, user_id=user_id)
     except Exception as exc:
-        raise HTTPException(status_code=500, detail=str(exc)) from exc
+        log_event("plan_prefetch", level=logging.WARNING, error=str(exc))
+    finally:
+        _prefetch_running -= 1
 
-    if user:
-        prefs = {
-            "origin": req.origin,
-            "destination": req.destination,
-            "travelers": req.travelers,
-            "budget_min": req.budget_min,
-            "budget_max": req.budget_max,
-            "budget_text": req.budget_text,
-            "preferences": req.preferences,
-            "pace": req.pace,
-            "constraints": req.constraints,
-        }
-        await db.save_preferences(user["id"], prefs)
-        await db.save_plan(user["id"], result.model_dump())
-        await db.save_search_history(user["id"], req.model_dump(), result.model_dump())
-        await save_user_memory_from_plan(str(user["id"]), req.model_dump(), result.model_dump())
-
-    return result
+
+@app.post('/api/plan/prefetch', status_code=202)
+async def prefetch_plan(req: PlanPrefetchRequest, request: Request, user: dict | None = Depends(optional_user_dep)):
+    global _prefetch_running
+    # Fire-and-forget: answers at once, the warm-up runs in the background.
+    if not (settings.prefetch_enabled and settings.rag_enabled):
+        return json_response(request, dumps({"status": "disabled"}), status_code=202)
+    try:
+        _prefetch_limiter.hit(str(user["id"]) if user else _client_ip(request))
+    except RateLimitedError as exc:
+        raise HTTPException(
+            status_code=429,
+            detail="Too many prefetch requests",
+            headers={"Retry-After": str(exc.retry_after)},
+        ) from exc
+    # Speculative work is the first thing dropped when the server is busy.
+    threshold = settings.degrade_inflight_threshold
+    busy = threshold > 0 and degradation.in_flight() >= threshold
+    if busy or _prefetch_running >= settings.prefetch_concurrency:
+        return json_response(request, dumps({"status": "skipped"}), status_code=202)
+    _prefetch_running += 1
+    jobs.spawn("plan_prefetch", _run_prefetch(req, str(user["id"]) if user else None))
+    return json_response(request, dumps({"status": "scheduled"}), status_code=202)
+
+
+@app.post('/api/plan/jobs', status_code=202)
+async def submit_plan_job(req: PlanRequest, request: Request, user: dict | None = Depends(optional_user_dep)):
+    user_id = str(user["id"]) if user else None
+    # Each job is a full pipeline that runs on after the client leaves: limit submissions per
+    # minute and pending jobs per user or client IP.
+    owner_key = user_id or _client_ip(request)
+    try:
+        _job_limiter.hit(owner_key)
+    except RateLimitedError as exc:
+        raise HTTPException(
+            status_code=429,
+            detail="Too many plan jobs",
+            headers={"Retry-After": str(exc.retry_after)},
+        ) from exc
+    job_id = await db.enqueue_plan_job(
+        user_id,
+        req.model_dump(mode="json"),
+        owner_key=owner_key,
+        max_pending=settings.plan_job_max_pending,
+    )
+    if job_id is None:
+        raise HTTPException(
+            status_code=429,
+            detail=f"At most {settings.plan_job_max_pending} pending plan jobs",
+            headers={"Retry-After": str(max(1, int(settings.plan_job_poll_seconds)))},
+        )
+    plan_jobs.wake()
+    return json_response(
+        request,
+        dumps({"id": job_id, "status": "queued"}),
+        status_code=202,
+        headers={"Location": f"/api/plan/jobs/{job_id}"},
+    )
+
+
+@app.get('/api/plan/jobs/{job_id}')
+async def get_plan_job(job_id: uuid.UUID, request: Request, user: dict | None = Depends(optional_user_dep)):
+    job = _job_for_user(await db.get_plan_job(str(job_id)), user)
+    job.pop("user_id")
+    headers = {"Cache-Control": "no-store"}
+    if job["status"] == "done":
+        job["result_url"] = f"/api/plan/jobs/{job['id']}/result"
+    elif job["status"] in {"queued", "running"}:
+        headers["Retry-After"] = str(max(1, int(settings.plan_job_poll_seconds)))
+    return json_response(request, dumps(job), headers=headers)
+
+
+@app.get('/api/plan/jobs/{job_id}/result', response_model=PlanResponse)
+async def get_plan_job_result(job_id: uuid.UUID, request: Request, user: dict | None = Depends(optional_user_dep)):
+    job = _job_for_user(await db.get_plan_job(str(job_id)), user)
+    if job["status"] == "failed":
+        raise HTTPException(status_code=409, detail=f"Job failed: {job['error'] or 'unknown error'}")
+    if job["status"] != "done" or not job["plan_id"]:
+        raise HTTPException(status_code=409, detail=f"Job is {job['status']}")
+    result = await db.load_trip_plan(job["plan_id"])
+    if result is None:
+        raise HTTPException(status_code=404, detail="Result expired")
+    return json_response(request, dumps(result))
+
+
+@app.post('/api/plan/batch')
+async def plan_batch(batch: PlanBatchRequest, request: Request, user: dict | None = Depends(optional_user_dep)):
+    # Results stream back as NDJSON lines ({"index", "status", "result" | "error"}) in completion
+    # order. Batch results are not written to the user's plans or history.
+    # A batch larger than the per-minute item limit could never pass it, so it is rejected here.
+    max_items = settings.plan_batch_max_items
+    if settings.plan_batch_items_per_minute > 0:
+        max_items = min(max_items, settings.plan_batch_items_per_minute)
+    if len(batch.items) > max_items:
+        raise HTTPException(status_code=400, detail=f"At most {max_items} items per batch")
+    user_id = str(user["id"]) if user else None
+    # Each item is a full pipeline, so the limit counts items, per user or client IP.
+    try:
+        _batch_limiter.hit(user_id or _client_ip(request), cost=len(batch.items))
+    except RateLimitedError as exc:
+        raise HTTPException(
+            status_code=429,
+            detail="Too many batch items",
+            headers={"Retry-After": str(exc.retry_after)},
+        ) from exc
+    lines: asyncio.Queue[bytes | None] = asyncio.Queue()
+
+    # Identical requests in one batch are planned once.
+    groups: dict[str, list[int]] = {}
+    for index, item in enumerate(batch.items):
+        groups.setdefault(item.model_dump_json(), []).append(index)
+
+    async def run_one(indexes: list[int], sem: asyncio.Semaphore) -> None:
+        req = batch.items[indexes[0]]
+        async with sem:
+            try:
+                with deadline.scope(settings.plan_deadline_seconds):
+                    result = await generate_plan_with_llm(req, user_id=user_id)
+                outcome = {"status": "ok", "result": result.model_dump(mode="json")}
+            except Exception as exc:
+                outcome = {"status": "error", "error": str(exc)}
+        for index in indexes:
+            await lines.put(dumps({"index": index, **outcome}) + b"\n")
+
+    async def run_all() -> None:
+        try:
+            with shared_retrieval():
+                await prefetch_shared_context(batch.items, user_id=user_id)
+                sem = asyncio.Semaphore(max(1, settings.plan_batch_concurrency))
+                await asyncio.gather(*(run_one(indexes, sem) for indexes in groups.values()))
+        finally:
+            await lines.put(None)
+
+    async def stream():
+        # The pipelines run in their own task; a client disconnect cancels the stream and them.
+        task = asyncio.create_task(run_all())
+        try:
+            while (line := await lines.get()) is not None:
+                yield line
+        finally:
+            if not task.done():
+                task.cancel()
+
+    log_event("plan_batch", items=len(batch.items), unique=len(groups))
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+
+_IMPORT_DONE = time.perf_counter()
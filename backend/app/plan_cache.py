@@ -0,0 +1,204 @@
+import hashlib
+import json
+import logging
+from datetime import date, datetime, timedelta, timezone
+from typing import Any, Dict, List, Tuple
+
+from . import db, deadline, degradation, logs
+from .llm import generate_plan_with_llm
+from .logs import log_event
+from .schemas import PlanRequest, PlanResponse
+from .settings import Settings, get_settings
+from .tools import normalize_date
+
+# Precomputed plans for popular requests (plan_cache table, migrations/008_plan_cache.sql).
+# The plan_precompute job mines recent search history for the most frequent canonical requests
+# and regenerates them off-peak under a per-run token budget; POST /api/plan answers a
+# request with the same canonical form from the table instead of running the pipeline.
+# Requests are canonicalized without the exact start date (only its month is kept) and
+# without the user, so a cached plan carries no personal memory context.
+
+# Markers of the warnings added by degradation.warning and llm._outline_warning; such plans
+# are not worth caching.
+_DEGRADED_MARKERS = ("Simplified plan", "outline-only", "简化方案", "仅为概要")
+
+_stats: Dict[str, int] = {"hits": 0, "misses": 0, "errors": 0}
+
+
+def _norm(value: Any) -> str:
+    return " ".join(str(value or "").split()).lower()
+
+
+def _amount(value: Any) -> float | None:
+    return float(value) if value is not None else None
+
+
+def canonical_request(query: Dict[str, Any]) -> Dict[str, Any] | None:
+    destination, origin = _norm(query.get("destination")), _norm(query.get("origin"))
+    if not destination and not origin:
+        return None
+    return {
+        "origin": origin,
+        "destination": destination,
+        "days": int(query.get("days") or 0),
+        "month": normalize_date(query.get("start_date"))[5:7],
+        "travelers": int(query.get("travelers") or 1),
+        "budget_min": _amount(query.get("budget_min")),
+        "budget_max": _amount(query.get("budget_max")),
+        "budget_text": _norm(query.get("budget_text")),
+        "preferences": sorted({_norm(p) for p in query.get("preferences") or [] if _norm(p)}),
+        "pace": _norm(query.get("pace")),
+        "constraints": sorted({_norm(c) for c in query.get("constraints") or [] if _norm(c)}),
+        "language": _norm(query.get("language")),
+    }
+
+
+def cache_key(canonical: Dict[str, Any]) -> str:
+    raw = json.dumps(canonical, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+async def lookup(req: PlanRequest) -> Dict[str, Any] | None:
+    canonical = canonical_request(req.model_dump())
+    if canonical is None:
+        return None
+    try:
+        result = await db.load_plan_cache(cache_key(canonical))
+    except Exception as exc:
+        # The cache is an optimization; a failed lookup falls through to generation.
+        _stats["errors"] += 1
+        log_event("plan_cache", level=logging.WARNING, status="lookup_error", error=str(exc))
+        return None
+    _stats["hits" if result is not None else "misses"] += 1
+    return result
+
+
+def stats() -> Dict[str, Any]:
+    return dict(_stats)
+
+
+def in_window(spec: str, hour: int | None = None) -> bool:
+    # "2-6" = from 02:00 to 05:59 UTC; "22-4" wraps past midnight; "3" = 03:00-03:59; empty = any time.
+    spec = spec.strip()
+    if not spec:
+        return True
+    start, _, end = spec.partition("-")
+    start_hour = int(start)
+    end_hour = int(end) if end else (start_hour + 1) % 24
+    hour = datetime.now(timezone.utc).hour if hour is None else hour
+    if start_hour <= end_hour:
+        return start_hour <= hour < end_hour
+    return hour >= start_hour or hour < end_hour
+
+
+def mine_popular(queries: List[Dict[str, Any]], top_n: int, min_count: int) -> List[Tuple[str, Dict[str, Any], int]]:
+    # (key, most recent original request, count) of the top_n canonical requests, most requested
+    # first; ties keep recency since queries arrive newest first.
+    counts: Dict[str, int] = {}
+    samples: Dict[str, Dict[str, Any]] = {}
+    for query in queries:
+        canonical = canonical_request(query)
+        if canonical is None:
+            continue
+        key = cache_key(canonical)
+        counts[key] = counts.get(key, 0) + 1
+        samples.setdefault(key, query)
+    ranked = sorted(counts.items(), key=lambda item: -item[1])[:top_n]
+    return [(key, samples[key], count) for key, count in ranked if count >= min_count]
+
+
+def _start_date(month: str, today: date | None = None) -> date:
+    # Next travel date in the canonical month: tomorrow for the current month, else the 1st.
+    today = today or date.today()
+    wanted = int(month)
+    tomorrow = today + timedelta(days=1)
+    if wanted == today.month and tomorrow.month == wanted:
+        return tomorrow
+    year = today.year if wanted > today.month else today.year + 1
+    return date(year, wanted, 1)
+
+
+def _degraded(result: PlanResponse) -> bool:
+    return any(marker in warning for warning in result.warnings for marker in _DEGRADED_MARKERS)
+
+
+async def _regenerate(key: str, query: Dict[str, Any], count: int, settings: Settings) -> Tuple[str, int]:
+    # Returns (status, tokens spent). Weather and retrieval context are fetched fresh.
+    canonical = canonical_request(query)
+    token = logs.begin_request(f"precompute:{key[:12]}")
+    result = None
+    try:
+        req = PlanRequest.model_validate({**query, "start_date": _start_date(canonical["month"]).isoformat()})
+        with deadline.scope(settings.plan_job_deadline_seconds):
+            result = await generate_plan_with_llm(req, settings=settings)
+    except Exception as exc:
+        log_event("plan_precompute_failed", level=logging.WARNING, key=key, error=str(exc))
+    finally:
+        llm = logs.end_request(token).get("llm") or {}
+    prompt_tokens = sum(v["prompt_tokens"] for v in llm.values())
+    completion_tokens = sum(v["completion_tokens"] for v in llm.values())
+    spent = prompt_tokens + completion_tokens
+    if result is None:
+        return "failed", spent
+    if _degraded(result):
+        return "degraded", spent
+    await db.save_plan_cache(
+        key,
+        req.model_dump(),
+        result.model_dump(mode="json"),
+        settings.plan_cache_ttl_seconds,
+        requests=count,
+        prompt_tokens=prompt_tokens,
+        completion_tokens=completion_tokens,
+    )
+    return "generated", spent
+
+
+async def precompute(settings: Settings, check_window: bool = True) -> Dict[str, Any]:
+    popular = mine_popular(
+        await db.recent_search_queries(settings.plan_precompute_lookback_days),
+        settings.plan_precompute_top_n,
+        settings.plan_precompute_min_count,
+    )
+    # Entries past half their TTL are refreshed, so a daily window keeps them valid.
+    fresh = await db.fresh_plan_cache_keys([key for key, _, _ in popular], settings.plan_cache_ttl_seconds / 2)
+    summary: Dict[str, Any] = {
+        "candidates": len(popular),
+        "fresh": len(fresh),
+        "generated": 0,
+        "failed": 0,
+        "degraded": 0,
+        "tokens": 0,
+        "stopped": None,
+    }
+    threshold = settings.degrade_inflight_threshold
+    for key, query, count in popular:
+        if key in fresh:
+            continue
+        # The budget is checked before each plan, so a run may overshoot it by one plan.
+        if summary["tokens"] >= settings.plan_precompute_token_budget:
+            summary["stopped"] = "token_budget"
+            break
+        if check_window and not in_window(settings.plan_precompute_hours):
+            summary["stopped"] = "window_closed"
+            break
+        if threshold > 0 and degradation.in_flight() >= threshold:
+            summary["stopped"] = "busy"
+            break
+        status, spent = await _regenerate(key, query, count, settings)
+        summary[status] += 1
+        summary["tokens"] += spent
+    return summary
+
+
+async def run_precompute() -> None:
+    # Periodic job body; only one process across all instances runs at a time.
+    settings = get_settings()
+    if not in_window(settings.plan_precompute_hours):
+        return
+    async with db.advisory_lock("plan_precompute") as locked:
+        if not locked:
+            return
+        summary = await precompute(settings)
+    if summary["generated"] or summary["failed"] or summary["degraded"]:
+        log_event("job_done", job="plan_precompute", **summary)
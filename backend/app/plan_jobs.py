@@ -0,0 +1,87 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict
+
+from . import db, deadline, logs
+from .llm import generate_plan_with_llm
+from .logs import log_event
+from .schemas import PlanRequest
+from .settings import Settings, get_settings
+from .tools import normalize_date
+
+# Worker side of the plan job API: claim a queued job (FOR UPDATE SKIP LOCKED), run the
+# pipeline, store the result in trip_requests / trip_plans. Every API process runs
+# PLAN_JOB_WORKERS of these loops; any process can answer polls from Postgres.
+
+OnResult = Callable[[str, PlanRequest, Dict[str, Any]], Awaitable[None]]
+
+_wakeup: asyncio.Event | None = None
+
+
+def wake() -> None:
+    # Pick up a freshly submitted job right away instead of waiting for the next poll.
+    if _wakeup is not None:
+        _wakeup.set()
+
+
+async def run_once(settings: Settings, on_result: OnResult | None = None) -> bool:
+    # The lease outlives the deadline, so only a crashed worker's job is ever re-claimed.
+    job = await db.claim_plan_job(
+        lease_seconds=settings.plan_job_deadline_seconds + 60,
+        max_attempts=settings.plan_job_max_attempts,
+    )
+    if job is None:
+        return False
+
+    token = logs.begin_request(f"job:{job['id']}")
+    logs.set_user_id(job["user_id"])
+    try:
+        req = PlanRequest.model_validate(job["request"])
+        try:
+            with deadline.scope(settings.plan_job_deadline_seconds):
+                result = await generate_plan_with_llm(req, user_id=job["user_id"], settings=settings)
+        except Exception as exc:
+            retry = job["attempts"] < settings.plan_job_max_attempts
+            await db.fail_plan_job(job["id"], str(exc), retry=retry)
+            log_event("plan_job_failed", level=logging.WARNING, job_id=job["id"], attempts=job["attempts"], retry=retry, error=str(exc))
+            return True
+
+        payload = result.model_dump(mode="json")
+        # trip_requests.start_date is a date column; PlanRequest accepts any string.
+        request = {**job["request"], "start_date": normalize_date(req.start_date)}
+        try:
+            plan_id = await db.complete_plan_job(job["id"], request, payload, settings.llm_model)
+        except Exception as exc:
+            # Not retried: the plan was generated and paid for, and storing it would fail again.
+            await db.fail_plan_job(job["id"], f"storing result failed: {exc}", retry=False)
+            log_event("plan_job_failed", level=logging.WARNING, job_id=job["id"], attempts=job["attempts"], retry=False, error=str(exc))
+            return True
+        if on_result is not None and job["user_id"]:
+            try:
+                await on_result(job["user_id"], req, payload)
+            except Exception as exc:
+                log_event("plan_job_persist_error", level=logging.WARNING, job_id=job["id"], error=str(exc))
+        log_event("plan_job_done", job_id=job["id"], plan_id=plan_id, attempts=job["attempts"])
+        return True
+    finally:
+        logs.end_request(token)
+
+
+async def run_worker(on_result: OnResult | None = None) -> None:
+    global _wakeup
+    if _wakeup is None:
+        _wakeup = asyncio.Event()
+    settings = get_settings()
+    while True:
+        try:
+            while await run_once(settings, on_result):
+                pass
+        except asyncio.CancelledError:
+            raise
+        except Exception as exc:
+            log_event("plan_job_worker_error", level=logging.ERROR, error=str(exc))
+        try:
+            await asyncio.wait_for(_wakeup.wait(), timeout=settings.plan_job_poll_seconds)
+        except asyncio.TimeoutError:
+            pass
+        _wakeup.clear()
@@ -0,0 +1,41 @@
+import time
+from collections import OrderedDict, deque
+from typing import Deque, Hashable
+
+
+class RateLimitedError(Exception):
+    def __init__(self, retry_after: float):
+        super().__init__(f"rate limited, retry after {retry_after:.0f}s")
+        self.retry_after = max(1, int(retry_after + 0.999))
+
+
+class SlidingWindowLimiter:
+    """Per-process sliding-window limiter: at most `limit` hits per key within `window_seconds`."""
+
+    def __init__(self, limit: int, window_seconds: float, max_keys: int = 10000):
+        self.limit = limit
+        self.window_seconds = window_seconds
+        self.max_keys = max_keys
+        self._hits: "OrderedDict[Hashable, Deque[float]]" = OrderedDict()
+
+    def hit(self, key: Hashable, cost: int = 1) -> None:
+        # cost > 1 counts one request as several hits (e.g. the items of a batch).
+        if self.limit <= 0:
+            return
+        if cost > self.limit:
+            # Could never pass, whatever the wait; callers must reject it up front.
+            raise ValueError(f"cost {cost} exceeds limit {self.limit}")
+        now = time.monotonic()
+        hits = self._hits.get(key)
+        if hits is None:
+            hits = deque()
+            self._hits[key] = hits
+        self._hits.move_to_end(key)
+        while hits and hits[0] <= now - self.window_seconds:
+            hits.popleft()
+        if len(hits) + cost > self.limit:
+            # Wait until enough of the oldest hits have left the window to make room.
+            raise RateLimitedError(hits[len(hits) + cost - self.limit - 1] + self.window_seconds - now)
+        hits.extend([now] * cost)
+        while len(self._hits) > self.max_keys:
+            self._hits.popitem(last=False)
@@ -0,0 +1,56 @@
+import gzip
+import json
+from typing import Any, Mapping
+
+from starlette.requests import Request
+from starlette.responses import Response
+
+try:
+    import orjson
+except Exception:  # pragma: no cover
+    orjson = None
+
+try:
+    import brotli
+except Exception:  # pragma: no cover
+    brotli = None
+
+# Bodies smaller than this are sent uncompressed.
+COMPRESS_MIN_BYTES = 1024
+
+
+def dumps(obj: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def _accepted_encodings(request: Request) -> set[str]:
+    accepted = set()
+    for part in request.headers.get("accept-encoding", "").split(","):
+        name, _, params = part.strip().partition(";")
+        if params.strip().replace(" ", "") in {"q=0", "q=0.0", "q=0.00", "q=0.000"}:
+            continue
+        if name:
+            accepted.add(name.strip().lower())
+    return accepted
+
+
+def json_response(
+    request: Request,
+    body: bytes,
+    status_code: int = 200,
+    headers: Mapping[str, str] | None = None,
+) -> Response:
+    # `body` is already-serialized JSON; it is compressed here when the client allows it.
+    out_headers = dict(headers or {})
+    if len(body) >= COMPRESS_MIN_BYTES:
+        accepted = _accepted_encodings(request)
+        out_headers["Vary"] = "Accept-Encoding"
+        if brotli is not None and "br" in accepted:
+            body = brotli.compress(body, quality=4)
+            out_headers["Content-Encoding"] = "br"
+        elif "gzip" in accepted:
+            body = gzip.compress(body, compresslevel=5)
+            out_headers["Content-Encoding"] = "gzip"
+    return Response(content=body, status_code=status_code, headers=out_headers, media_type="application/json")
@@ -1,17 +1,106 @@
-﻿import os
-from typing import Any, Dict, List
+﻿import asyncio
+import contextvars
+import logging
+import os
+from contextlib import contextmanager
+from typing import Any, Awaitable, Callable, Dict, Hashable, Iterator, List, Tuple
 
-import httpx
+from . import db, deadline
+from .breaker import CircuitOpenError, get_breaker
+from .cache import MISSING, TTLCache
+from .http_clients import get_client
+from .logs import log_event
+from .settings import get_settings
+from .tools import WeatherQuery, get_weather_context, get_weather_contexts, normalize_date
 
-from . import db
-from .tools import get_weather_context
+# Batch planning shares embeddings, RAG lookups and weather across pipelines: inside
+# shared_retrieval(), identical calls are made once and every caller awaits the same future.
+_shared: contextvars.ContextVar[Dict[Hashable, "asyncio.Future[Any]"] | None] = contextvars.ContextVar(
+    "shared_retrieval",
+    default=None,
+)
 
 
-def _to_pgvector(values: List[float]) -> str:
-    return "[" + ",".join(str(v) for v in values) + "]"
+# Speculative prefetch (POST /api/plan/prefetch) runs the same calls inside prefetching();
+# their futures are also kept here for PREFETCH_TTL_SECONDS, so the /api/plan that follows
+# (or is already waiting on an in-flight lookup) reuses them instead of starting over.
+_prefetched = TTLCache(maxsize=512, ttl_seconds=get_settings().prefetch_ttl_seconds)
+_prefetching: contextvars.ContextVar[bool] = contextvars.ContextVar("prefetching", default=False)
+
+
+@contextmanager
+def shared_retrieval() -> Iterator[None]:
+    token = _shared.set({})
+    try:
+        yield
+    finally:
+        _shared.reset(token)
+
+
+@contextmanager
+def prefetching() -> Iterator[None]:
+    token = _prefetching.set(True)
+    try:
+        with shared_retrieval():
+            yield
+    finally:
+        _prefetching.reset(token)
+
+
+def _usable(future: Any) -> bool:
+    # A failed or cancelled prefetch is ignored; the request does the lookup itself.
+    return future is not MISSING and not future.cancelled() and (not future.done() or future.exception() is None)
+
+
+async def _shared_call(key: Hashable, factory: Callable[[], Awaitable[Any]]) -> Any:
+    warm = _prefetched.get(key)
+    if _usable(warm):
+        return await asyncio.shield(warm)
+    memo = _shared.get()
+    if memo is None:
+        return await factory()
+    future = memo.get(key)
+    if future is None:
+        future = asyncio.ensure_future(factory())
+        memo[key] = future
+        if _prefetching.get():
+            _prefetched.set(key, future)
+    # One cancelled pipeline must not cancel the lookup for the others.
+    return await asyncio.shield(future)
+
+
+def _seed(key: Hashable, value: Any) -> None:
+    memo = _shared.get()
+    if memo is not None and key not in memo:
+        future = asyncio.get_running_loop().create_future()
+        future.set_result(value)
+        memo[key] = future
+        if _prefetching.get():
+            _prefetched.set(key, future)
+
+
+def prefetch_stats() -> Dict[str, Any]:
+    return _prefetched.stats()
 
 
 async def _embed_text(text: str) -> List[float]:
+    vectors = await _shared_call(("embed", text), lambda: _embed_remote([text]))
+    return vectors[0]
+
+
+async def embed_texts(texts: List[str]) -> List[List[float]]:
+    # Deduped, single request for many texts; results also seed the shared-retrieval memo.
+    unique = list(dict.fromkeys(t for t in texts if t))
+    vectors: Dict[str, List[float]] = {}
+    for start in range(0, len(unique), 64):
+        chunk = unique[start:start + 64]
+        for text, vector in zip(chunk, await _embed_remote(chunk)):
+            vectors[text] = vector
+            _seed(("embed", text), [vector])
+    return [vectors[t] if t else [] for t in texts]
+
+
+async def _embed_remote(texts: List[str]) -> List[List[float]]:
     api_key = os.getenv("LLM_API_KEY", "").strip()
     if not api_key:
         raise RuntimeError("LLM_API_KEY not set")
@@ -31,35 +120,48 @@ async def _embed_text(text: str) -> List[float]:
     }
     payload: Dict[str, Any] = {
         "model": model,
-        "input": text,
+        "input": texts if len(texts) > 1 else texts[0],
     }
+    dimensions = os.getenv("EMBEDDING_DIMENSIONS", "").strip()
+    if dimensions:
+        # text-embedding-3-* can return shortened vectors; must match the column dimension.
+        payload["dimensions"] = int(dimensions)
 
-    async with httpx.AsyncClient(timeout=30) as client:
-        resp = await client.post(url, headers=headers, json=payload)
+    timeout = deadline.timeout_for(30, stage="embedding")
+    async with get_breaker("embedding").guard():
+        resp = await get_client("llm").post(url, headers=headers, json=payload, timeout=timeout)
         resp.raise_for_status()
         data = resp.json()
 
-    return data["data"][0]["embedding"]
+    return [row["embedding"] for row in sorted(data["data"], key=lambda r: r["index"])]
 
 
 async def retrieve_context(query: str, top_k: int = 4) -> List[Dict[str, Any]]:
+    return await _shared_call(("kb", query, top_k), lambda: _retrieve_context(query, top_k))
+
+
+async def _retrieve_context(query: str, top_k: int) -> List[Dict[str, Any]]:
     pool = await db.get_pool()
     if pool is None:
         return []
 
-    embedding = await _embed_text(query)
-    vector_str = _to_pgvector(embedding)
+    try:
+        embedding = await _embed_text(query)
+    except CircuitOpenError as exc:
+        # Embeddings are down: plan without KB context instead of waiting on timeouts.
+        log_event("rag_kb", status="circuit_open", retry_after=round(exc.retry_after))
+        return []
 
     async with pool.connection() as conn:
         async with conn.cursor() as cur:
             await cur.execute(
-                """
+                f"""
                 select id, title, source, content
                 from knowledge_docs
-                order by embedding <=> %s::vector
+                order by embedding <=> %s::{db.EMBEDDING_STORAGE}
                 limit %s
                 """,
-                (vector_str, top_k),
+                (db.vector_param(embedding), top_k),
             )
             rows = await cur.fetchall() or []
             if not rows:
@@ -88,15 +190,22 @@ async def retrieve_context(query: str, top_k: int = 4) -> List[Dict[str, Any]]:
 async def retrieve_user_memory_context(user_id: str, query: str, top_k: int = 4) -> List[Dict[str, Any]]:
     if not user_id:
         return []
-    embedding = await _embed_text(query)
-    return await db.load_user_memory_by_vector(user_id, embedding, limit=top_k)
+    return await _shared_call(
+        ("memory", user_id, query, top_k),
+        lambda: _retrieve_user_memory_context(user_id, query, top_k),
+    )
 
 
-async def save_user_memory_from_plan(user_id: str, query: Dict[str, Any], result: Dict[str, Any]) -> None:
-    if not user_id:
-        return
-    audit_enabled = os.getenv("AGENT_AUDIT_LOG", "false").lower() == "true"
+async def _retrieve_user_memory_context(user_id: str, query: str, top_k: int) -> List[Dict[str, Any]]:
+    try:
+        embedding = await _embed_text(query)
+    except CircuitOpenError as exc:
+        log_event("rag_memory", status="circuit_open", retry_after=round(exc.retry_after))
+        return []
+    return await db.load_user_memory_by_vector(user_id, embedding, limit=top_k)
+
 
+def memory_doc_from_plan(query: Dict[str, Any], result: Dict[str, Any]) -> Tuple[str, str]:
     route = f"{query.get('origin') or '出发地'} -> {query.get('destination') or '目的地'}"
     warnings = result.get("warnings") or []
     daily_plan = result.get("daily_plan") or []
@@ -116,21 +225,64 @@ async def save_user_memory_from_plan(user_id: str, query: Dict[str, Any], result
             f"晚上{first_day.get('evening', {}).get('title', '')}"
         )
 
-    content = "\n".join(summary_lines)
-    title = f"历史偏好记忆: {route}"
+    return f"历史偏好记忆: {route}", "\n".join(summary_lines)
+
+
+async def save_user_memory_from_plan(user_id: str, query: Dict[str, Any], result: Dict[str, Any]) -> None:
+    if not user_id:
+        return
+    title, content = memory_doc_from_plan(query, result)
+    # Identical memory already stored: refresh it and skip the embedding call.
+    touched = await db.touch_user_memory_doc(user_id, content)
+    await store_user_memory_doc(user_id, title, content, touched)
+
+
+async def store_user_memory_doc(user_id: str, title: str, content: str, touched: bool) -> None:
+    # `touched`: an identical doc was already refreshed (db.touch_user_memory_doc or
+    # db.save_plan_result), so there is nothing to embed.
+    audit_enabled = os.getenv("AGENT_AUDIT_LOG", "false").lower() == "true"
     if audit_enabled:
         lines = content.count("\n") + 1
-        print("[memory_write]", f"title={title} chars={len(content)} lines={lines}")
-    embedding = await _embed_text(content)
+        log_event("memory_write", title=title, chars=len(content), lines=lines)
+    if touched:
+        if audit_enabled:
+            log_event("memory_write", duplicate="exact")
+        return
 
-    await db.save_user_memory_doc(
+    try:
+        embedding = await _embed_text(content)
+    except CircuitOpenError as exc:
+        # The plan and history are already committed; the memory doc is skipped, not retried.
+        log_event("memory_write", status="circuit_open", retry_after=round(exc.retry_after))
+        return
+    except Exception as exc:
+        log_event("memory_write", level=logging.WARNING, status="embed_error", error=str(exc))
+        return
+    merged = await db.save_user_memory_doc(
         user_id=user_id,
         title=title,
         source="user_search_history",
         content=content,
         embedding=embedding,
+        dedup_threshold=get_settings().memory_dedup_threshold,
     )
+    if audit_enabled and merged:
+        log_event("memory_write", duplicate="similar")
+
+
+def _weather_key(destination: str | None, start_date: str | None, days: int | None) -> Hashable:
+    return ("weather", (destination or "").strip().lower(), normalize_date(start_date), days)
 
 
 async def retrieve_weather_context(destination: str | None, start_date: str | None, days: int | None) -> str:
-    return await get_weather_context(destination, start_date, days)
+    return await _shared_call(
+        _weather_key(destination, start_date, days),
+        lambda: get_weather_context(destination, start_date, days),
+    )
+
+
+async def retrieve_weather_contexts(queries: List[WeatherQuery]) -> List[str]:
+    contexts = await get_weather_contexts(queries)
+    for (destination, start_date, days), context in zip(queries, contexts):
+        _seed(_weather_key(destination, start_date, days), context)
+    return contexts
@@ -15,6 +15,19 @@ class PlanRequest(BaseModel):
     constraints: List[str] = Field(default_factory=list, description='??')
     language: Optional[str] = Field(default=None, description='?? (zh/en)')
 
+# Partial form state sent while the user is still typing; every field is optional.
+class PlanPrefetchRequest(BaseModel):
+    origin: Optional[str] = None
+    destination: Optional[str] = None
+    start_date: Optional[str] = None
+    days: Optional[int] = Field(default=None, ge=1, le=30)
+    budget_text: Optional[str] = None
+    preferences: List[str] = Field(default_factory=list)
+    constraints: List[str] = Field(default_factory=list)
+
+class PlanBatchRequest(BaseModel):
+    items: List[PlanRequest] = Field(min_length=1, max_length=50)
+
 class Destination(BaseModel):
     name: str
     reasons: List[str]
@@ -48,6 +61,15 @@ class PlanResponse(BaseModel):
     budget_breakdown: BudgetBreakdown
     warnings: List[str] = Field(default_factory=list)
 
+# Sharded generation for long trips: PlanResponse minus daily_plan, plus day blocks generated separately.
+class PlanOverview(BaseModel):
+    top_destinations: List[Destination]
+    budget_breakdown: BudgetBreakdown
+    warnings: List[str] = Field(default_factory=list)
+
+class DayBlock(BaseModel):
+    daily_plan: List[DayPlan]
+
 class AuthRegisterRequest(BaseModel):
     email: str
     password: str
@@ -8,6 +8,10 @@ def _env_bool(key: str, default: str = "false") -> bool:
 
 
 class Settings(BaseModel):
+    # Startup
+    startup_warmup: bool
+    db_required_at_startup: bool
+
     # Email / CORS
     resend_api_key: str
     email_from: str
@@ -22,9 +26,49 @@ class Settings(BaseModel):
     llm_response_format: str
     llm_timeout_seconds: int
     llm_max_retries: int
+    plan_deadline_seconds: float
+    plan_batch_max_items: int
+    plan_batch_concurrency: int
+    plan_batch_items_per_minute: int
+    plan_job_workers: int
+    plan_job_poll_seconds: float
+    plan_job_max_attempts: int
+    plan_job_deadline_seconds: float
+    plan_job_retention_days: int
+    plan_job_max_per_minute: int
+    plan_job_max_pending: int
+    plan_shard_min_days: int
+    plan_shard_days: int
+    plan_shard_concurrency: int
+    prefetch_enabled: bool
+    prefetch_ttl_seconds: float
+    prefetch_max_per_minute: int
+    prefetch_concurrency: int
+    plan_cache_enabled: bool
+    plan_cache_ttl_seconds: float
+    plan_precompute_enabled: bool
+    plan_precompute_interval_seconds: float
+    plan_precompute_hours: str
+    plan_precompute_top_n: int
+    plan_precompute_min_count: int
+    plan_precompute_lookback_days: int
+    plan_precompute_token_budget: int
+    llm_cache_mode: str
+    llm_usage_enabled: bool
+    llm_usage_flush_seconds: float
+    llm_usage_buffer_max: int
+    llm_price_input_per_mtok: float
+    llm_price_cached_input_per_mtok: float
+    llm_price_output_per_mtok: float
+    admin_token: str
+    llm_cache_path: str
+    degrade_enabled: bool
+    degrade_call_seconds: float
+    degrade_inflight_threshold: int
 
     # Feature flags
     agent_audit_log: bool
+    log_dump_sample_rate: float
     enable_budget_risk: bool
     rag_enabled: bool
     rag_top_k: int
@@ -39,6 +83,34 @@ class Settings(BaseModel):
     dual_rate_slow_importance: float
     dual_rate_recent_keep: int
 
+    # Auth codes
+    auth_code_max_per_email: int
+    auth_code_max_per_ip: int
+    auth_code_window_seconds: int
+    auth_code_sweep_interval_seconds: int
+    trusted_proxy_count: int
+
+    # Email outbox
+    email_outbox_batch_size: int
+    email_outbox_poll_seconds: float
+    email_outbox_max_attempts: int
+    email_outbox_backoff_seconds: float
+    email_outbox_max_age_seconds: int
+
+    # Caching
+    cache_notify_enabled: bool
+
+    # Circuit breakers (MCP, Open-Meteo, embeddings)
+    breaker_failure_rate: float
+    breaker_min_calls: int
+    breaker_window_seconds: float
+    breaker_open_seconds: float
+
+    # User memory
+    memory_dedup_threshold: float
+    memory_keep_per_user: int
+    memory_compact_interval_seconds: int
+
 
 @lru_cache
 def get_settings() -> Settings:
@@ -55,6 +127,8 @@ def get_settings() -> Settings:
         llm_model = os.getenv("LLM_MODEL", "gpt-4o-mini").strip()
 
     return Settings(
+        startup_warmup=_env_bool("STARTUP_WARMUP", "true"),
+        db_required_at_startup=_env_bool("DB_REQUIRED_AT_STARTUP", "false"),
         resend_api_key=os.getenv("RESEND_API_KEY", "").strip(),
         email_from=os.getenv("EMAIL_FROM", "E-Travel <no-reply@yourdomain.com>").strip(),
         cors_origins=[
@@ -72,7 +146,47 @@ def get_settings() -> Settings:
         llm_response_format=os.getenv("LLM_RESPONSE_FORMAT", "json_object").strip(),
         llm_timeout_seconds=int(os.getenv("LLM_TIMEOUT_SECONDS", "60")),
         llm_max_retries=int(os.getenv("LLM_MAX_RETRIES", "2")),
+        llm_usage_enabled=_env_bool("LLM_USAGE_ENABLED", "true"),
+        llm_usage_flush_seconds=float(os.getenv("LLM_USAGE_FLUSH_SECONDS", "5")),
+        llm_usage_buffer_max=int(os.getenv("LLM_USAGE_BUFFER_MAX", "10000")),
+        llm_price_input_per_mtok=float(os.getenv("LLM_PRICE_INPUT_PER_MTOK", "0.15")),
+        llm_price_cached_input_per_mtok=float(os.getenv("LLM_PRICE_CACHED_INPUT_PER_MTOK", "0.075")),
+        llm_price_output_per_mtok=float(os.getenv("LLM_PRICE_OUTPUT_PER_MTOK", "0.60")),
+        admin_token=os.getenv("ADMIN_TOKEN", "").strip(),
+        llm_cache_mode=os.getenv("LLM_CACHE_MODE", "passthrough").strip().lower(),
+        llm_cache_path=os.getenv("LLM_CACHE_PATH", ".llm_cache.sqlite3").strip(),
+        plan_deadline_seconds=float(os.getenv("PLAN_DEADLINE_SECONDS", "90")),
+        plan_batch_max_items=int(os.getenv("PLAN_BATCH_MAX_ITEMS", "20")),
+        plan_batch_concurrency=int(os.getenv("PLAN_BATCH_CONCURRENCY", "4")),
+        plan_batch_items_per_minute=int(os.getenv("PLAN_BATCH_ITEMS_PER_MINUTE", "40")),
+        plan_job_workers=int(os.getenv("PLAN_JOB_WORKERS", "2")),
+        plan_job_poll_seconds=float(os.getenv("PLAN_JOB_POLL_SECONDS", "2")),
+        plan_job_max_attempts=int(os.getenv("PLAN_JOB_MAX_ATTEMPTS", "2")),
+        plan_job_deadline_seconds=float(os.getenv("PLAN_JOB_DEADLINE_SECONDS", "300")),
+        plan_job_retention_days=int(os.getenv("PLAN_JOB_RETENTION_DAYS", "7")),
+        plan_job_max_per_minute=int(os.getenv("PLAN_JOB_MAX_PER_MINUTE", "6")),
+        plan_job_max_pending=int(os.getenv("PLAN_JOB_MAX_PENDING", "3")),
+        plan_shard_min_days=int(os.getenv("PLAN_SHARD_MIN_DAYS", "8")),
+        plan_shard_days=max(1, int(os.getenv("PLAN_SHARD_DAYS", "4"))),
+        plan_shard_concurrency=max(1, int(os.getenv("PLAN_SHARD_CONCURRENCY", "4"))),
+        prefetch_enabled=_env_bool("PREFETCH_ENABLED", "true"),
+        prefetch_ttl_seconds=float(os.getenv("PREFETCH_TTL_SECONDS", "120")),
+        prefetch_max_per_minute=int(os.getenv("PREFETCH_MAX_PER_MINUTE", "12")),
+        prefetch_concurrency=int(os.getenv("PREFETCH_CONCURRENCY", "4")),
+        plan_cache_enabled=_env_bool("PLAN_CACHE_ENABLED", "true"),
+        plan_cache_ttl_seconds=float(os.getenv("PLAN_CACHE_TTL_SECONDS", "172800")),
+        plan_precompute_enabled=_env_bool("PLAN_PRECOMPUTE_ENABLED", "false"),
+        plan_precompute_interval_seconds=float(os.getenv("PLAN_PRECOMPUTE_INTERVAL_SECONDS", "900")),
+        plan_precompute_hours=os.getenv("PLAN_PRECOMPUTE_HOURS", "2-6").strip(),
+        plan_precompute_top_n=int(os.getenv("PLAN_PRECOMPUTE_TOP_N", "50")),
+        plan_precompute_min_count=max(1, int(os.getenv("PLAN_PRECOMPUTE_MIN_COUNT", "3"))),
+        plan_precompute_lookback_days=int(os.getenv("PLAN_PRECOMPUTE_LOOKBACK_DAYS", "30")),
+        plan_precompute_token_budget=int(os.getenv("PLAN_PRECOMPUTE_TOKEN_BUDGET", "500000")),
+        degrade_enabled=_env_bool("DEGRADE_ENABLED", "true"),
+        degrade_call_seconds=float(os.getenv("DEGRADE_CALL_SECONDS", "12")),
+        degrade_inflight_threshold=int(os.getenv("DEGRADE_INFLIGHT_THRESHOLD", "8")),
         agent_audit_log=_env_bool("AGENT_AUDIT_LOG", "false"),
+        log_dump_sample_rate=float(os.getenv("LOG_DUMP_SAMPLE_RATE", "1.0")),
         enable_budget_risk=_env_bool("ENABLE_BUDGET_RISK", "false"),
         rag_enabled=_env_bool("RAG_ENABLED", "false"),
         rag_top_k=int(os.getenv("RAG_TOP_K", "4")),
@@ -86,4 +200,22 @@ def get_settings() -> Settings:
         dual_rate_slow_every=int(os.getenv("DUAL_RATE_SLOW_EVERY", "4")),
         dual_rate_slow_importance=float(os.getenv("DUAL_RATE_SLOW_IMPORTANCE", "3.0")),
         dual_rate_recent_keep=int(os.getenv("DUAL_RATE_RECENT_KEEP", "1")),
+        auth_code_max_per_email=int(os.getenv("AUTH_CODE_MAX_PER_EMAIL", "5")),
+        auth_code_max_per_ip=int(os.getenv("AUTH_CODE_MAX_PER_IP", "20")),
+        auth_code_window_seconds=int(os.getenv("AUTH_CODE_WINDOW_SECONDS", "900")),
+        auth_code_sweep_interval_seconds=int(os.getenv("AUTH_CODE_SWEEP_INTERVAL_SECONDS", "600")),
+        trusted_proxy_count=max(0, int(os.getenv("TRUSTED_PROXY_COUNT", "1"))),
+        email_outbox_batch_size=int(os.getenv("EMAIL_OUTBOX_BATCH_SIZE", "50")),
+        email_outbox_poll_seconds=float(os.getenv("EMAIL_OUTBOX_POLL_SECONDS", "5")),
+        email_outbox_max_attempts=int(os.getenv("EMAIL_OUTBOX_MAX_ATTEMPTS", "5")),
+        email_outbox_backoff_seconds=float(os.getenv("EMAIL_OUTBOX_BACKOFF_SECONDS", "2")),
+        email_outbox_max_age_seconds=int(os.getenv("EMAIL_OUTBOX_MAX_AGE_SECONDS", "600")),
+        cache_notify_enabled=_env_bool("CACHE_NOTIFY_ENABLED", "true"),
+        breaker_failure_rate=float(os.getenv("BREAKER_FAILURE_RATE", "0.5")),
+        breaker_min_calls=int(os.getenv("BREAKER_MIN_CALLS", "5")),
+        breaker_window_seconds=float(os.getenv("BREAKER_WINDOW_SECONDS", "60")),
+        breaker_open_seconds=float(os.getenv("BREAKER_OPEN_SECONDS", "30")),
+        memory_dedup_threshold=float(os.getenv("MEMORY_DEDUP_THRESHOLD", "0.95")),
+        memory_keep_per_user=int(os.getenv("MEMORY_KEEP_PER_USER", "100")),
+        memory_compact_interval_seconds=int(os.getenv("MEMORY_COMPACT_INTERVAL_SECONDS", "900")),
     )
@@ -1,11 +1,17 @@
-﻿import os
+﻿import asyncio
+import os
 from datetime import date
-from typing import Any, Dict
+from typing import Any, Dict, List, Tuple
 
-import httpx
+from . import deadline
+from .breaker import CircuitOpenError, get_breaker
+from .http_clients import get_client
+from .logs import log_event
 
+WeatherQuery = Tuple[str | None, str | None, int | None]
 
-def _normalize_date(value: str | None) -> str:
+
+def normalize_date(value: str | None) -> str:
     if not value:
         return date.today().isoformat()
     normalized = value.strip().replace("/", "-")
@@ -16,9 +22,9 @@ def _normalize_date(value: str | None) -> str:
     return date.today().isoformat()
 
 
-def _audit(msg: str) -> None:
+def _audit(event: str, **fields: Any) -> None:
     if os.getenv("AGENT_AUDIT_LOG", "false").strip().lower() == "true":
-        print(msg)
+        log_event(event, **fields)
 
 
 async def get_weather_context(destination: str | None, start_date: str | None, days: int | None) -> str:
@@ -34,93 +40,165 @@ async def get_weather_context(destination: str | None, start_date: str | None, d
     return await _get_weather_fallback(destination, start_date, days)
 
 
-async def _get_weather_from_mcp(destination: str, start_date: str | None, days: int | None) -> str:
+def _mcp_config() -> Tuple[str, Dict[str, str]]:
     mcp_url = os.getenv("MCP_WEATHER_URL", "").strip()
     mcp_token = os.getenv("MCP_TOKEN", "").strip()
-    if not mcp_url:
-        return ""
-
     headers: Dict[str, str] = {"Content-Type": "application/json"}
     if mcp_token and mcp_token.isascii():
         headers["Authorization"] = f"Bearer {mcp_token}"
     elif mcp_token:
-        _audit("[mcp_weather] invalid MCP_TOKEN (non-ascii), ignored")
+        _audit("mcp_weather", status="invalid_token", detail="MCP_TOKEN is non-ascii, ignored")
+    return mcp_url, headers
+
+
+async def _get_weather_from_mcp(destination: str, start_date: str | None, days: int | None) -> str:
+    mcp_url, headers = _mcp_config()
+    if not mcp_url:
+        return ""
 
     payload: Dict[str, Any] = {
         "tool": "weather",
         "input": {
             "destination": destination,
-            "start_date": _normalize_date(start_date),
+            "start_date": normalize_date(start_date),
             "days": days,
         },
     }
 
     try:
-        async with httpx.AsyncClient(timeout=15) as client:
-            resp = await client.post(mcp_url, headers=headers, json=payload)
+        timeout = deadline.timeout_for(15, stage="mcp_weather")
+        async with get_breaker("mcp").guard():
+            resp = await get_client("mcp").post(mcp_url, headers=headers, json=payload, timeout=timeout)
             resp.raise_for_status()
             data = resp.json()
 
         text = data.get("context") or data.get("result") or ""
-        _audit("[mcp_weather] success")
+        _audit("mcp_weather", status="success")
         return str(text).strip()
+    except CircuitOpenError:
+        _audit("mcp_weather", status="circuit_open")
+        return ""
     except Exception as exc:
-        _audit(f"[mcp_weather] error: {exc}")
+        _audit("mcp_weather", status="error", error=str(exc))
         return ""
 
 
+async def _get_weather_batch_from_mcp(queries: List[WeatherQuery]) -> List[str]:
+    mcp_url, headers = _mcp_config()
+    if not mcp_url or not queries:
+        return ["" for _ in queries]
+
+    payload: Dict[str, Any] = {
+        "tool": "weather_batch",
+        "input": {
+            "items": [
+                {"destination": dest, "start_date": normalize_date(start), "days": days}
+                for dest, start, days in queries
+            ]
+        },
+    }
+
+    try:
+        timeout = deadline.timeout_for(20, stage="mcp_weather")
+        async with get_breaker("mcp").guard():
+            resp = await get_client("mcp").post(mcp_url, headers=headers, json=payload, timeout=timeout)
+            resp.raise_for_status()
+            results = resp.json().get("results") or []
+        _audit("mcp_weather", status="success", batch=len(queries))
+        contexts = [str((r or {}).get("context") or "").strip() for r in results]
+        return (contexts + [""] * len(queries))[: len(queries)]
+    except CircuitOpenError:
+        _audit("mcp_weather", status="circuit_open", batch=len(queries))
+        return ["" for _ in queries]
+    except Exception as exc:
+        _audit("mcp_weather", status="error", batch=len(queries), error=str(exc))
+        return ["" for _ in queries]
+
+
+async def get_weather_contexts(queries: List[WeatherQuery]) -> List[str]:
+    # Several destinations/date ranges in one MCP round-trip; misses fall back to Open-Meteo concurrently.
+    contexts = ["" for _ in queries]
+    wanted = [i for i, (dest, _, _) in enumerate(queries) if dest]
+    if not wanted:
+        return contexts
+
+    mcp_enabled = os.getenv("MCP_ENABLED", "false").strip().lower() == "true"
+    if mcp_enabled:
+        batch = await _get_weather_batch_from_mcp([queries[i] for i in wanted])
+        for i, text in zip(wanted, batch):
+            contexts[i] = text
+
+    missing = [i for i in wanted if not contexts[i]]
+    fallback = await asyncio.gather(*(_get_weather_fallback(*queries[i]) for i in missing))
+    for i, text in zip(missing, fallback):
+        contexts[i] = text
+    return contexts
+
+
 async def _get_weather_fallback(destination: str, start_date: str | None, days: int | None) -> str:
     try:
-        async with httpx.AsyncClient(timeout=20) as client:
-            geo = await client.get(
-                "https://geocoding-api.open-meteo.com/v1/search",
-                params={"name": destination, "count": 1, "language": "zh", "format": "json"},
-            )
-            geo.raise_for_status()
-            geo_data = geo.json()
-            results = geo_data.get("results") or []
-            if not results:
-                return ""
-
-            loc = results[0]
-            lat = loc["latitude"]
-            lon = loc["longitude"]
-            city_name = loc.get("name") or destination
-
-            forecast_start = _normalize_date(start_date)
-            _ = max(1, min(int(days or 1), 7))
-
-            params = {
-                "latitude": lat,
-                "longitude": lon,
-                "start_date": forecast_start,
-                "end_date": forecast_start,
-                "daily": "temperature_2m_max,temperature_2m_min,precipitation_probability_max,weathercode",
-                "timezone": "auto",
-            }
-            weather = await client.get("https://api.open-meteo.com/v1/forecast", params=params)
-            if weather.status_code == 400:
-                # Fallback for out-of-range dates: request nearest forecast window.
-                params = {
-                    "latitude": lat,
-                    "longitude": lon,
-                    "forecast_days": 1,
-                    "daily": "temperature_2m_max,temperature_2m_min,precipitation_probability_max,weathercode",
-                    "timezone": "auto",
-                }
-                weather = await client.get("https://api.open-meteo.com/v1/forecast", params=params)
-            weather.raise_for_status()
-            daily = weather.json().get("daily", {})
-
-            tmax = (daily.get("temperature_2m_max") or [None])[0]
-            tmin = (daily.get("temperature_2m_min") or [None])[0]
-            rain = (daily.get("precipitation_probability_max") or [None])[0]
-
-            _audit("[fallback_weather] success")
-            return (
-                f"{city_name} 实时天气参考: 最高温 {tmax}°C, 最低温 {tmin}°C, "
-                f"降水概率 {rain}%。请据此调整户外/室内活动。"
-            )
+        timeout = deadline.timeout_for(20, stage="fallback_weather")
+        async with get_breaker("open_meteo").guard():
+            context = await _fetch_open_meteo(destination, start_date, days, timeout)
+        _audit("fallback_weather", status="success" if context else "empty")
+        return context
+    except CircuitOpenError:
+        _audit("fallback_weather", status="circuit_open")
+        return ""
     except Exception as exc:
-        _audit(f"[fallback_weather] error: {exc}")
+        _audit("fallback_weather", status="error", error=str(exc))
+        return ""
+
+
+async def _fetch_open_meteo(destination: str, start_date: str | None, days: int | None, timeout: float) -> str:
+    client = get_client("open_meteo", timeout=20)
+    geo = await client.get(
+        "https://geocoding-api.open-meteo.com/v1/search",
+        params={"name": destination, "count": 1, "language": "zh", "format": "json"},
+        timeout=timeout,
+    )
+    geo.raise_for_status()
+    geo_data = geo.json()
+    results = geo_data.get("results") or []
+    if not results:
         return ""
+
+    loc = results[0]
+    lat = loc["latitude"]
+    lon = loc["longitude"]
+    city_name = loc.get("name") or destination
+
+    forecast_start = normalize_date(start_date)
+    _ = max(1, min(int(days or 1), 7))
+
+    params = {
+        "latitude": lat,
+        "longitude": lon,
+        "start_date": forecast_start,
+        "end_date": forecast_start,
+        "daily": "temperature_2m_max,temperature_2m_min,precipitation_probability_max,weathercode",
+        "timezone": "auto",
+    }
+    timeout = deadline.timeout_for(timeout, stage="fallback_weather")
+    weather = await client.get("https://api.open-meteo.com/v1/forecast", params=params, timeout=timeout)
+    if weather.status_code == 400:
+        # Fallback for out-of-range dates: request nearest forecast window.
+        params = {
+            "latitude": lat,
+            "longitude": lon,
+            "forecast_days": 1,
+            "daily": "temperature_2m_max,temperature_2m_min,precipitation_probability_max,weathercode",
+            "timezone": "auto",
+        }
+        weather = await client.get("https://api.open-meteo.com/v1/forecast", params=params, timeout=timeout)
+    weather.raise_for_status()
+    daily = weather.json().get("daily", {})
+
+    tmax = (daily.get("temperature_2m_max") or [None])[0]
+    tmin = (daily.get("temperature_2m_min") or [None])[0]
+    rain = (daily.get("precipitation_probability_max") or [None])[0]
+
+    return (
+        f"{city_name} 实时天气参考: 最高温 {tmax}°C, 最低温 {tmin}°C, "
+        f"降水概率 {rain}%。请据此调整户外/室内活动。"
+    )
@@ -0,0 +1,66 @@
+import logging
+from datetime import datetime, timezone
+from typing import Any, Dict, List
+
+from . import db
+from .logs import current_request_id, current_user_id, log_event
+from .settings import get_settings
+
+# Per-call LLM accounting. record() only appends to an in-memory buffer (no I/O on the
+# request path); the "llm_usage_flush" job COPYs the buffer into llm_usage in batches.
+
+_buffer: List[tuple] = []
+_stats: Dict[str, int] = {"flushed": 0, "dropped": 0}
+
+
+def record(stage: str, model: str, attempt: int, status: str, latency_ms: int, usage: Dict[str, Any]) -> None:
+    settings = get_settings()
+    if not settings.llm_usage_enabled:
+        return
+    if len(_buffer) >= settings.llm_usage_buffer_max:
+        # The database is behind or down: lose accounting rows rather than memory or latency.
+        _stats["dropped"] += 1
+        return
+    _buffer.append(
+        (
+            datetime.now(timezone.utc),
+            current_request_id(),
+            current_user_id(),
+            stage,
+            model,
+            attempt,
+            status,
+            usage.get("prompt_tokens") or 0,
+            usage.get("completion_tokens") or 0,
+            (usage.get("prompt_tokens_details") or {}).get("cached_tokens") or 0,
+            latency_ms,
+        )
+    )
+
+
+async def flush() -> None:
+    global _buffer
+    if not _buffer:
+        return
+    rows, _buffer = _buffer, []
+    try:
+        _stats["flushed"] += await db.insert_llm_usage(rows)
+    except Exception as exc:
+        # Put the batch back (oldest first) so the next run retries it; overflow is dropped.
+        room = max(0, get_settings().llm_usage_buffer_max - len(_buffer))
+        _stats["dropped"] += max(0, len(rows) - room)
+        _buffer[:0] = rows[max(0, len(rows) - room):] if room else []
+        log_event("llm_usage_flush", level=logging.WARNING, error=str(exc), requeued=min(room, len(rows)))
+
+
+def cost_usd(prompt_tokens: int, cached_tokens: int, completion_tokens: int) -> float:
+    settings = get_settings()
+    return (
+        (prompt_tokens - cached_tokens) * settings.llm_price_input_per_mtok
+        + cached_tokens * settings.llm_price_cached_input_per_mtok
+        + completion_tokens * settings.llm_price_output_per_mtok
+    ) / 1_000_000
+
+
+def stats() -> Dict[str, int]:
+    return {"buffered": len(_buffer), **_stats}
@@ -0,0 +1,40 @@
+import asyncio
+import os
+import time
+from typing import Any, Awaitable, Dict
+
+from .http_clients import get_client
+from .settings import Settings
+
+# Optional startup phase (STARTUP_WARMUP=true): runs inside the lifespan, before uvicorn
+# accepts requests, so a woken instance only reports healthy once its upstream TLS
+# connections are already established. The touches are best effort and only logged; the
+# DB pool is opened by the lifespan itself, with or without this phase.
+
+
+async def _timed(name: str, coro: Awaitable[Any], timings: Dict[str, Any]) -> None:
+    started = time.perf_counter()
+    try:
+        await coro
+        timings[name] = int((time.perf_counter() - started) * 1000)
+    except Exception as exc:
+        timings[name] = f"error: {exc}"
+
+
+async def _touch(client_name: str, url: str) -> None:
+    # Any HTTP response (even 401/404) leaves a pooled keep-alive connection behind.
+    await get_client(client_name).get(url, timeout=5.0)
+
+
+async def warm_up(settings: Settings) -> Dict[str, Any]:
+    timings: Dict[str, Any] = {}
+    tasks = []
+    if settings.llm_api_key:
+        tasks.append(_timed("llm", _touch("llm", f"{settings.llm_api_base.rstrip('/')}/models"), timings))
+    if settings.resend_api_key and not settings.send_code_in_response:
+        tasks.append(_timed("resend", _touch("resend", "https://api.resend.com/"), timings))
+    mcp_url = os.getenv("MCP_WEATHER_URL", "").strip()
+    if settings.mcp_enabled and mcp_url:
+        tasks.append(_timed("mcp", _touch("mcp", mcp_url), timings))
+    await asyncio.gather(*tasks)
+    return timings
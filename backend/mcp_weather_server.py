@@ -1,11 +1,21 @@
+import asyncio
 import os
-from datetime import date
-from typing import Any, Dict
+from contextlib import asynccontextmanager
+from typing import Any, Dict, List
 
 import httpx
 from fastapi import FastAPI, Header, HTTPException
 from fastapi.responses import HTMLResponse
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
+
+from app.cache import MISSING, TTLCache
+from app.tools import normalize_date
+
+# Geocoding results barely change; forecasts are refreshed every MCP_CACHE_TTL_SECONDS.
+_geo_cache = TTLCache(maxsize=2048, ttl_seconds=24 * 3600)
+_forecast_cache = TTLCache(maxsize=4096, ttl_seconds=float(os.getenv("MCP_CACHE_TTL_SECONDS", "1800")))
+_BATCH_CONCURRENCY = int(os.getenv("MCP_BATCH_CONCURRENCY", "8"))
+_client: httpx.AsyncClient | None = None
 
 
 class WeatherInput(BaseModel):
@@ -14,12 +24,35 @@ class WeatherInput(BaseModel):
     days: int | None = 1
 
 
+class WeatherBatchInput(BaseModel):
+    items: List[WeatherInput] = Field(min_length=1, max_length=50)
+
+
 class MCPRequest(BaseModel):
     tool: str
-    input: WeatherInput
+    input: WeatherInput | WeatherBatchInput
+
 
+def _get_client() -> httpx.AsyncClient:
+    # One keep-alive client shared by every tool call.
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            timeout=20,
+            limits=httpx.Limits(max_connections=50, max_keepalive_connections=20, keepalive_expiry=60),
+        )
+    return _client
 
-app = FastAPI(title="MCP Weather Tool", version="0.1.0")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    _get_client()
+    yield
+    if _client is not None:
+        await _client.aclose()
+
+
+app = FastAPI(title="MCP Weather Tool", version="0.2.0", lifespan=lifespan)
 
 
 @app.get("/", response_class=HTMLResponse)
@@ -76,65 +109,111 @@ def ui() -> str:
 </html>"""
 
 
-def _normalize_date(value: str | None) -> str:
-    if not value:
-        return date.today().isoformat()
-    normalized = value.strip().replace("/", "-")
-    parts = normalized.split("-")
-    if len(parts) == 3 and all(p.isdigit() for p in parts):
-        y, m, d = parts
-        return f"{int(y):04d}-{int(m):02d}-{int(d):02d}"
-    return date.today().isoformat()
+async def _geocode(client: httpx.AsyncClient, destination: str) -> Dict[str, Any] | None:
+    key = destination.strip().lower()
+    cached = _geo_cache.get(key)
+    if cached is not MISSING:
+        return cached
+    geo = await client.get(
+        "https://geocoding-api.open-meteo.com/v1/search",
+        params={"name": destination, "count": 1, "language": "zh", "format": "json"},
+    )
+    geo.raise_for_status()
+    results = (geo.json() or {}).get("results") or []
+    loc = results[0] if results else None
+    _geo_cache.set(key, loc)
+    return loc
 
 
 async def _build_weather_context(destination: str, start_date: str | None, days: int | None) -> str:
-    async with httpx.AsyncClient(timeout=20) as client:
-        geo = await client.get(
-            "https://geocoding-api.open-meteo.com/v1/search",
-            params={"name": destination, "count": 1, "language": "zh", "format": "json"},
-        )
-        geo.raise_for_status()
-        results = (geo.json() or {}).get("results") or []
-        if not results:
-            return ""
-
-        loc = results[0]
-        lat = loc["latitude"]
-        lon = loc["longitude"]
-        city_name = loc.get("name") or destination
-
-        forecast_start = _normalize_date(start_date)
-        _ = max(1, min(int(days or 1), 7))
-
+    key = (destination.strip().lower(), normalize_date(start_date), days)
+    cached = _forecast_cache.get(key)
+    if cached is not MISSING:
+        return cached
+    context = await _fetch_weather_context(_get_client(), destination, start_date, days)
+    _forecast_cache.set(key, context)
+    return context
+
+
+async def _fetch_weather_context(
+    client: httpx.AsyncClient,
+    destination: str,
+    start_date: str | None,
+    days: int | None,
+) -> str:
+    loc = await _geocode(client, destination)
+    if not loc:
+        return ""
+
+    lat = loc["latitude"]
+    lon = loc["longitude"]
+    city_name = loc.get("name") or destination
+
+    forecast_start = normalize_date(start_date)
+    _ = max(1, min(int(days or 1), 7))
+
+    params = {
+        "latitude": lat,
+        "longitude": lon,
+        "start_date": forecast_start,
+        "end_date": forecast_start,
+        "daily": "temperature_2m_max,temperature_2m_min,precipitation_probability_max",
+        "timezone": "auto",
+    }
+    weather = await client.get("https://api.open-meteo.com/v1/forecast", params=params)
+    if weather.status_code == 400:
         params = {
             "latitude": lat,
             "longitude": lon,
-            "start_date": forecast_start,
-            "end_date": forecast_start,
+            "forecast_days": 1,
             "daily": "temperature_2m_max,temperature_2m_min,precipitation_probability_max",
             "timezone": "auto",
         }
         weather = await client.get("https://api.open-meteo.com/v1/forecast", params=params)
-        if weather.status_code == 400:
-            params = {
-                "latitude": lat,
-                "longitude": lon,
-                "forecast_days": 1,
-                "daily": "temperature_2m_max,temperature_2m_min,precipitation_probability_max",
-                "timezone": "auto",
-            }
-            weather = await client.get("https://api.open-meteo.com/v1/forecast", params=params)
-        weather.raise_for_status()
-        daily = (weather.json() or {}).get("daily") or {}
+    weather.raise_for_status()
+    daily = (weather.json() or {}).get("daily") or {}
+
+    tmax = (daily.get("temperature_2m_max") or [None])[0]
+    tmin = (daily.get("temperature_2m_min") or [None])[0]
+    rain = (daily.get("precipitation_probability_max") or [None])[0]
 
-        tmax = (daily.get("temperature_2m_max") or [None])[0]
-        tmin = (daily.get("temperature_2m_min") or [None])[0]
-        rain = (daily.get("precipitation_probability_max") or [None])[0]
+    return (
+        f"{city_name} weather: max {tmax}C, min {tmin}C, "
+        f"rain probability {rain}%. Use this to adjust indoor/outdoor activities."
+    )
 
-        return (
-            f"{city_name} weather: max {tmax}C, min {tmin}C, "
-            f"rain probability {rain}%. Use this to adjust indoor/outdoor activities."
+
+async def _build_weather_batch(items: List[WeatherInput]) -> List[Dict[str, Any]]:
+    sem = asyncio.Semaphore(_BATCH_CONCURRENCY)
+    # Identical (destination, date, days) entries are resolved once.
+    pending: Dict[tuple, asyncio.Task] = {}
+
+    async def resolve(item: WeatherInput) -> Dict[str, Any]:
+        async with sem:
+            try:
+                context = await _build_weather_context(item.destination, item.start_date, item.days)
+                return {"context": context}
+            except Exception as exc:
+                return {"context": "", "error": str(exc)}
+
+    for item in items:
+        key = (item.destination.strip().lower(), normalize_date(item.start_date), item.days)
+        if key not in pending:
+            pending[key] = asyncio.ensure_future(resolve(item))
+    await asyncio.gather(*pending.values())
+
+    results = []
+    for item in items:
+        key = (item.destination.strip().lower(), normalize_date(item.start_date), item.days)
+        results.append(
+            {
+                "destination": item.destination,
+                "start_date": normalize_date(item.start_date),
+                "days": item.days,
+                **pending[key].result(),
+            }
         )
+    return results
 
 
 @app.post("/weather")
@@ -147,12 +226,15 @@ async def weather_tool(req: MCPRequest, authorization: str | None = Header(defau
         if token != expected_token:
             raise HTTPException(status_code=401, detail="Invalid token")
 
-    if req.tool != "weather":
-        raise HTTPException(status_code=400, detail="Unsupported tool")
+    if req.tool == "weather" and isinstance(req.input, WeatherInput):
+        context = await _build_weather_context(
+            destination=req.input.destination,
+            start_date=req.input.start_date,
+            days=req.input.days,
+        )
+        return {"context": context}
 
-    context = await _build_weather_context(
-        destination=req.input.destination,
-        start_date=req.input.start_date,
-        days=req.input.days,
-    )
-    return {"context": context}
+    if req.tool == "weather_batch" and isinstance(req.input, WeatherBatchInput):
+        return {"results": await _build_weather_batch(req.input.items)}
+
+    raise HTTPException(status_code=400, detail="Unsupported tool")
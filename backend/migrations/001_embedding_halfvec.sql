@@ -0,0 +1,34 @@
+-- Shrink stored embeddings to 512-d half precision (float16).
+--
+-- text-embedding-3-* vectors keep their ranking quality when only the leading
+-- dimensions are kept, which is what the embeddings API `dimensions` parameter
+-- does. Cosine distance (<=>) ignores vector length, so existing rows can be
+-- truncated in place instead of being re-embedded.
+--
+-- Requires pgvector >= 0.7 (halfvec, subvector). After applying, set on the backend:
+--   EMBEDDING_DIMENSIONS=512
+--   EMBEDDING_STORAGE=halfvec
+-- and re-run `python -m scripts.bench_embedding_storage` to confirm recall for
+-- your corpus if you pick a different dimension.
+
+begin;
+
+drop index if exists knowledge_docs_embedding_idx;
+
+alter table user_memory_docs
+  alter column embedding type halfvec(512)
+  using subvector(embedding::vector, 1, 512)::halfvec(512);
+
+alter table knowledge_docs
+  alter column embedding type halfvec(512)
+  using subvector(embedding::vector, 1, 512)::halfvec(512);
+
+create index if not exists knowledge_docs_embedding_idx
+  on knowledge_docs using hnsw (embedding halfvec_cosine_ops);
+
+-- Per-user memory lookups scan at most ~100 rows per user; a btree on the
+-- owner is cheaper than a global ANN index here.
+create index if not exists user_memory_docs_user_created_idx
+  on user_memory_docs (user_id, created_at desc);
+
+commit;
@@ -0,0 +1,5 @@
+-- Index backing keyset pagination of GET /api/me/search-history?view=summary
+-- (where user_id = ? and (created_at, id) < (?, ?) order by created_at desc, id desc).
+
+create index if not exists user_search_history_user_created_idx
+  on user_search_history (user_id, created_at desc, id desc);
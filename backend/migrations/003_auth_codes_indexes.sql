@@ -0,0 +1,8 @@
+-- verify_code: where email=? and purpose=? and expires_at > now() order by created_at desc limit 1
+-- store_code throttle: where email=? and created_at > now() - window
+create index if not exists auth_codes_email_purpose_created_idx
+  on auth_codes (email, purpose, created_at desc);
+
+-- Expired-code sweeper: delete ... where expires_at < now() limit N
+create index if not exists auth_codes_expires_idx
+  on auth_codes (expires_at);
@@ -0,0 +1,19 @@
+-- Transactional outbox for verification-code emails. Rows are written in the
+-- same transaction as auth_codes and delivered by the background dispatcher
+-- (app/mailer.py). status: pending -> sent | dead.
+
+create table if not exists email_outbox (
+  id uuid primary key default gen_random_uuid(),
+  to_email text not null,
+  subject text not null,
+  body text not null,
+  status text not null default 'pending',
+  attempts int not null default 0,
+  next_attempt_at timestamptz not null default now(),
+  last_error text,
+  created_at timestamptz not null default now(),
+  sent_at timestamptz
+);
+
+create index if not exists email_outbox_pending_idx
+  on email_outbox (next_attempt_at) where status = 'pending';
@@ -0,0 +1,24 @@
+-- One row per LLM call (stage, model, tokens, latency), written in batches by the
+-- usage recorder (app/usage.py). No foreign key on user_id: accounting rows outlive
+-- deleted users and the insert path stays a plain COPY.
+
+create table if not exists llm_usage (
+  id bigserial primary key,
+  created_at timestamptz not null default now(),
+  request_id text,
+  user_id uuid,
+  stage text not null,
+  model text not null,
+  attempt int not null default 0,
+  status text not null default 'ok',
+  prompt_tokens int not null default 0,
+  completion_tokens int not null default 0,
+  cached_tokens int not null default 0,
+  latency_ms int not null
+);
+
+create index if not exists llm_usage_created_idx
+  on llm_usage (created_at);
+
+create index if not exists llm_usage_user_created_idx
+  on llm_usage (user_id, created_at) where user_id is not null;
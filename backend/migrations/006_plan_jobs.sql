@@ -0,0 +1,30 @@
+-- Asynchronous plan jobs (POST /api/plan/jobs). Any API worker can serve a poll; the
+-- in-process job workers (app/plan_jobs.py) claim queued rows with FOR UPDATE SKIP LOCKED.
+-- Finished results are stored in trip_requests / trip_plans.
+-- status: queued -> running -> done | failed
+
+create table if not exists plan_jobs (
+  id uuid primary key default gen_random_uuid(),
+  user_id uuid references users(id) on delete cascade,
+  status text not null default 'queued',
+  request jsonb not null,
+  attempts int not null default 0,
+  locked_until timestamptz,
+  plan_id uuid references trip_plans(id) on delete set null,
+  error text,
+  created_at timestamptz not null default now(),
+  started_at timestamptz,
+  finished_at timestamptz
+);
+
+create index if not exists plan_jobs_queued_idx
+  on plan_jobs (created_at) where status = 'queued';
+
+create index if not exists plan_jobs_running_idx
+  on plan_jobs (locked_until) where status = 'running';
+
+create index if not exists plan_jobs_finished_idx
+  on plan_jobs (finished_at) where status in ('done', 'failed');
+
+create index if not exists trip_plans_request_idx
+  on trip_plans (request_id);
@@ -0,0 +1,78 @@
+-- Store each plan result once. A logged-in plan used to write the same PlanResponse JSON to
+-- user_plans.data and to user_search_history.result; both now reference a row in
+-- plan_results, keyed by the sha256 of the JSON text as first written (the API's serialized
+-- response body; jsonb::text for rows backfilled here).
+--
+-- encoding: 'json' (data jsonb) or 'zstd' (blob = zstd-compressed JSON, written by the
+-- backend when PLAN_RESULT_COMPRESSION=zstd). summary holds what the history list view
+-- needs (days, destination names, warning count), so listing never decodes a result.
+--
+-- Existing rows are backfilled as 'json' (SQL cannot zstd); to compress them afterwards run
+--   cd backend && STORAGE_RECOMPRESS=true python -m scripts.plan_storage_report
+-- Deploy the matching backend right after applying: the old inline columns are dropped.
+
+begin;
+
+create table if not exists plan_results (
+  hash text primary key,
+  encoding text not null default 'json',
+  data jsonb,
+  blob bytea,
+  summary jsonb not null default '{}'::jsonb,
+  raw_bytes int not null,
+  touched_at timestamptz not null default now(),
+  check ((encoding = 'json' and data is not null) or (encoding = 'zstd' and blob is not null))
+);
+
+-- Unreferenced results are garbage-collected once untouched for a while.
+create index if not exists plan_results_touched_idx
+  on plan_results (touched_at);
+
+alter table user_plans
+  add column if not exists result_hash text references plan_results(hash);
+
+alter table user_search_history
+  add column if not exists result_hash text references plan_results(hash);
+
+insert into plan_results (hash, encoding, data, summary, raw_bytes)
+select distinct on (hash)
+  hash,
+  'json',
+  j,
+  jsonb_build_object(
+    'days', jsonb_array_length(coalesce(j->'daily_plan', '[]'::jsonb)),
+    'top_destinations', (
+      select coalesce(jsonb_agg(d->>'name'), '[]'::jsonb)
+      from jsonb_array_elements(coalesce(j->'top_destinations', '[]'::jsonb)) d
+    ),
+    'warnings', jsonb_array_length(coalesce(j->'warnings', '[]'::jsonb))
+  ),
+  octet_length(j::text)
+from (
+  select result as j from user_search_history
+  union all
+  select data from user_plans
+) src
+cross join lateral (select encode(sha256(convert_to(j::text, 'UTF8')), 'hex') as hash) h
+on conflict (hash) do nothing;
+
+update user_search_history
+set result_hash = encode(sha256(convert_to(result::text, 'UTF8')), 'hex')
+where result_hash is null;
+
+update user_plans
+set result_hash = encode(sha256(convert_to(data::text, 'UTF8')), 'hex')
+where result_hash is null;
+
+alter table user_search_history alter column result_hash set not null;
+alter table user_plans alter column result_hash set not null;
+alter table user_search_history drop column if exists result;
+alter table user_plans drop column if exists data;
+
+create index if not exists user_plans_result_hash_idx
+  on user_plans (result_hash);
+
+create index if not exists user_search_history_result_hash_idx
+  on user_search_history (result_hash);
+
+commit;
@@ -0,0 +1,29 @@
+-- Precomputed plans for popular requests. The plan_precompute job (app/plan_cache.py) mines
+-- user_search_history for the most frequent canonical requests (origin, destination, days,
+-- month of travel, travelers, budget, preferences, pace, constraints, language) and
+-- regenerates them off-peak; POST /api/plan answers a matching request from here.
+--
+-- key: sha256 of the canonical request. The result is stored once in plan_results.
+
+create table if not exists plan_cache (
+  key text primary key,
+  request jsonb not null,
+  result_hash text not null references plan_results(hash),
+  requests int not null default 0,
+  hits int not null default 0,
+  prompt_tokens int not null default 0,
+  completion_tokens int not null default 0,
+  generated_at timestamptz not null default now(),
+  expires_at timestamptz not null,
+  last_hit_at timestamptz
+);
+
+create index if not exists plan_cache_expires_idx
+  on plan_cache (expires_at);
+
+create index if not exists plan_cache_result_hash_idx
+  on plan_cache (result_hash);
+
+-- Mining reads the last PLAN_PRECOMPUTE_LOOKBACK_DAYS of history across all users.
+create index if not exists user_search_history_created_idx
+  on user_search_history (created_at);
@@ -0,0 +1,9 @@
+-- Per-caller cap on pending plan jobs (PLAN_JOB_MAX_PENDING). owner_key is the user id for
+-- logged-in submissions and the client IP for anonymous ones; enqueue_plan_job counts the
+-- caller's queued/running rows through the partial index below.
+
+alter table plan_jobs
+  add column if not exists owner_key text;
+
+create index if not exists plan_jobs_owner_pending_idx
+  on plan_jobs (owner_key) where status in ('queued', 'running');
@@ -1,5 +1,7 @@
 -- Core tables for requests, plans, and feedback
 
+create extension if not exists vector;
+
 create table if not exists trip_requests (
   id uuid primary key,
   created_at timestamptz not null default now(),
@@ -27,6 +29,9 @@ create table if not exists trip_plans (
   warnings jsonb not null default '[]'
 );
 
+create index if not exists trip_plans_request_idx
+  on trip_plans (request_id);
+
 create table if not exists feedback (
   id uuid primary key,
   plan_id uuid not null references trip_plans(id),
@@ -55,27 +60,121 @@ create table if not exists auth_codes (
   expires_at timestamptz not null
 );
 
+create index if not exists auth_codes_email_purpose_created_idx
+  on auth_codes (email, purpose, created_at desc);
+
+create index if not exists auth_codes_expires_idx
+  on auth_codes (expires_at);
+
+create table if not exists email_outbox (
+  id uuid primary key default gen_random_uuid(),
+  to_email text not null,
+  subject text not null,
+  body text not null,
+  status text not null default 'pending',
+  attempts int not null default 0,
+  next_attempt_at timestamptz not null default now(),
+  last_error text,
+  created_at timestamptz not null default now(),
+  sent_at timestamptz
+);
+
+create index if not exists email_outbox_pending_idx
+  on email_outbox (next_attempt_at) where status = 'pending';
+
+-- Asynchronous plan jobs; results live in trip_requests / trip_plans.
+create table if not exists plan_jobs (
+  id uuid primary key default gen_random_uuid(),
+  user_id uuid references users(id) on delete cascade,
+  status text not null default 'queued',
+  request jsonb not null,
+  owner_key text,
+  attempts int not null default 0,
+  locked_until timestamptz,
+  plan_id uuid references trip_plans(id) on delete set null,
+  error text,
+  created_at timestamptz not null default now(),
+  started_at timestamptz,
+  finished_at timestamptz
+);
+
+create index if not exists plan_jobs_queued_idx
+  on plan_jobs (created_at) where status = 'queued';
+
+create index if not exists plan_jobs_running_idx
+  on plan_jobs (locked_until) where status = 'running';
+
+create index if not exists plan_jobs_finished_idx
+  on plan_jobs (finished_at) where status in ('done', 'failed');
+
+create index if not exists plan_jobs_owner_pending_idx
+  on plan_jobs (owner_key) where status in ('queued', 'running');
+
+-- Per-call LLM accounting (see app/usage.py).
+create table if not exists llm_usage (
+  id bigserial primary key,
+  created_at timestamptz not null default now(),
+  request_id text,
+  user_id uuid,
+  stage text not null,
+  model text not null,
+  attempt int not null default 0,
+  status text not null default 'ok',
+  prompt_tokens int not null default 0,
+  completion_tokens int not null default 0,
+  cached_tokens int not null default 0,
+  latency_ms int not null
+);
+
+create index if not exists llm_usage_created_idx
+  on llm_usage (created_at);
+
+create index if not exists llm_usage_user_created_idx
+  on llm_usage (user_id, created_at) where user_id is not null;
+
 create table if not exists user_preferences (
   user_id uuid primary key references users(id) on delete cascade,
   data jsonb not null default '{}'::jsonb,
   updated_at timestamptz not null default now()
 );
 
+-- Plan results stored once (content-addressed), referenced by plans and history.
+-- encoding 'json' keeps data; 'zstd' keeps the compressed JSON in blob.
+create table if not exists plan_results (
+  hash text primary key,
+  encoding text not null default 'json',
+  data jsonb,
+  blob bytea,
+  summary jsonb not null default '{}'::jsonb,
+  raw_bytes int not null,
+  touched_at timestamptz not null default now(),
+  check ((encoding = 'json' and data is not null) or (encoding = 'zstd' and blob is not null))
+);
+
+create index if not exists plan_results_touched_idx
+  on plan_results (touched_at);
+
 create table if not exists user_plans (
   id uuid primary key default gen_random_uuid(),
   user_id uuid not null references users(id) on delete cascade,
-  data jsonb not null,
+  result_hash text not null references plan_results(hash),
   created_at timestamptz not null default now()
 );
 
+create index if not exists user_plans_result_hash_idx
+  on user_plans (result_hash);
+
 create table if not exists user_search_history (
   id uuid primary key default gen_random_uuid(),
   user_id uuid not null references users(id) on delete cascade,
   query jsonb not null,
-  result jsonb not null,
+  result_hash text not null references plan_results(hash),
   created_at timestamptz not null default now()
 );
 
+create index if not exists user_search_history_result_hash_idx
+  on user_search_history (result_hash);
+
 create table if not exists user_memory_docs (
   id uuid primary key default gen_random_uuid(),
   user_id uuid not null references users(id) on delete cascade,
@@ -85,3 +184,43 @@ create table if not exists user_memory_docs (
   embedding vector(1536) not null,
   created_at timestamptz not null default now()
 );
+
+create index if not exists user_search_history_user_created_idx
+  on user_search_history (user_id, created_at desc, id desc);
+
+create index if not exists user_memory_docs_user_created_idx
+  on user_memory_docs (user_id, created_at desc);
+
+create index if not exists user_search_history_created_idx
+  on user_search_history (created_at);
+
+-- Precomputed plans for popular requests (see migrations/008_plan_cache.sql).
+create table if not exists plan_cache (
+  key text primary key,
+  request jsonb not null,
+  result_hash text not null references plan_results(hash),
+  requests int not null default 0,
+  hits int not null default 0,
+  prompt_tokens int not null default 0,
+  completion_tokens int not null default 0,
+  generated_at timestamptz not null default now(),
+  expires_at timestamptz not null,
+  last_hit_at timestamptz
+);
+
+create index if not exists plan_cache_expires_idx
+  on plan_cache (expires_at);
+
+create index if not exists plan_cache_result_hash_idx
+  on plan_cache (result_hash);
+
+-- RAG knowledge base (see scripts/ingest_knowledge.py).
+-- To store reduced-dimension half-precision embeddings apply migrations/001_embedding_halfvec.sql.
+create table if not exists knowledge_docs (
+  id uuid primary key default gen_random_uuid(),
+  title text not null,
+  source text,
+  content text not null,
+  embedding vector(1536) not null,
+  created_at timestamptz not null default now()
+);
@@ -0,0 +1,146 @@
+import json
+import math
+import os
+import struct
+from pathlib import Path
+from typing import Any, Dict, List
+
+import httpx
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from scripts.ingest_knowledge import chunk_text
+
+# Recall of reduced-dimension / half-precision embeddings against full float32 vectors.
+#   cd backend && python -m scripts.bench_embedding_storage
+CASE_FILE = os.getenv("EVAL_CASES", "scripts/eval_dualrate_cases.jsonl")
+KNOWLEDGE_DIR = os.getenv("BENCH_KNOWLEDGE_DIR", "knowledge")
+OUT_FILE = os.getenv("BENCH_OUT", "scripts/bench_embedding_storage_report.json")
+TOP_K = int(os.getenv("RAG_TOP_K", "4"))
+DIMENSIONS = [int(d) for d in os.getenv("BENCH_DIMENSIONS", "256,512,768,1024,1536").split(",") if d.strip()]
+
+
+def embed_batch(texts: List[str]) -> List[List[float]]:
+    api_key = os.getenv("LLM_API_KEY", "").strip()
+    if not api_key:
+        raise RuntimeError("LLM_API_KEY not set")
+    provider = os.getenv("LLM_PROVIDER", "openai").strip().lower()
+    default_base = "https://models.github.ai/inference" if provider == "github" else "https://api.openai.com/v1"
+    api_base = os.getenv("LLM_API_BASE", default_base).strip()
+    model = os.getenv("EMBEDDING_MODEL", "text-embedding-3-small").strip()
+
+    vectors: List[List[float]] = []
+    with httpx.Client(timeout=60) as client:
+        for start in range(0, len(texts), 64):
+            resp = client.post(
+                f"{api_base.rstrip('/')}/embeddings",
+                headers={"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"},
+                json={"model": model, "input": texts[start:start + 64]},
+            )
+            resp.raise_for_status()
+            rows = sorted(resp.json()["data"], key=lambda r: r["index"])
+            vectors.extend(r["embedding"] for r in rows)
+    return vectors
+
+
+def load_corpus() -> List[str]:
+    docs: List[str] = []
+    for file in sorted(Path(KNOWLEDGE_DIR).glob("*.txt")):
+        docs.extend(chunk_text(file.read_text(encoding="utf-8"), chunk_size=300, overlap=50))
+    # Memory-style documents, shaped like retrieval.save_user_memory_from_plan output.
+    for case in load_cases():
+        docs.append(
+            "\n".join(
+                [
+                    f"路线: {case.get('origin') or '出发地'} -> {case.get('destination') or '目的地'}",
+                    f"天数: {case.get('days')}",
+                    f"偏好: {', '.join(case.get('preferences') or [])}",
+                    f"约束: {'; '.join(case.get('constraints') or [])}",
+                ]
+            )
+        )
+    return docs
+
+
+def load_cases() -> List[Dict[str, Any]]:
+    with open(CASE_FILE, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def query_text(case: Dict[str, Any]) -> str:
+    return " ".join(
+        [
+            case.get("origin") or "",
+            case.get("destination") or "",
+            case.get("budget_text") or "",
+            " ".join(case.get("preferences") or []),
+            " ".join(case.get("constraints") or []),
+        ]
+    ).strip()
+
+
+def reduce(vector: List[float], dims: int, half: bool) -> List[float]:
+    out = vector[:dims]
+    if half:
+        out = list(struct.unpack(f"{len(out)}e", struct.pack(f"{len(out)}e", *out)))
+    return out
+
+
+def cosine(a: List[float], b: List[float]) -> float:
+    dot = sum(x * y for x, y in zip(a, b))
+    na = math.sqrt(sum(x * x for x in a))
+    nb = math.sqrt(sum(y * y for y in b))
+    return dot / (na * nb) if na and nb else 0.0
+
+
+def top_k(query: List[float], corpus: List[List[float]], k: int) -> List[int]:
+    scored = sorted(range(len(corpus)), key=lambda i: cosine(query, corpus[i]), reverse=True)
+    return scored[:k]
+
+
+def row_bytes(dims: int, half: bool) -> int:
+    # varlena header (4) + dim (2) + unused (2) + values
+    return 8 + dims * (2 if half else 4)
+
+
+def main() -> None:
+    corpus = load_corpus()
+    queries = [q for q in (query_text(c) for c in load_cases()) if q]
+    if not corpus or not queries:
+        raise RuntimeError("empty corpus or query set")
+    k = min(TOP_K, len(corpus))
+
+    full = embed_batch(corpus + queries)
+    doc_vecs, query_vecs = full[: len(corpus)], full[len(corpus):]
+    max_dims = len(doc_vecs[0])
+    baseline = [set(top_k(q, doc_vecs, k)) for q in query_vecs]
+
+    rows = []
+    for dims in [d for d in DIMENSIONS if d <= max_dims]:
+        for half in (False, True):
+            docs = [reduce(v, dims, half) for v in doc_vecs]
+            hits = 0
+            for q, expected in zip(query_vecs, baseline):
+                hits += len(set(top_k(reduce(q, dims, half), docs, k)) & expected)
+            recall = hits / (k * len(query_vecs))
+            size = row_bytes(dims, half)
+            rows.append(
+                {
+                    "storage": "halfvec" if half else "vector",
+                    "dimensions": dims,
+                    "bytes_per_row": size,
+                    "size_vs_baseline": round(size / row_bytes(max_dims, False), 3),
+                    f"recall_at_{k}": round(recall, 4),
+                }
+            )
+            print(f"[bench] {rows[-1]['storage']:<7} dims={dims:<5} bytes={size:<6} recall@{k}={recall:.3f}")
+
+    report = {"corpus_size": len(corpus), "query_count": len(queries), "top_k": k, "results": rows}
+    with open(OUT_FILE, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"saved: {OUT_FILE}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+import asyncio
+import json
+import os
+import secrets
+import statistics
+import tempfile
+import time
+from typing import Any, Awaitable, Callable, Dict, List
+
+from dotenv import load_dotenv
+
+# Load .env before importing db module, because db reads env on import. One pooled connection,
+# so the libpq trace attached to it sees every statement of both write paths.
+load_dotenv()
+os.environ["DB_POOL_MIN_SIZE"] = "1"
+os.environ["DB_POOL_MAX_SIZE"] = "1"
+
+from psycopg.pq import Trace
+
+from app import db
+from app.retrieval import memory_doc_from_plan
+
+# Post-plan persistence for a logged-in user: the four separate writes (prefs, plan, history,
+# memory refresh) vs. db.save_plan_result (one pipelined transaction, prefs skipped when unchanged).
+#   cd backend && python -m scripts.bench_plan_persist
+# Round-trips are counted from a libpq protocol trace (one per Sync or simple Query message).
+# The embedding call for a brand-new memory doc is the same in both paths and not measured:
+# a matching memory doc is seeded, as for a user repeating a search.
+ITERATIONS = int(os.getenv("BENCH_ITERATIONS", "50"))
+TRACE_ITERATIONS = int(os.getenv("BENCH_TRACE_ITERATIONS", "5"))
+CASE_FILE = os.getenv("EVAL_CASES", "scripts/eval_dualrate_cases.jsonl")
+REPORT_FILE = os.getenv("EVAL_OUT", "scripts/eval_dualrate_report.json")
+OUT_FILE = os.getenv("BENCH_OUT", "scripts/bench_plan_persist_report.json")
+
+
+def percentile(values: List[float], pct: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def load_sample() -> Dict[str, Any]:
+    with open(CASE_FILE, "r", encoding="utf-8") as f:
+        query = json.loads(next(line for line in f if line.strip()))
+    result: Dict[str, Any] = {"top_destinations": [], "daily_plan": [], "budget_breakdown": {}, "warnings": []}
+    try:
+        with open(REPORT_FILE, "r", encoding="utf-8") as f:
+            report = json.load(f)
+        bodies = [r.get("response") for r in report.get("runs") or report.get("results") or []]
+        result = next((b for b in bodies if isinstance(b, dict) and b.get("daily_plan")), result)
+    except (OSError, ValueError):
+        pass
+    return {"query": query, "result": result}
+
+
+def prefs_from(query: Dict[str, Any]) -> Dict[str, Any]:
+    keys = ("origin", "destination", "travelers", "budget_min", "budget_max", "budget_text", "preferences", "pace", "constraints")
+    return {key: query.get(key) for key in keys}
+
+
+async def seed_memory(user_id: str, content: str) -> None:
+    pool = await db.get_pool()
+    async with pool.connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(
+                """
+                select atttypmod from pg_attribute
+                where attrelid = 'user_memory_docs'::regclass and attname = 'embedding'
+                """
+            )
+            dims = (await cur.fetchone())[0]
+    await db.save_user_memory_doc(user_id, "bench", "bench", content, [1.0] + [0.0] * (dims - 1))
+
+
+async def count_round_trips(run: Callable[[], Awaitable[None]], iterations: int) -> float:
+    pool = await db.get_pool()
+    with tempfile.TemporaryFile("w+") as trace:
+        async with pool.connection() as conn:
+            pgconn = conn.pgconn
+        pgconn.trace(trace.fileno())
+        pgconn.set_trace_flags(Trace.SUPPRESS_TIMESTAMPS | Trace.REGRESS_MODE)
+        try:
+            for _ in range(iterations):
+                await run()
+        finally:
+            pgconn.untrace()
+        trace.seek(0)
+        messages = [line.split("\t") for line in trace]
+    return sum(1 for m in messages if m[0] == "F" and len(m) > 2 and m[2].startswith(("Sync", "Query"))) / iterations
+
+
+async def time_path(run: Callable[[], Awaitable[None]]) -> List[float]:
+    samples = []
+    for _ in range(ITERATIONS):
+        started = time.perf_counter()
+        await run()
+        samples.append((time.perf_counter() - started) * 1000)
+    return samples
+
+
+async def main() -> None:
+    await db.open_pool()
+    pool = await db.get_pool()
+    if pool is None:
+        raise RuntimeError("DATABASE_URL not set")
+
+    email = f"bench-{secrets.token_hex(4)}@example.invalid"
+    await db.create_user(email, secrets.token_hex(8))
+    user_id = str((await db.get_user_by_email(email))["id"])
+    sample = load_sample()
+    query, result = sample["query"], sample["result"]
+    prefs = prefs_from(query)
+    body = json.dumps(result, ensure_ascii=False).encode("utf-8")
+    _, content = memory_doc_from_plan(query, result)
+    await seed_memory(user_id, content)
+
+    async def legacy() -> None:
+        await db.save_preferences(user_id, prefs)
+        await db.save_plan(user_id, body)
+        await db.save_search_history(user_id, query, body)
+        await db.touch_user_memory_doc(user_id, content)
+
+    async def pipelined() -> None:
+        await db.save_plan_result(user_id, prefs, query, result, body, memory_content=content)
+
+    try:
+        rows = []
+        for name, run in (("legacy", legacy), ("pipelined", pipelined)):
+            await run()  # warm-up (and prefs cache for the pipelined path)
+            samples = await time_path(run)
+            rows.append(
+                {
+                    "path": name,
+                    "iterations": ITERATIONS,
+                    "round_trips_per_plan": await count_round_trips(run, TRACE_ITERATIONS),
+                    "wall_ms_p50": round(percentile(samples, 50), 2),
+                    "wall_ms_p95": round(percentile(samples, 95), 2),
+                    "wall_ms_mean": round(statistics.fmean(samples), 2),
+                }
+            )
+            r = rows[-1]
+            print(
+                f"[bench] {name:<9} round_trips={r['round_trips_per_plan']:<5} "
+                f"p50={r['wall_ms_p50']}ms p95={r['wall_ms_p95']}ms"
+            )
+    finally:
+        async with pool.connection() as conn:
+            await conn.execute("delete from users where id=%s", (user_id,))
+        await db.close_pool()
+
+    report = {"body_bytes": len(body), "results": rows}
+    with open(OUT_FILE, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"saved: {OUT_FILE}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,98 @@
+import asyncio
+import json
+import os
+import statistics
+import time
+from typing import Any, Dict, List
+
+from dotenv import load_dotenv
+
+# Load .env before importing db module, because db reads env on import.
+load_dotenv()
+
+from app import db
+
+# Pool saturation load test: N concurrent "requests" each hold a pooled connection
+# for QUERY_MS, like the post-plan writes and RAG queries that overlap in /api/plan.
+#   cd backend && DB_POOL_MAX_SIZE=5 python -m scripts.bench_pool_saturation
+CONCURRENCY = [int(c) for c in os.getenv("BENCH_CONCURRENCY", "1,2,5,10,20,50").split(",") if c.strip()]
+REQUESTS_PER_LEVEL = int(os.getenv("BENCH_REQUESTS", "200"))
+QUERY_MS = float(os.getenv("BENCH_QUERY_MS", "20"))
+OUT_FILE = os.getenv("BENCH_OUT", "scripts/bench_pool_saturation_report.json")
+
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+async def one_request(pool, waits: List[float], errors: List[str]) -> None:
+    t0 = time.perf_counter()
+    try:
+        async with pool.connection() as conn:
+            waits.append((time.perf_counter() - t0) * 1000)
+            await conn.execute("select pg_sleep(%s)", (QUERY_MS / 1000,))
+    except Exception as exc:
+        errors.append(type(exc).__name__)
+
+
+async def run_level(pool, concurrency: int) -> Dict[str, Any]:
+    waits: List[float] = []
+    errors: List[str] = []
+    sem = asyncio.Semaphore(concurrency)
+
+    async def guarded() -> None:
+        async with sem:
+            await one_request(pool, waits, errors)
+
+    pool.pop_stats()
+    t0 = time.perf_counter()
+    await asyncio.gather(*(guarded() for _ in range(REQUESTS_PER_LEVEL)))
+    elapsed = time.perf_counter() - t0
+    stats = pool.pop_stats()
+    return {
+        "concurrency": concurrency,
+        "requests": REQUESTS_PER_LEVEL,
+        "throughput_rps": round(REQUESTS_PER_LEVEL / elapsed, 1),
+        "wait_ms_p50": round(percentile(waits, 50), 2),
+        "wait_ms_p95": round(percentile(waits, 95), 2),
+        "wait_ms_max": round(max(waits) if waits else 0.0, 2),
+        "wait_ms_mean": round(statistics.fmean(waits), 2) if waits else 0.0,
+        "queued": stats.get("requests_queued", 0),
+        "timeouts": errors.count("PoolTimeout"),
+        "errors": len(errors),
+    }
+
+
+async def main() -> None:
+    await db.open_pool()
+    pool = await db.get_pool()
+    if pool is None:
+        raise RuntimeError("DATABASE_URL not set")
+    rows = []
+    for concurrency in CONCURRENCY:
+        row = await run_level(pool, concurrency)
+        rows.append(row)
+        print(
+            f"[bench] concurrency={concurrency:<3} rps={row['throughput_rps']:<7} "
+            f"wait_p50={row['wait_ms_p50']}ms wait_p95={row['wait_ms_p95']}ms "
+            f"queued={row['queued']} timeouts={row['timeouts']}"
+        )
+    report = {
+        "pool_min_size": db.DB_POOL_MIN_SIZE,
+        "pool_max_size": db.DB_POOL_MAX_SIZE,
+        "pool_timeout_seconds": db.DB_POOL_TIMEOUT_SECONDS,
+        "query_ms": QUERY_MS,
+        "results": rows,
+    }
+    with open(OUT_FILE, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"saved: {OUT_FILE}")
+    await db.close_pool()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
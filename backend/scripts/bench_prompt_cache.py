@@ -0,0 +1,217 @@
+import json
+import os
+import statistics
+import time
+from typing import Any, Dict, List, Tuple
+
+import httpx
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from app.llm import _format_schema, _integrator_system, _with_language
+from app.prompts import INTEGRATOR_USER, PLANNER_SYSTEM, PLANNER_USER
+
+# Time-to-first-token, cached prompt tokens and cost: legacy prompt layout vs. static-prefix layout.
+#   cd backend && python -m scripts.bench_prompt_cache
+# Each case runs BENCH_REPEAT times per layout, interleaved so both see the same provider load.
+CASE_FILE = os.getenv("EVAL_CASES", "scripts/eval_dualrate_cases.jsonl")
+OUT_FILE = os.getenv("BENCH_OUT", "scripts/bench_prompt_cache_report.json")
+REPEAT = int(os.getenv("BENCH_REPEAT", "3"))
+PRICE_INPUT = float(os.getenv("LLM_PRICE_INPUT_PER_MTOK", "0.15"))
+PRICE_CACHED = float(os.getenv("LLM_PRICE_CACHED_INPUT_PER_MTOK", "0.075"))
+PRICE_OUTPUT = float(os.getenv("LLM_PRICE_OUTPUT_PER_MTOK", "0.60"))
+
+# Layout before the prefix-cache change: language formatted into the system prompt, and the
+# integrator schema placed after the per-request plan JSON.
+LEGACY_PLANNER_SYSTEM = """
+You are the Planner Agent. Your job is to create a feasible travel plan outline.
+Rules:
+1) Use only the user input.
+2) Output JSON only.
+3) Keep structure minimal: summary + daily skeleton.
+4) Output must be in {language}, even if sources are in another language.
+"""
+
+LEGACY_PLANNER_USER = PLANNER_USER + """
+Output JSON with:
+- summary (string)
+- daily_skeleton (list of day entries: day, theme, highlights)
+"""
+
+LEGACY_INTEGRATOR_SYSTEM = """
+You are the Integrator Agent. Your job is to merge planner + budget + risk outputs.
+Rules:
+1) Output strict JSON for the final response schema.
+2) Resolve conflicts and apply fixes.
+3) Output must be in {language}, even if sources are in another language.
+"""
+
+LEGACY_INTEGRATOR_USER = """
+Inputs:
+- plan_skeleton: {plan_skeleton}
+- budget_info: {budget_info}
+- risk_info: {risk_info}
+- schema: {schema}
+
+Rules:
+- If a destination was provided, the daily_plan must be for that destination.
+- top_destinations must include exactly 3 alternative destinations and must NOT include the provided destination.
+
+Return final JSON that matches the schema exactly.
+Output must be in {language}.
+"""
+
+
+def llm_config() -> Tuple[str, str, str]:
+    api_key = os.getenv("LLM_API_KEY", "").strip()
+    if not api_key:
+        raise RuntimeError("LLM_API_KEY not set")
+    provider = os.getenv("LLM_PROVIDER", "openai").strip().lower()
+    default_base = "https://models.github.ai/inference" if provider == "github" else "https://api.openai.com/v1"
+    api_base = os.getenv("LLM_API_BASE", default_base).strip()
+    model = os.getenv("LLM_MODEL", "gpt-4o-mini").strip()
+    return api_base, api_key, model
+
+
+def load_cases() -> List[Dict[str, Any]]:
+    with open(CASE_FILE, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def language_of(case: Dict[str, Any]) -> str:
+    return "English" if str(case.get("language") or "").lower().startswith("en") else "Chinese"
+
+
+def planner_fields(case: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "origin": case.get("origin") or "???",
+        "destination": case.get("destination") or "???",
+        "start_date": case.get("start_date"),
+        "days": case.get("days"),
+        "travelers": case.get("travelers") or 1,
+        "budget": case.get("budget_text") or "???",
+        "preferences": "?".join(case.get("preferences") or []) or "?",
+        "pace": case.get("pace") or "??",
+        "constraints": "?".join(case.get("constraints") or []) or "?",
+    }
+
+
+def stream_call(client: httpx.Client, system: str, user: str) -> Dict[str, Any]:
+    api_base, api_key, model = llm_config()
+    payload = {
+        "model": model,
+        "messages": [{"role": "system", "content": system}, {"role": "user", "content": user}],
+        "temperature": 0.2,
+        "response_format": {"type": "json_object"},
+        "stream": True,
+        "stream_options": {"include_usage": True},
+    }
+    started = time.perf_counter()
+    ttft = None
+    usage: Dict[str, Any] = {}
+    content: List[str] = []
+    with client.stream(
+        "POST",
+        f"{api_base.rstrip('/')}/chat/completions",
+        headers={"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"},
+        json=payload,
+    ) as resp:
+        resp.raise_for_status()
+        for line in resp.iter_lines():
+            if not line.startswith("data: ") or line == "data: [DONE]":
+                continue
+            chunk = json.loads(line[6:])
+            for choice in chunk.get("choices") or []:
+                delta = (choice.get("delta") or {}).get("content")
+                if delta:
+                    if ttft is None:
+                        ttft = time.perf_counter() - started
+                    content.append(delta)
+            if chunk.get("usage"):
+                usage = chunk["usage"]
+    prompt_tokens = usage.get("prompt_tokens") or 0
+    cached = (usage.get("prompt_tokens_details") or {}).get("cached_tokens") or 0
+    completion = usage.get("completion_tokens") or 0
+    cost = ((prompt_tokens - cached) * PRICE_INPUT + cached * PRICE_CACHED + completion * PRICE_OUTPUT) / 1_000_000
+    return {
+        "ttft_ms": int((ttft or 0) * 1000),
+        "total_ms": int((time.perf_counter() - started) * 1000),
+        "prompt_tokens": prompt_tokens,
+        "cached_tokens": cached,
+        "completion_tokens": completion,
+        "cost_usd": cost,
+        "content": "".join(content),
+    }
+
+
+def build_messages(layout: str, stage: str, case: Dict[str, Any], skeleton: str) -> Tuple[str, str]:
+    language = language_of(case)
+    if stage == "planner":
+        fields = planner_fields(case)
+        if layout == "legacy":
+            return LEGACY_PLANNER_SYSTEM.format(language=language), LEGACY_PLANNER_USER.format(**fields)
+        return PLANNER_SYSTEM, _with_language(PLANNER_USER.format(**fields), language)
+    inputs = {"plan_skeleton": skeleton, "budget_info": "{}", "risk_info": "{}"}
+    if layout == "legacy":
+        return (
+            LEGACY_INTEGRATOR_SYSTEM.format(language=language),
+            LEGACY_INTEGRATOR_USER.format(**inputs, schema=_format_schema(), language=language),
+        )
+    return _integrator_system(), _with_language(INTEGRATOR_USER.format(**inputs), language)
+
+
+def summarize(rows: List[Dict[str, Any]]) -> Dict[str, Any]:
+    prompt = sum(r["prompt_tokens"] for r in rows)
+    return {
+        "calls": len(rows),
+        "ttft_p50_ms": int(statistics.median(r["ttft_ms"] for r in rows)),
+        "total_p50_ms": int(statistics.median(r["total_ms"] for r in rows)),
+        "prompt_tokens": prompt,
+        "cached_tokens": sum(r["cached_tokens"] for r in rows),
+        "cached_ratio": round(sum(r["cached_tokens"] for r in rows) / prompt, 3) if prompt else 0.0,
+        "cost_usd": round(sum(r["cost_usd"] for r in rows), 6),
+    }
+
+
+def main() -> None:
+    cases = load_cases()
+    if not cases:
+        raise RuntimeError("no eval cases")
+    samples: Dict[Tuple[str, str], List[Dict[str, Any]]] = {}
+    with httpx.Client(timeout=120) as client:
+        for idx, case in enumerate(cases, start=1):
+            # One unmeasured planner call provides a realistic skeleton for the integrator stage.
+            system, user = build_messages("prefix", "planner", case, "")
+            skeleton = stream_call(client, system, user)["content"]
+            for _ in range(REPEAT):
+                for stage in ("planner", "integrator"):
+                    for layout in ("legacy", "prefix"):
+                        system, user = build_messages(layout, stage, case, skeleton)
+                        row = stream_call(client, system, user)
+                        row.pop("content")
+                        samples.setdefault((stage, layout), []).append(row)
+            print(f"[case {idx}] done")
+
+    results = []
+    for (stage, layout), rows in sorted(samples.items()):
+        results.append({"stage": stage, "layout": layout, **summarize(rows)})
+        r = results[-1]
+        print(
+            f"[bench] {stage:<10} {layout:<6} ttft_p50={r['ttft_p50_ms']}ms "
+            f"cached={r['cached_ratio']:.0%} cost=${r['cost_usd']:.4f}"
+        )
+
+    report = {
+        "case_count": len(cases),
+        "repeat": REPEAT,
+        "prices_per_mtok": {"input": PRICE_INPUT, "cached_input": PRICE_CACHED, "output": PRICE_OUTPUT},
+        "results": results,
+    }
+    with open(OUT_FILE, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"saved: {OUT_FILE}")
+
+
+if __name__ == "__main__":
+    main()
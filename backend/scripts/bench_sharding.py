@@ -0,0 +1,121 @@
+import asyncio
+import json
+import os
+import statistics
+import time
+from typing import Any, Dict, List
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from app import logs
+from app.http_clients import close_all
+from app.llm import generate_plan_with_llm
+from app.schemas import PlanRequest
+from app.settings import get_settings
+
+# Single-completion vs. day-sharded generation for short, medium and long trips.
+#   cd backend && python -m scripts.bench_sharding
+# Runs the real pipeline in process; sharding is toggled through a settings override.
+OUT_FILE = os.getenv("BENCH_OUT", "scripts/bench_sharding_report.json")
+REPEAT = int(os.getenv("BENCH_REPEAT", "2"))
+DAYS = [int(d) for d in os.getenv("BENCH_DAYS", "3,10,30").split(",") if d.strip()]
+DESTINATION = os.getenv("BENCH_DESTINATION", "Kyoto")
+LANGUAGE = os.getenv("BENCH_LANGUAGE", "en")
+
+
+async def run_once(req: PlanRequest, sharded: bool) -> Dict[str, Any]:
+    base = get_settings()
+    settings = base.model_copy(update={"plan_shard_min_days": 1 if sharded else 0})
+    token = logs.begin_request(f"bench-{'sharded' if sharded else 'single'}-{req.days}")
+    started = time.perf_counter()
+    error = None
+    days_ok = False
+    outline_days = 0
+    try:
+        result = await generate_plan_with_llm(req, settings=settings)
+        days_ok = [d.day for d in result.daily_plan] == list(range(1, req.days + 1))
+        # Days that fell back to the skeleton keep the pending marker as their transport.
+        outline_days = sum(1 for d in result.daily_plan if d.morning.transport in ("TBD", "待定"))
+    except Exception as exc:
+        error = str(exc)
+    elapsed = time.perf_counter() - started
+    ctx = logs.end_request(token)
+    llm = ctx.get("llm") or {}
+    return {
+        "ok": error is None and days_ok,
+        "error": error,
+        "latency_ms": int(elapsed * 1000),
+        "outline_days": outline_days,
+        "calls": sum(v["calls"] for v in llm.values()),
+        "prompt_tokens": sum(v["prompt_tokens"] for v in llm.values()),
+        "completion_tokens": sum(v["completion_tokens"] for v in llm.values()),
+    }
+
+
+def summarize(rows: List[Dict[str, Any]]) -> Dict[str, Any]:
+    latencies = [r["latency_ms"] for r in rows]
+    return {
+        "runs": len(rows),
+        "success_rate": round(sum(1 for r in rows if r["ok"]) / len(rows), 3),
+        "latency_p50_ms": int(statistics.median(latencies)),
+        "latency_max_ms": max(latencies),
+        "outline_days": sum(r["outline_days"] for r in rows),
+        "calls_avg": round(sum(r["calls"] for r in rows) / len(rows), 1),
+        "prompt_tokens_avg": int(sum(r["prompt_tokens"] for r in rows) / len(rows)),
+        "completion_tokens_avg": int(sum(r["completion_tokens"] for r in rows) / len(rows)),
+        "errors": [r["error"] for r in rows if r["error"]],
+    }
+
+
+async def run() -> Dict[str, Any]:
+    results = []
+    for days in DAYS:
+        req = PlanRequest(
+            origin="Shanghai",
+            destination=DESTINATION,
+            start_date="2026-04-01",
+            days=days,
+            travelers=2,
+            budget_text="mid-range",
+            preferences=["culture", "food"],
+            language=LANGUAGE,
+        )
+        samples: Dict[str, List[Dict[str, Any]]] = {"single": [], "sharded": []}
+        # Interleaved so both modes see the same provider load.
+        for _ in range(REPEAT):
+            for mode in ("single", "sharded"):
+                samples[mode].append(await run_once(req, sharded=mode == "sharded"))
+        for mode, rows in samples.items():
+            results.append({"days": days, "mode": mode, **summarize(rows)})
+            r = results[-1]
+            print(
+                f"[bench] days={days:<3} {mode:<7} ok={r['success_rate']:.0%} "
+                f"p50={r['latency_p50_ms']}ms completion_tokens={r['completion_tokens_avg']}"
+            )
+    settings = get_settings()
+    return {
+        "repeat": REPEAT,
+        "shard_days": settings.plan_shard_days,
+        "shard_concurrency": settings.plan_shard_concurrency,
+        "results": results,
+    }
+
+
+async def run_and_close() -> Dict[str, Any]:
+    try:
+        return await run()
+    finally:
+        await close_all()
+
+
+def main() -> None:
+    report = asyncio.run(run_and_close())
+    with open(OUT_FILE, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"saved: {OUT_FILE}")
+
+
+if __name__ == "__main__":
+    main()
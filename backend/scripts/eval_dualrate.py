@@ -1,14 +1,35 @@
+import asyncio
 import json
 import os
+import statistics
 import time
-from typing import Dict, Any, List
+from typing import Any, Dict, List
 
-import httpx
+from dotenv import load_dotenv
 
+load_dotenv()
 
-API_BASE = os.getenv("EVAL_API_BASE", "http://127.0.0.1:8000")
-CASE_FILE = os.getenv("EVAL_CASES", "backend/scripts/eval_dualrate_cases.jsonl")
-OUT_FILE = os.getenv("EVAL_OUT", "backend/scripts/eval_dualrate_report.json")
+from app import deadline, logs
+from app.http_clients import close_all
+from app.llm import generate_plan_with_llm
+from app.responses import dumps
+from app.schemas import PlanRequest
+from app.settings import Settings, get_settings
+
+# A/B evaluation of pipeline flag sets over the eval cases, run in process.
+#   cd backend && python -m scripts.eval_dualrate
+# EVAL_CONFIGS maps a config name to settings overrides (env names or field names), e.g.
+#   {"baseline": {}, "dual_rate": {"DUAL_RATE_ENABLED": true}, "sharded": {"PLAN_SHARD_MIN_DAYS": 1}}
+# Every case runs EVAL_REPEAT times per config, interleaved, at most EVAL_CONCURRENCY at once.
+# Overrides apply to what the pipeline reads from its settings argument (stage flags, RAG,
+# sharding, degradation); keep EVAL_CONCURRENCY below DEGRADE_INFLIGHT_THRESHOLD or load
+# shedding will skew the comparison.
+CASE_FILE = os.getenv("EVAL_CASES", "scripts/eval_dualrate_cases.jsonl")
+OUT_FILE = os.getenv("EVAL_OUT", "scripts/eval_dualrate_report.json")
+CONFIGS = json.loads(os.getenv("EVAL_CONFIGS", '{"baseline": {}, "dual_rate": {"DUAL_RATE_ENABLED": true}}'))
+CONCURRENCY = max(1, int(os.getenv("EVAL_CONCURRENCY", "2")))
+REPEAT = max(1, int(os.getenv("EVAL_REPEAT", "1")))
+SAVE_BODIES = os.getenv("EVAL_SAVE_BODIES", "false").strip().lower() == "true"
 
 
 def load_cases(path: str) -> List[Dict[str, Any]]:
@@ -22,36 +43,122 @@ def load_cases(path: str) -> List[Dict[str, Any]]:
     return cases
 
 
-def main() -> None:
+def build_settings(base: Settings, overrides: Dict[str, Any]) -> Settings:
+    fields = {key.lower(): value for key, value in overrides.items()}
+    unknown = sorted(set(fields) - set(Settings.model_fields))
+    if unknown:
+        raise RuntimeError(f"unknown settings in EVAL_CONFIGS: {', '.join(unknown)}")
+    # Validated (not model_copy) so "true" / "8" strings are coerced like environment values.
+    return Settings.model_validate({**base.model_dump(), **fields})
+
+
+def percentile(values: List[int], pct: float) -> int:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+async def run_once(name: str, settings: Settings, case_id: int, payload: Dict[str, Any], rep: int) -> Dict[str, Any]:
+    token = logs.begin_request(f"eval-{name}-{case_id}-{rep}")
+    started = time.perf_counter()
+    row: Dict[str, Any] = {"config": name, "case_id": case_id, "rep": rep, "status": "ok", "error": None}
+    body = None
+    try:
+        with deadline.scope(settings.plan_deadline_seconds):
+            req = PlanRequest.model_validate(payload)
+            result = await generate_plan_with_llm(req, settings=settings)
+        body = result.model_dump(mode="json")
+        row["output_bytes"] = len(dumps(body))
+        row["days_ok"] = [d.day for d in result.daily_plan] == list(range(1, req.days + 1))
+        row["warnings"] = len(result.warnings)
+    except deadline.DeadlineExceeded as exc:
+        row.update(status="timeout", error=f"deadline exceeded at {exc.stage}")
+    except Exception as exc:
+        row.update(status="invalid" if "output invalid" in str(exc) else "error", error=str(exc))
+    row["latency_ms"] = int((time.perf_counter() - started) * 1000)
+    llm = logs.end_request(token).get("llm") or {}
+    row["calls"] = sum(v["calls"] for v in llm.values())
+    row["prompt_tokens"] = sum(v["prompt_tokens"] for v in llm.values())
+    row["cached_tokens"] = sum(v["cached_tokens"] for v in llm.values())
+    row["completion_tokens"] = sum(v["completion_tokens"] for v in llm.values())
+    if SAVE_BODIES:
+        row["response"] = body
+    print(f"[{name} case {case_id} rep {rep}] {row['status']} latency={row['latency_ms']}ms")
+    return row
+
+
+def summarize(rows: List[Dict[str, Any]]) -> Dict[str, Any]:
+    ok = [r for r in rows if r["status"] == "ok"]
+    latencies = [r["latency_ms"] for r in ok]
+    sizes = [r["output_bytes"] for r in ok]
+    return {
+        "runs": len(rows),
+        "ok": len(ok),
+        "validation_failure_rate": round(sum(1 for r in rows if r["status"] == "invalid") / len(rows), 3),
+        "timeout_rate": round(sum(1 for r in rows if r["status"] == "timeout") / len(rows), 3),
+        "error_rate": round(sum(1 for r in rows if r["status"] == "error") / len(rows), 3),
+        "day_mismatch": sum(1 for r in ok if not r["days_ok"]),
+        "with_warnings": sum(1 for r in ok if r["warnings"]),
+        "latency_p50_ms": percentile(latencies, 50) if latencies else None,
+        "latency_p95_ms": percentile(latencies, 95) if latencies else None,
+        "calls_avg": round(statistics.mean(r["calls"] for r in rows), 1),
+        "prompt_tokens_avg": int(statistics.mean(r["prompt_tokens"] for r in rows)),
+        "cached_tokens_avg": int(statistics.mean(r["cached_tokens"] for r in rows)),
+        "completion_tokens_avg": int(statistics.mean(r["completion_tokens"] for r in rows)),
+        "output_bytes_p50": percentile(sizes, 50) if sizes else None,
+        "output_bytes_max": max(sizes) if sizes else None,
+    }
+
+
+async def run() -> Dict[str, Any]:
     cases = load_cases(CASE_FILE)
-    results = []
-    with httpx.Client(timeout=120) as client:
-        for idx, payload in enumerate(cases, start=1):
-            t0 = time.perf_counter()
-            resp = client.post(f"{API_BASE}/api/plan", json=payload)
-            latency_ms = int((time.perf_counter() - t0) * 1000)
-            ok = resp.status_code == 200
-            body = {}
-            try:
-                body = resp.json()
-            except Exception:
-                body = {"_raw": resp.text}
-            results.append(
-                {
-                    "case_id": idx,
-                    "status_code": resp.status_code,
-                    "ok": ok,
-                    "latency_ms": latency_ms,
-                    "response": body,
-                }
-            )
-            print(f"[case {idx}] status={resp.status_code} latency={latency_ms}ms")
-
-    report = {
-        "api_base": API_BASE,
+    if not cases:
+        raise RuntimeError("no eval cases")
+    base = get_settings()
+    configs = {name: build_settings(base, overrides or {}) for name, overrides in CONFIGS.items()}
+    gate = asyncio.Semaphore(CONCURRENCY)
+
+    async def _gated(name: str, case_id: int, payload: Dict[str, Any], rep: int) -> Dict[str, Any]:
+        async with gate:
+            return await run_once(name, configs[name], case_id, payload, rep)
+
+    # Interleaved (rep, case, config) so every config sees the same provider load over time.
+    rows = await asyncio.gather(
+        *(
+            _gated(name, case_id, payload, rep)
+            for rep in range(1, REPEAT + 1)
+            for case_id, payload in enumerate(cases, start=1)
+            for name in configs
+        )
+    )
+
+    summary = {}
+    for name in configs:
+        summary[name] = summarize([r for r in rows if r["config"] == name])
+        s = summary[name]
+        print(
+            f"[eval] {name:<12} ok={s['ok']}/{s['runs']} invalid={s['validation_failure_rate']:.0%} "
+            f"p50={s['latency_p50_ms']}ms p95={s['latency_p95_ms']}ms "
+            f"tokens={s['prompt_tokens_avg']}+{s['completion_tokens_avg']} size_p50={s['output_bytes_p50']}B"
+        )
+    return {
         "case_count": len(cases),
-        "results": results,
+        "repeat": REPEAT,
+        "concurrency": CONCURRENCY,
+        "configs": CONFIGS,
+        "summary": summary,
+        "runs": rows,
     }
+
+
+async def run_and_close() -> Dict[str, Any]:
+    try:
+        return await run()
+    finally:
+        await close_all()
+
+
+def main() -> None:
+    report = asyncio.run(run_and_close())
     with open(OUT_FILE, "w", encoding="utf-8") as f:
         json.dump(report, f, ensure_ascii=False, indent=2)
     print(f"saved: {OUT_FILE}")
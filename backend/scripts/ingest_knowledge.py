@@ -32,6 +32,9 @@ def embed_text(text: str) -> List[float]:
         "model": model,
         "input": text,
     }
+    dimensions = os.getenv("EMBEDDING_DIMENSIONS", "").strip()
+    if dimensions:
+        payload["dimensions"] = int(dimensions)
 
     with httpx.Client(timeout=30) as client:
         resp = client.post(url, headers=headers, json=payload)
@@ -63,9 +66,9 @@ def upsert_doc(title: str, source: str, content: str) -> None:
     with pool.connection() as conn:
         with conn.cursor() as cur:
             cur.execute(
-                """
+                f"""
                 insert into knowledge_docs (title, source, content, embedding)
-                values (%s, %s, %s, %s::vector)
+                values (%s, %s, %s, %s::{db.EMBEDDING_STORAGE})
                 """,
                 (title, source, content, vector),
             )
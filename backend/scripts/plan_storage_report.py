@@ -0,0 +1,116 @@
+import asyncio
+import json
+import os
+from typing import Any, Dict
+
+from dotenv import load_dotenv
+
+# Load .env before importing db module, because db reads env on import.
+load_dotenv()
+
+from app import db
+
+# Storage used by plan results (migrations/007_plan_results.sql): logical bytes (one copy per
+# plan / history reference, as the inline JSONB columns stored them) vs. bytes actually stored.
+#   cd backend && python -m scripts.plan_storage_report
+# With STORAGE_RECOMPRESS=true, rows still stored as JSONB (e.g. backfilled by the migration)
+# are first rewritten as zstd in batches of STORAGE_BATCH_SIZE; needs the zstandard package.
+RECOMPRESS = os.getenv("STORAGE_RECOMPRESS", "false").strip().lower() == "true"
+BATCH_SIZE = int(os.getenv("STORAGE_BATCH_SIZE", "200"))
+ZSTD_LEVEL = int(os.getenv("PLAN_RESULT_ZSTD_LEVEL", "6"))
+OUT_FILE = os.getenv("BENCH_OUT", "scripts/plan_storage_report.json")
+
+
+async def recompress(pool) -> int:
+    if db.zstandard is None:
+        raise RuntimeError("zstandard not installed")
+    compressor = db.zstandard.ZstdCompressor(level=ZSTD_LEVEL)
+    total = 0
+    while True:
+        # One short transaction per batch; rows stay readable throughout.
+        async with pool.connection() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(
+                    """
+                    select hash, data::text from plan_results
+                    where encoding = 'json'
+                    limit %s
+                    for update skip locked
+                    """,
+                    (BATCH_SIZE,),
+                )
+                rows = await cur.fetchall()
+                if rows:
+                    await cur.executemany(
+                        "update plan_results set encoding='zstd', blob=%s, data=null where hash=%s",
+                        [(compressor.compress(text.encode("utf-8")), hash_) for hash_, text in rows],
+                    )
+        total += len(rows)
+        print(f"[recompress] {total} rows")
+        if len(rows) < BATCH_SIZE:
+            return total
+
+
+async def report(pool) -> Dict[str, Any]:
+    async with pool.connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(
+                """
+                select
+                    (select count(*) from plan_results),
+                    (select count(*) from plan_results where encoding = 'zstd'),
+                    (select count(*) from user_plans),
+                    (select count(*) from user_search_history),
+                    (select coalesce(sum(r.raw_bytes), 0) from user_plans u join plan_results r on r.hash = u.result_hash)
+                      + (select coalesce(sum(r.raw_bytes), 0) from user_search_history h join plan_results r on r.hash = h.result_hash),
+                    (select coalesce(sum(raw_bytes), 0) from plan_results),
+                    (select coalesce(sum(coalesce(pg_column_size(data), 0) + coalesce(pg_column_size(blob), 0)), 0) from plan_results),
+                    pg_total_relation_size('plan_results'),
+                    pg_total_relation_size('user_plans'),
+                    pg_total_relation_size('user_search_history')
+                """
+            )
+            row = await cur.fetchone()
+    (results, zstd_rows, plans, history, logical, unique_raw, stored, results_table, plans_table, history_table) = row
+    return {
+        "plan_results": results,
+        "zstd_rows": zstd_rows,
+        "references": {"user_plans": plans, "user_search_history": history},
+        # Raw JSON bytes, one copy per reference: what the inline columns held before 007.
+        "logical_bytes": logical,
+        "unique_raw_bytes": unique_raw,
+        "stored_value_bytes": stored,
+        "dedup_ratio": round(logical / unique_raw, 2) if unique_raw else None,
+        "compression_ratio": round(unique_raw / stored, 2) if stored else None,
+        "saved_bytes": logical - stored,
+        "table_bytes": {
+            "plan_results": results_table,
+            "user_plans": plans_table,
+            "user_search_history": history_table,
+        },
+    }
+
+
+async def main() -> None:
+    pool = await db.get_pool()
+    if pool is None:
+        raise RuntimeError("DATABASE_URL not set")
+    try:
+        result: Dict[str, Any] = {}
+        if RECOMPRESS:
+            result["recompressed"] = await recompress(pool)
+        result.update(await report(pool))
+    finally:
+        await db.close_pool()
+    print(
+        f"[storage] results={result['plan_results']} logical={result['logical_bytes']}B "
+        f"stored={result['stored_value_bytes']}B saved={result['saved_bytes']}B "
+        f"dedup={result['dedup_ratio']}x compression={result['compression_ratio']}x"
+    )
+    with open(OUT_FILE, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+    print(f"saved: {OUT_FILE}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
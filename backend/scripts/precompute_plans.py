@@ -0,0 +1,72 @@
+import asyncio
+import json
+import os
+from typing import Any, Dict
+
+from dotenv import load_dotenv
+
+# Load .env before importing db module, because db reads env on import.
+load_dotenv()
+
+from app import db, plan_cache
+from app.http_clients import close_all
+from app.settings import get_settings
+
+# One precompute run now, regardless of PLAN_PRECOMPUTE_HOURS (e.g. to fill an empty cache
+# after deploying migrations/008_plan_cache.sql). Uses the same lock as the plan_precompute
+# job, so it never overlaps a run of a live instance.
+#   cd backend && python -m scripts.precompute_plans
+# With PRECOMPUTE_DRY_RUN=true only the mined candidates are reported; nothing is generated.
+DRY_RUN = os.getenv("PRECOMPUTE_DRY_RUN", "false").strip().lower() == "true"
+OUT_FILE = os.getenv("BENCH_OUT", "scripts/precompute_plans_report.json")
+
+
+async def dry_run(settings) -> Dict[str, Any]:
+    popular = plan_cache.mine_popular(
+        await db.recent_search_queries(settings.plan_precompute_lookback_days),
+        settings.plan_precompute_top_n,
+        settings.plan_precompute_min_count,
+    )
+    fresh = await db.fresh_plan_cache_keys([key for key, _, _ in popular], settings.plan_cache_ttl_seconds / 2)
+    return {
+        "candidates": [
+            {"key": key, "count": count, "fresh": key in fresh, "request": plan_cache.canonical_request(query)}
+            for key, query, count in popular
+        ]
+    }
+
+
+async def run() -> Dict[str, Any]:
+    settings = get_settings()
+    if await db.get_pool() is None:
+        raise RuntimeError("DATABASE_URL not set")
+    try:
+        if DRY_RUN:
+            return await dry_run(settings)
+        async with db.advisory_lock("plan_precompute") as locked:
+            if not locked:
+                raise RuntimeError("another precompute run holds the lock")
+            return await plan_cache.precompute(settings, check_window=False)
+    finally:
+        await close_all()
+        await db.close_pool()
+
+
+def main() -> None:
+    result = asyncio.run(run())
+    if DRY_RUN:
+        for row in result["candidates"]:
+            req = row["request"]
+            print(f"[precompute] {row['count']:>4}x {req['origin']} -> {req['destination']} {req['days']}d month={req['month']} fresh={row['fresh']}")
+    else:
+        print(
+            f"[precompute] candidates={result['candidates']} fresh={result['fresh']} generated={result['generated']} "
+            f"failed={result['failed']} degraded={result['degraded']} tokens={result['tokens']} stopped={result['stopped']}"
+        )
+    with open(OUT_FILE, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+    print(f"saved: {OUT_FILE}")
+
+
+if __name__ == "__main__":
+    main()
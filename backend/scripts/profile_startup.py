@@ -0,0 +1,100 @@
+import json
+import os
+import re
+import subprocess
+import sys
+import time
+from typing import Any, Dict, List
+
+import httpx
+
+# Cold-start profile: per-module import time of app.main and time until the first
+# successful request on a fresh uvicorn process.
+#   cd backend && python -m scripts.profile_startup
+TOP_N = int(os.getenv("PROFILE_TOP_N", "25"))
+PORT = int(os.getenv("PROFILE_PORT", "8765"))
+STARTUP_TIMEOUT = float(os.getenv("PROFILE_STARTUP_TIMEOUT", "120"))
+OUT_FILE = os.getenv("PROFILE_OUT", "scripts/profile_startup_report.json")
+
+_IMPORT_LINE = re.compile(r"import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+
+def import_profile() -> Dict[str, Any]:
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import app.main"],
+        capture_output=True,
+        text=True,
+        env={**os.environ, "PYTHONDONTWRITEBYTECODE": "1"},
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr[-2000:])
+    modules: List[Dict[str, Any]] = []
+    for line in proc.stderr.splitlines():
+        match = _IMPORT_LINE.match(line)
+        if not match:
+            continue
+        self_us, cumulative_us, indent, name = match.groups()
+        modules.append(
+            {
+                "module": name,
+                "self_ms": int(self_us) / 1000,
+                "cumulative_ms": int(cumulative_us) / 1000,
+                "top_level": len(indent) <= 1,
+            }
+        )
+    total = next((m["cumulative_ms"] for m in modules if m["module"] == "app.main"), 0.0)
+    top_level = sorted((m for m in modules if m["top_level"]), key=lambda m: m["cumulative_ms"], reverse=True)
+    return {
+        "total_ms": total,
+        "top_level": top_level[:TOP_N],
+        "by_self_time": sorted(modules, key=lambda m: m["self_ms"], reverse=True)[:TOP_N],
+    }
+
+
+def first_request_profile() -> Dict[str, Any]:
+    started = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(PORT), "--log-level", "warning"],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        while time.perf_counter() - started < STARTUP_TIMEOUT:
+            if proc.poll() is not None:
+                raise RuntimeError(f"uvicorn exited with {proc.returncode}")
+            try:
+                resp = httpx.get(f"http://127.0.0.1:{PORT}/health", timeout=1.0)
+                if resp.status_code == 200:
+                    ready = time.perf_counter() - started
+                    t0 = time.perf_counter()
+                    httpx.get(f"http://127.0.0.1:{PORT}/health", timeout=5.0)
+                    return {
+                        "time_to_first_request_ms": int(ready * 1000),
+                        "warm_request_ms": round((time.perf_counter() - t0) * 1000, 2),
+                        "startup_warmup": os.getenv("STARTUP_WARMUP", "true"),
+                    }
+            except httpx.HTTPError:
+                pass
+            time.sleep(0.05)
+        raise RuntimeError("server did not become healthy in time")
+    finally:
+        proc.terminate()
+        proc.wait(timeout=10)
+
+
+def main() -> None:
+    imports = import_profile()
+    print(f"[profile] import app.main: {imports['total_ms']:.1f}ms")
+    for m in imports["top_level"]:
+        print(f"[profile]   {m['cumulative_ms']:>8.1f}ms  {m['module']}")
+    first = first_request_profile()
+    print(f"[profile] time to first request: {first['time_to_first_request_ms']}ms (STARTUP_WARMUP={first['startup_warmup']})")
+
+    report = {"imports": imports, "first_request": first}
+    with open(OUT_FILE, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"saved: {OUT_FILE}")
+
+
+if __name__ == "__main__":
+    main()
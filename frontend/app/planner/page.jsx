@@ -86,12 +86,12 @@ export default function PlannerPage() {
 
   const fetchHistory = async (jwt) => {
     try {
-      const resp = await fetch(`${apiBase}/api/me/search-history`, {
+      const resp = await fetch(`${apiBase}/api/me/search-history?view=summary`, {
         headers: { Authorization: `Bearer ${jwt || token}` }
       });
       if (!resp.ok) return;
-      const items = await resp.json();
-      setHistoryItems(Array.isArray(items) ? items : []);
+      const body = await resp.json();
+      setHistoryItems(Array.isArray(body?.items) ? body.items : []);
     } catch (e) {
       // ignore
     }
@@ -158,7 +158,20 @@ export default function PlannerPage() {
     return filtered.slice(0, 3);
   };
 
-  const applyHistory = (item) => {
+  const fetchHistoryResult = async (itemId) => {
+    try {
+      const resp = await fetch(`${apiBase}/api/me/search-history/${itemId}`, {
+        headers: { Authorization: `Bearer ${token}` }
+      });
+      if (!resp.ok) return null;
+      const body = await resp.json();
+      return body?.result || null;
+    } catch (e) {
+      return null;
+    }
+  };
+
+  const applyHistory = async (item) => {
     const query = item?.query || {};
     setOrigin(query.origin || "");
     setDestination(query.destination || "");
@@ -171,9 +184,16 @@ export default function PlannerPage() {
     setPreferences(query.preferences || []);
     setPace(query.pace || "适中");
     setConstraintsText((query.constraints || []).join(", ") || (lang === "zh" ? DEFAULT_CONSTRAINTS_ZH : DEFAULT_CONSTRAINTS_EN));
-    if (item?.result) {
-      setData(item.result);
-      const nextTop = buildTopDestinations(item.result.top_destinations, query.destination);
+    let result = item?.result;
+    if (!result && item?.id) {
+      result = await fetchHistoryResult(item.id);
+      if (result) {
+        setHistoryItems((prev) => prev.map((entry) => (entry.id === item.id ? { ...entry, result } : entry)));
+      }
+    }
+    if (result) {
+      setData(result);
+      const nextTop = buildTopDestinations(result.top_destinations, query.destination);
       setTopDestinations(nextTop);
       setActiveDestination(query.destination || "");
     }
@@ -434,6 +454,28 @@ export default function PlannerPage() {
     setTimeout(() => win.print(), 400);
   };
 
+  // Warm the backend's retrieval cache while the form is being filled in; the result is not
+  // used here, so failures and 429/skipped answers are ignored.
+  useEffect(() => {
+    if (!token || !destination || loading || !showForm) return undefined;
+    const timer = setTimeout(() => {
+      fetch(`${apiBase}/api/plan/prefetch`, {
+        method: "POST",
+        headers: authHeaders(),
+        body: JSON.stringify({
+          origin: origin || null,
+          destination,
+          start_date: startDate || null,
+          days: days ? Number(days) : null,
+          budget_text: budgetText || null,
+          preferences,
+          constraints: buildConstraints()
+        })
+      }).catch(() => {});
+    }, 800);
+    return () => clearTimeout(timer);
+  }, [token, origin, destination, startDate, days, budgetText, preferences, constraintsText]);
+
   const generatePlan = async (forcedDestination) => {
     if (loading) return;
     setError("");